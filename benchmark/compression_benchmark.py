@@ -0,0 +1,158 @@
+"""
+Benchmark of the compressions of package bundles.
+
+Each package is repackaged with each compression from the files installed by
+its last build (see ``buildall --compression``), and the benchmark reports:
+
+- the size transferred: the bundle, or its precompressed copy, and its .js
+- the load time in the browser from a local server, best of --repeat runs
+- the decompression throughput in the runtime, estimated from the difference
+  with the load time of the uncompressed bundle
+- the estimated load time when the transfer is limited to --bandwidth Mbit/s
+
+Build Pyodide without the build cache, then run e.g.
+
+    python benchmark/compression_benchmark.py scipy pandas sympy
+"""
+
+import argparse
+import functools
+import http.server
+from pathlib import Path
+import sys
+import tempfile
+import threading
+
+sys.path.insert(0, str((Path(__file__).resolve().parents[1])))
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "pyodide-build"))
+
+import conftest  # noqa: E402
+from pyodide_build import buildpkg, serve  # noqa: E402
+from pyodide_build.io import parse_package_config  # noqa: E402
+
+ROOTDIR = Path(__file__).resolve().parents[1]
+
+BROWSERS = {
+    "firefox": conftest.FirefoxWrapper,
+    "chrome": conftest.ChromeWrapper,
+}
+
+
+class QuietHandler(serve.Handler):
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_directory(directory: Path):
+    """Serve a directory in a background thread, and return the server"""
+    httpd = http.server.ThreadingHTTPServer(
+        ("127.0.0.1", 0),
+        functools.partial(QuietHandler, directory=str(directory)),  # type: ignore
+    )
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
+
+
+def time_load(selenium_cls, port, package):
+    """Load a package in a new Pyodide instance and return the load time"""
+    selenium = selenium_cls(port, script_timeout=300)
+    try:
+        return selenium.run_js(
+            f"""
+            let t0 = performance.now();
+            await pyodide.loadPackage({package!r});
+            return (performance.now() - t0) / 1000;
+            """
+        )
+    finally:
+        selenium.driver.quit()
+
+
+def benchmark_package(name, args, serve_dir, port):
+    meta = parse_package_config(args.packages_dir / name / "meta.yaml")
+    install_prefix = buildpkg.find_install_prefix(args.packages_dir / name)
+    if install_prefix is None:
+        print(f"{name}: no installed files, rebuild it without the build cache")
+        return
+    installed = [
+        file.relative_to(install_prefix).as_posix()
+        for file in sorted(install_prefix.rglob("*"))
+        if file.is_file()
+    ]
+    print(name)
+    # The uncompressed bundle is the reference of the other compressions
+    compressions = ["none"] + [c for c in args.compressions if c != "none"]
+    for compression in compressions:
+        for file in serve_dir.glob(name + ".*"):
+            file.unlink()
+        pkg = dict(meta, build=dict(meta.get("build", {}), compression=compression))
+        bundle_args = argparse.Namespace(
+            package_format="data",
+            compression=compression,
+            compile_bytecode=False,
+            strip_sources=False,
+        )
+        try:
+            files = buildpkg.package_installed_subset(
+                pkg, install_prefix, installed, serve_dir, bundle_args
+            )
+        except RuntimeError as e:
+            print(f"  {compression:>8}: {e}")
+            continue
+        # The precompressed copy replaces the bundle in transfers
+        transferred = files[1:] if len(files) > 2 else files
+        size = sum((serve_dir / file).stat().st_size for file in transferred)
+        load_time = min(
+            time_load(BROWSERS[args.browser], port, name) for _ in range(args.repeat)
+        )
+        if compression == "none":
+            uncompressed_size = size
+            uncompressed_time = load_time
+        decode_time = load_time - uncompressed_time
+        throughput = (
+            f"{uncompressed_size / decode_time / 1e6:7.1f} MB/s"
+            if decode_time > 0
+            else "        n/a"
+        )
+        end_to_end = load_time + size * 8 / (args.bandwidth * 1e6)
+        print(
+            f"  {compression:>8}: {size / 1e6:7.2f} MB "
+            f"({size / uncompressed_size:4.0%}), "
+            f"load {load_time:6.3f} s, decode {throughput}, "
+            f"at {args.bandwidth:g} Mbit/s {end_to_end:6.2f} s"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("packages", nargs="+")
+    parser.add_argument("--compressions", nargs="+", default=buildpkg.COMPRESSIONS)
+    parser.add_argument("--browser", choices=list(BROWSERS), default="firefox")
+    parser.add_argument("--build-dir", type=Path, default=ROOTDIR / "build")
+    parser.add_argument("--packages-dir", type=Path, default=ROOTDIR / "packages")
+    parser.add_argument(
+        "--bandwidth",
+        type=float,
+        default=20,
+        help="The bandwidth (in Mbit/s) of the estimated end to end load time",
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # The build directory, in which the files of the benchmarked packages
+        # are replaced
+        serve_dir = Path(tmp)
+        for entry in args.build_dir.resolve().iterdir():
+            (serve_dir / entry.name).symlink_to(entry)
+        httpd = serve_directory(serve_dir)
+        try:
+            for name in args.packages:
+                benchmark_package(name, args, serve_dir, httpd.server_address[1])
+        finally:
+            httpd.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Benchmark of the translation of captured compiler commands to emscripten.
+
+Times pywasmcross.handle_command in dry-run mode (the commands are not run)
+on a recorded build.log, with the rewrite rules built for each command, and
+shared by all the commands as in replay_compile. Build a package, e.g. scipy,
+keep its build.log (it is in the source directory under packages/scipy/build)
+and run e.g.
+
+    python benchmark/handle_command_benchmark.py path/to/build.log \
+        --replace-libs "lapack=clapack"
+"""
+
+import argparse
+import contextlib
+import io
+import json
+from pathlib import Path
+import sys
+from time import perf_counter
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "pyodide-build"))
+
+from pyodide_build import pywasmcross  # noqa: E402
+
+
+def time_rewrite(commands, args, shared_rules):
+    rules = pywasmcross.RewriteRules(args) if shared_rules else None
+    t0 = perf_counter()
+    # handle_command prints the commands
+    with contextlib.redirect_stdout(io.StringIO()):
+        for line in commands:
+            pywasmcross.handle_command(
+                line, args, dryrun=True, run_f2c=False, rules=rules
+            )
+    return perf_counter() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("build_log", type=Path)
+    parser.add_argument("--cflags", default="-O2 -fPIC")
+    parser.add_argument("--cxxflags", default="")
+    parser.add_argument("--ldflags", default="-O2 -s SIDE_MODULE=1")
+    parser.add_argument("--replace-libs", default="")
+    parser.add_argument("--install-dir", default="")
+    parser.add_argument("--target", default="")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with open(args.build_log) as fd:
+        commands = [json.loads(line) for line in fd]
+    n_args = sum(len(line) for line in commands)
+    print(f"{args.build_log}: {len(commands)} commands, {n_args} arguments")
+    for name, shared_rules in [("rules per command", False), ("shared rules", True)]:
+        elapsed = min(
+            time_rewrite(commands, args, shared_rules) for _ in range(args.repeat)
+        )
+        print(
+            f"  {name:>17}: {elapsed:.3f} s, "
+            f"{elapsed / len(commands) * 1e6:.1f} us per command"
+        )
+
+
+if __name__ == "__main__":
+    main()
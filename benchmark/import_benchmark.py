@@ -0,0 +1,110 @@
+"""
+Benchmark of the time needed to import packages, with and without bytecode.
+
+Build Pyodide twice, once as usual and once with
+``PYODIDE_BUILDALL_ARGS="--compile-bytecode"`` (optionally with
+``--strip-sources``), copy the build directories aside and run e.g.
+
+    python benchmark/import_benchmark.py build-py build-pyc
+
+To compare build profiles, build with ``buildall --build-profile PROFILE
+--profile-report report.json`` and record the import times of each build in
+the same report with
+
+    python benchmark/import_benchmark.py build --profile PROFILE \
+        --profile-report report.json
+"""
+
+import argparse
+from pathlib import Path
+import sys
+from time import time
+
+sys.path.insert(0, str((Path(__file__).resolve().parents[1])))
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "pyodide-build"))
+
+import conftest  # noqa: E402
+from pyodide_build import buildall  # noqa: E402
+from pyodide_build.buildpkg import BUILD_PROFILES  # noqa: E402
+
+
+PACKAGES = ["numpy", "pandas", "scipy"]
+
+BROWSERS = {
+    "firefox": conftest.FirefoxWrapper,
+    "chrome": conftest.ChromeWrapper,
+}
+
+
+def time_import(selenium_cls, port, package):
+    """Load a package in a new Pyodide instance, and time its import"""
+    selenium = selenium_cls(port, script_timeout=120)
+    try:
+        t0 = time()
+        selenium.load_package(package)
+        load_time = time() - t0
+        import_time = selenium.run(
+            f"""
+            from time import perf_counter
+            t0 = perf_counter()
+            import {package}
+            perf_counter() - t0
+            """
+        )
+    finally:
+        selenium.driver.quit()
+    return load_time, import_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "build_dirs", nargs="+", type=Path, help="Pyodide build directories"
+    )
+    parser.add_argument("--packages", nargs="+", default=PACKAGES)
+    parser.add_argument("--browsers", nargs="+", default=list(BROWSERS))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--profile-report",
+        type=Path,
+        help="Record the import times in this report of buildall --profile-report",
+    )
+    parser.add_argument(
+        "--profile",
+        choices=BUILD_PROFILES,
+        help="The build profile of the build directory, for --profile-report",
+    )
+    args = parser.parse_args()
+    if args.profile_report and (args.profile is None or len(args.build_dirs) != 1):
+        parser.error("--profile-report needs --profile and a single build directory")
+    report = (
+        buildall.load_profile_report(args.profile_report) if args.profile_report else {}
+    )
+
+    for build_dir in args.build_dirs:
+        print(build_dir)
+        with conftest.spawn_web_server(build_dir.resolve()) as (_, port, _):
+            for browser in args.browsers:
+                for package in args.packages:
+                    # The first run warms up the browser caches
+                    runs = [
+                        time_import(BROWSERS[browser], port, package)
+                        for _ in range(args.repeat + 1)
+                    ][1:]
+                    load_time = min(load for load, _ in runs)
+                    import_time = min(imp for _, imp in runs)
+                    print(
+                        f"  {browser:>8} {package:>8}: "
+                        f"load {load_time:.3f} s, import {import_time:.3f} s"
+                    )
+                    if args.profile_report and browser == args.browsers[0]:
+                        measures = report.setdefault(args.profile, {})
+                        measures.setdefault(package, {})["import_time"] = import_time
+
+    if args.profile_report:
+        buildall.save_profile_report(args.profile_report, report)
+        print(buildall.format_profile_report(report))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Load test of the development server.
+
+Compares the throughput of pyodide_build.serve with the handler it replaced
+(a single threaded server sending whole files with SimpleHTTPRequestHandler):
+--clients concurrent clients each send --requests requests for the files of
+the build directory, on a keep-alive connection when the server supports it,
+and the benchmark reports the requests and megabytes per second. Build
+Pyodide, then run e.g.
+
+    python benchmark/serve_benchmark.py --clients 8 --pattern "*.data" "*.js"
+"""
+
+import argparse
+import http.client
+import http.server
+import itertools
+from pathlib import Path
+import socketserver
+import sys
+import threading
+from time import perf_counter
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "pyodide-build"))
+
+from pyodide_build import serve  # noqa: E402
+
+ROOTDIR = Path(__file__).resolve().parents[1]
+
+
+class LegacyHandler(http.server.SimpleHTTPRequestHandler):
+    """The handler of pyodide_build.serve before the asset server"""
+
+    def end_headers(self):
+        self.send_header("Access-Control-Allow-Origin", "*")
+        super().end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+LegacyHandler.extensions_map[".wasm"] = "application/wasm"
+
+
+class QuietHandler(serve.Handler):
+    def log_message(self, format, *args):
+        pass
+
+
+def legacy_server(directory):
+    class Handler(LegacyHandler):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, directory=str(directory), **kwargs)
+
+    return socketserver.TCPServer(("127.0.0.1", 0), Handler)
+
+
+def asset_server(directory):
+    class Handler(QuietHandler):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, directory=str(directory), **kwargs)
+
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    httpd.daemon_threads = True
+    return httpd
+
+
+def run_client(port, paths, n_requests, headers, results):
+    conn = http.client.HTTPConnection("127.0.0.1", port)
+    transferred = 0
+    for path in itertools.islice(itertools.cycle(paths), n_requests):
+        conn.request("GET", path, headers=headers)
+        response = conn.getresponse()
+        transferred += len(response.read())
+        if response.will_close:
+            conn.close()
+            conn = http.client.HTTPConnection("127.0.0.1", port)
+    conn.close()
+    results.append(transferred)
+
+
+def load_test(make_server, directory, paths, args):
+    httpd = make_server(directory)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    headers = {"Accept-Encoding": "br, gzip"}
+    results: list = []
+    try:
+        clients = [
+            threading.Thread(
+                target=run_client,
+                args=(httpd.server_address[1], paths, args.requests, headers, results),
+            )
+            for _ in range(args.clients)
+        ]
+        t0 = perf_counter()
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        elapsed = perf_counter() - t0
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+    return args.clients * args.requests / elapsed, sum(results) / elapsed / 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--build-dir", type=Path, default=ROOTDIR / "build")
+    parser.add_argument(
+        "--pattern",
+        nargs="+",
+        default=["*.js", "*.data", "*.wasm"],
+        help="The glob patterns of the requested files",
+    )
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=50)
+    args = parser.parse_args()
+
+    directory = args.build_dir.resolve()
+    paths = sorted(
+        "/" + file.name
+        for pattern in args.pattern
+        for file in directory.glob(pattern)
+        if file.is_file()
+    )
+    if not paths:
+        sys.exit(f"No files matching {args.pattern} in {directory}")
+    print(
+        f"{len(paths)} files, {args.clients} clients, "
+        f"{args.requests} requests per client"
+    )
+    for name, make_server in [("legacy", legacy_server), ("asset", asset_server)]:
+        requests_per_s, mb_per_s = load_test(make_server, directory, paths, args)
+        print(f"  {name:>6}: {requests_per_s:8.1f} requests/s, {mb_per_s:8.1f} MB/s")
+
+
+if __name__ == "__main__":
+    main()
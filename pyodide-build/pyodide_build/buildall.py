@@ -6,17 +6,31 @@ Build all of the packages in a given directory.
 
 import argparse
 from functools import total_ordering
+import hashlib
 import json
+import math
+import os
 from pathlib import Path
 from queue import Queue, PriorityQueue
 import shutil
 import subprocess
 import sys
-from threading import Thread
-from time import sleep, perf_counter
-from typing import Dict, Set, Optional, List, Any
+from threading import Condition, Thread
+from time import sleep, perf_counter, time
+from typing import Dict, Set, Optional, List, Any, Tuple
 
 from . import common
+from .buildpkg import (
+    BUILD_PROFILES,
+    COMPRESSIONS,
+    PACKAGE_FORMATS,
+    find_install_prefix,
+    get_build_profile,
+    get_compression,
+    get_package_format,
+    package_installed_subset,
+    package_output_files,
+)
 from .io import parse_package_config
 from .common import UNVENDORED_STDLIB_MODULES
 
@@ -31,14 +45,41 @@ class BasePackage:
     dependencies: List[str]
     unbuilt_dependencies: Set[str]
     dependents: Set[str]
+    # Number of CPUs (possibly fractional) and memory (in MB) used while
+    # building the package
+    weight: float = 1
+    memory: int = 0
+    # Build duration in seconds, from previous runs if known
+    build_time: Optional[float] = None
+    # Longest build time of a chain starting at this package and following
+    # dependents. See compute_critical_paths.
+    critical_path: float = 0.0
+    # How the last call to build built the package, see
+    # buildpkg.BUILD_STATUSES
+    status: str = "up to date"
+    # Set by build_from_graph in --keep-going mode when the package failed to
+    # build, or wasn't built because one of its dependencies failed.
+    failed: bool = False
+    skipped: bool = False
+    # Trace of the build phases written by buildpkg when --trace-file is set
+    trace_path: Optional[Path] = None
+    # See buildpkg.get_package_format
+    package_format: str = "data"
+    # See buildpkg.get_compression
+    compression: str = "lz4"
+    # See buildpkg.get_build_profile
+    build_profile: str = "default"
+    # Files moved to the shared bundles by deduplicate_shared_files, as a map
+    # from their absolute path in the Emscripten filesystem to their sha256
+    shared_files: Dict[str, str] = {}
 
     # We use this in the priority queue, which pops off the smallest element.
-    # So we want the smallest element to have the largest number of dependents
+    # So we want the smallest element to have the longest critical path
     def __lt__(self, other) -> bool:
-        return len(self.dependents) > len(other.dependents)
+        return self.critical_path > other.critical_path
 
     def __eq__(self, other) -> bool:
-        return len(self.dependents) == len(other.dependents)
+        return self.critical_path == other.critical_path
 
 
 @total_ordering
@@ -61,18 +102,25 @@ class StdLibPackage(BasePackage):
 
 @total_ordering
 class Package(BasePackage):
-    def __init__(self, pkgdir: Path):
+    def __init__(self, pkgdir: Path, meta: Optional[Dict[str, Any]] = None):
         self.pkgdir = pkgdir
 
         pkgpath = pkgdir / "meta.yaml"
         if not pkgpath.is_file():
             raise ValueError(f"Directory {pkgdir} does not contain meta.yaml")
 
-        self.meta = parse_package_config(pkgpath)
+        self.meta = parse_package_config(pkgpath) if meta is None else meta
         self.name = self.meta["package"]["name"]
         self.version = self.meta["package"]["version"]
         self.library = self.meta.get("build", {}).get("library", False)
         self.shared_library = self.meta.get("build", {}).get("sharedlibrary", False)
+        self.weight = self.meta.get("build", {}).get("weight", 1)
+        self.memory = self.meta.get("build", {}).get("memory", 0)
+        if self.weight <= 0:
+            raise ValueError(
+                f"Invalid build/weight {self.weight} of package {self.name}, "
+                "expected a positive number"
+            )
 
         assert self.name == pkgdir.stem
 
@@ -81,6 +129,16 @@ class Package(BasePackage):
         self.dependents = set()
 
     def build(self, outputdir: Path, args) -> None:
+        self.package_format = get_package_format(self.meta, args)
+        self.compression = get_compression(self.meta, args)
+        self.build_profile = get_build_profile(self.meta, args)
+        status_path = self.pkgdir / "build" / "status"
+        if status_path.is_file():
+            status_path.unlink()
+        trace_args = []
+        if args.trace_file:
+            self.trace_path = self.pkgdir / "build" / "trace.json"
+            trace_args = ["--trace-file", str(self.trace_path)]
         with open(self.pkgdir / "build.log.tmp", "w") as f:
             p = subprocess.run(
                 [
@@ -99,24 +157,42 @@ class Package(BasePackage):
                     args.target,
                     "--install-dir",
                     args.install_dir,
-                ],
+                    "--cache-dir",
+                    args.cache_dir,
+                    "--source-mirror",
+                    args.source_mirror,
+                    "--package-format",
+                    args.package_format,
+                    "--compression",
+                    args.compression,
+                    "--build-profile",
+                    args.build_profile,
+                    # The compiler commands replayed by pywasmcross share
+                    # the CPUs reserved for this package in the budget
+                    "--replay-jobs",
+                    str(max(int(min(self.weight, args.n_jobs)), 1)),
+                    "--status-file",
+                    str(status_path),
+                ]
+                + (["--reuse-build-log"] if args.reuse_build_log else [])
+                + (["--reuse-objects"] if args.reuse_objects else [])
+                + (["--compile-bytecode"] if args.compile_bytecode else [])
+                + (["--strip-sources"] if args.strip_sources else [])
+                + trace_args,
                 check=False,
                 stdout=f,
                 stderr=subprocess.STDOUT,
             )
 
-        # Don't overwrite build log if we didn't build the file.
-        # If the file didn't need to be rebuilt, the log will have exactly two lines.
-        rebuilt = True
-        with open(self.pkgdir / "build.log.tmp", "r") as f:
-            try:
-                next(f)
-                next(f)
-                next(f)
-            except StopIteration:
-                rebuilt = False
-
-        if rebuilt:
+        # Don't overwrite the build log if the package wasn't built, i.e. it
+        # was up to date or restored from the build cache. buildpkg writes no
+        # status when it fails.
+        if status_path.is_file():
+            self.status = status_path.read_text().strip()
+            status_path.unlink()
+        else:
+            self.status = "built"
+        if self.status == "built":
             shutil.move(self.pkgdir / "build.log.tmp", self.pkgdir / "build.log")  # type: ignore
         else:
             (self.pkgdir / "build.log.tmp").unlink()
@@ -137,18 +213,71 @@ class Package(BasePackage):
             raise
 
         if not self.library:
-            shutil.copyfile(
-                self.pkgdir / "build" / (self.name + ".data"),
-                outputdir / (self.name + ".data"),
-            )
-            shutil.copyfile(
-                self.pkgdir / "build" / (self.name + ".js"),
-                outputdir / (self.name + ".js"),
-            )
+            for file in package_output_files(
+                self.name, self.package_format, self.compression
+            ):
+                shutil.copyfile(self.pkgdir / "build" / file, outputdir / file)
+
+
+# Bump when the format of the index or the validation of meta.yaml changes
+METADATA_INDEX_VERSION = 2
+
+
+def load_metadata_index(path: Optional[Path]) -> Dict[str, Dict[str, Any]]:
+    """Load the index of parsed meta.yaml files saved by a previous run"""
+    if path is None or not path.is_file():
+        return {}
+    try:
+        with open(path, "r") as fd:
+            index = json.load(fd)
+    except ValueError:
+        print(f"Ignoring invalid metadata index {path}")
+        return {}
+    if index.get("version") != METADATA_INDEX_VERSION:
+        return {}
+    return index["packages"]
+
+
+def save_metadata_index(path: Optional[Path], index: Dict[str, Dict[str, Any]]):
+    if path is None:
+        return
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Write to a temporary file first, concurrent runs may read the index
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "w") as fd:
+        json.dump({"version": METADATA_INDEX_VERSION, "packages": index}, fd)
+    tmp_path.replace(path)
+
+
+def load_package_config(pkgpath: Path, index: Dict[str, Dict[str, Any]]) -> Dict:
+    """Parse a meta.yaml file, unless it is unchanged since it was indexed.
+
+    The file is considered unchanged if its modification time and size match
+    the index or, failing that, its sha256 hash does. The index is updated
+    in place.
+    """
+    key = str(pkgpath.resolve())
+    stat = pkgpath.stat()
+    entry = index.get(key)
+    if (
+        entry is not None
+        and entry["mtime_ns"] == stat.st_mtime_ns
+        and entry["size"] == stat.st_size
+    ):
+        return entry["meta"]
+
+    sha256 = hashlib.sha256(pkgpath.read_bytes()).hexdigest()
+    if entry is None or entry["sha256"] != sha256:
+        entry = {"sha256": sha256, "meta": parse_package_config(pkgpath)}
+    entry.update(mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+    index[key] = entry
+    return entry["meta"]
 
 
 def generate_dependency_graph(
-    packages_dir: Path, packages: Optional[Set[str]]
+    packages_dir: Path,
+    packages: Optional[Set[str]],
+    metadata_index: Optional[Path] = None,
 ) -> Dict[str, BasePackage]:
     """This generates a dependency graph for listed packages.
 
@@ -165,12 +294,16 @@ def generate_dependency_graph(
      - packages_dir: directory that contains packages
      - packages: set of packages to build. If None, then all packages in
        packages_dir are compiled.
+     - metadata_index: file in which the parsed meta.yaml files are cached
+       between runs (see load_package_config). If None, all meta.yaml files
+       are parsed.
 
     Returns:
      - pkg_map: dictionary mapping package names to BasePackage objects
     """
 
     pkg_map: Dict[str, BasePackage] = {}
+    index = load_metadata_index(metadata_index)
 
     if packages is None:
         packages = set(
@@ -184,13 +317,19 @@ def generate_dependency_graph(
         if pkgname in UNVENDORED_STDLIB_MODULES:
             pkg = StdLibPackage(packages_dir / pkgname)
         else:
-            pkg = Package(packages_dir / pkgname)
+            pkgdir = packages_dir / pkgname
+            meta = None
+            if (pkgdir / "meta.yaml").is_file():
+                meta = load_package_config(pkgdir / "meta.yaml", index)
+            pkg = Package(pkgdir, meta)
         pkg_map[pkg.name] = pkg
 
         for dep in pkg.dependencies:
             if pkg_map.get(dep) is None:
                 packages.add(dep)
 
+    save_metadata_index(metadata_index, index)
+
     # Compute dependents
     for pkg in pkg_map.values():
         for dep in pkg.dependencies:
@@ -199,61 +338,255 @@ def generate_dependency_graph(
     return pkg_map
 
 
-def build_from_graph(pkg_map: Dict[str, BasePackage], outputdir: Path, args) -> None:
+class ResourceBudget:
+    """Limit the CPUs and memory used by the packages built concurrently.
+
+    Each package requests its weight (number of CPUs, which may be a fraction
+    for packages that barely use one) and memory hint. A request larger than
+    the whole budget is clamped to it, so that every package can eventually
+    be built. Requests are granted in order, so that heavy packages are not
+    starved by a stream of lighter ones.
+
+    Parameters
+    ----------
+    cpus
+        total weight of the packages built concurrently
+    memory
+        total memory (in MB) of the packages built concurrently. 0 means no
+        limit.
+    """
+
+    # Slack when comparing sums of fractional weights, which are inexact
+    EPSILON = 1e-9
+
+    def __init__(self, cpus: float, memory: int = 0):
+        self.cpus = cpus
+        self.memory = memory
+        self.used_cpus: float = 0
+        self.used_memory = 0
+        self._condition = Condition()
+        self._waiting: List[BasePackage] = []
+
+    def _request(self, pkg: BasePackage) -> Tuple[float, int]:
+        cpus = min(pkg.weight, self.cpus)
+        memory = min(pkg.memory, self.memory) if self.memory else 0
+        return cpus, memory
+
+    def _fits(self, pkg: BasePackage) -> bool:
+        cpus, memory = self._request(pkg)
+        return (
+            self.used_cpus + cpus <= self.cpus + self.EPSILON
+            and self.used_memory + memory <= self.memory
+        )
+
+    def acquire(self, pkg: BasePackage) -> None:
+        """Block until the resources requested by pkg are available"""
+        with self._condition:
+            self._waiting.append(pkg)
+            self._condition.wait_for(
+                lambda: self._waiting[0] is pkg and self._fits(pkg)
+            )
+            self._waiting.pop(0)
+            cpus, memory = self._request(pkg)
+            self.used_cpus += cpus
+            self.used_memory += memory
+            self._condition.notify_all()
+
+    def release(self, pkg: BasePackage) -> None:
+        """Release the resources held by pkg"""
+        with self._condition:
+            cpus, memory = self._request(pkg)
+            self.used_cpus -= cpus
+            self.used_memory -= memory
+            self._condition.notify_all()
+
+
+def count_builder_threads(pkg_map: Dict[str, BasePackage], n_jobs: int) -> int:
+    """The number of threads needed to build as many packages at once as fit
+    in n_jobs CPUs, i.e. n_jobs divided by the smallest weight.
+
+    >>> pkg = StdLibPackage(Path("distutils"))
+    >>> pkg.weight = 0.25
+    >>> count_builder_threads({"distutils": pkg}, 4)
+    1
+    >>> count_builder_threads({str(n): pkg for n in range(100)}, 4)
+    16
+    """
+    if not pkg_map:
+        return 1
+    min_weight = min(min(pkg.weight, n_jobs) for pkg in pkg_map.values())
+    return max(min(math.ceil(n_jobs / min_weight), len(pkg_map)), 1)
+
+
+def load_build_times(path: Optional[Path]) -> Dict[str, float]:
+    """Load the build durations recorded by previous runs"""
+    if path is None or not path.is_file():
+        return {}
+    try:
+        with open(path, "r") as fd:
+            return json.load(fd)
+    except ValueError:
+        print(f"Ignoring invalid build times file {path}")
+        return {}
+
+
+def save_build_times(path: Optional[Path], build_times: Dict[str, float]) -> None:
+    """Merge the build durations of this run into the build times file"""
+    if path is None or not build_times:
+        return
+    all_build_times = load_build_times(path)
+    all_build_times.update(build_times)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w") as fd:
+        json.dump(dict(sorted(all_build_times.items())), fd, indent=2)
+
+
+def compute_critical_paths(pkg_map: Dict[str, BasePackage]) -> None:
+    """Compute the critical path of every package in the graph.
+
+    The critical path of a package is its own build time plus the longest
+    critical path among its dependents, i.e. the minimal time needed to build
+    it and everything that transitively depends on it. Packages without a
+    recorded build time are assumed to take the mean of the known build times
+    (or 1 second if none is known).
+    """
+    known_times = [
+        pkg.build_time for pkg in pkg_map.values() if pkg.build_time is not None
+    ]
+    default_time = sum(known_times) / len(known_times) if known_times else 1.0
+
+    critical_paths: Dict[str, float] = {}
+
+    def critical_path(name: str) -> float:
+        if name in critical_paths:
+            return critical_paths[name]
+        pkg = pkg_map[name]
+        # Guard against dependency cycles
+        critical_paths[name] = 0.0
+        own_time = pkg.build_time if pkg.build_time is not None else default_time
+        critical_paths[name] = own_time + max(
+            (critical_path(dependent) for dependent in pkg.dependents), default=0.0
+        )
+        return critical_paths[name]
+
+    for name, pkg in pkg_map.items():
+        pkg.critical_path = critical_path(name)
+
+
+def build_from_graph(
+    pkg_map: Dict[str, BasePackage],
+    outputdir: Path,
+    args,
+    trace: Optional[common.BuildTrace] = None,
+) -> Dict[str, float]:
     """
     This builds packages in pkg_map in parallel, building at most args.n_jobs
     packages at once.
 
     We have a priority queue of packages we are ready to build (build_queue),
     where a package is ready to build if all its dependencies are built. The
-    priority is based on the number of dependents --- we prefer to build
-    packages with more dependents first.
-
-    To build packages in parallel, we use a thread pool of args.n_jobs many
-    threads listening to build_queue. When the thread is free, it takes an
-    item off build_queue and builds it. Once the package is built, it sends the
-    package to the built_queue. The main thread listens to the built_queue and
+    priority is based on the critical path (see compute_critical_paths) --- we
+    prefer to build packages that hold up the longest chain of builds first.
+
+    To build packages in parallel, we use a thread pool listening to
+    build_queue, large enough to fill the budget with the packages of the
+    smallest weight (see count_builder_threads). When the thread is free, it
+    takes an item off build_queue, waits until the package fits in the CPU and memory
+    budget (see ResourceBudget) and builds it. Once the package is built, it
+    sends the package to the built_queue. The main thread listens to the built_queue and
     checks if any of the dependents are ready to be built. If so, it add the
     package to the build queue.
+
+    If a build fails, the exception is re-raised, unless args.keep_going is
+    set. In that case the package is marked as failed, all its transitive
+    dependents are marked as skipped, and the remaining packages keep
+    building. A summary is printed at the end.
+
+    If trace is given, the build of each package is added to it as an event
+    in the lane of the thread that built it, together with the phases recorded
+    by buildpkg.
+
+    Returns the build time in seconds of each package that was built, rather
+    than restored from the build cache or up to date.
     """
 
-    # Insert packages into build_queue. We *must* do this after counting
-    # dependents, because the ordering ought not to change after insertion.
+    compute_critical_paths(pkg_map)
+
+    # Insert packages into build_queue. We *must* do this after computing
+    # critical paths, because the ordering ought not to change after insertion.
     build_queue: PriorityQueue = PriorityQueue()
     for pkg in pkg_map.values():
         if len(pkg.dependencies) == 0:
             build_queue.put(pkg)
 
     built_queue: Queue = Queue()
+    build_times: Dict[str, float] = {}
+    durations: Dict[str, float] = {}
+    budget = ResourceBudget(args.n_jobs, args.memory_budget)
+
+    def record_trace(n: int, pkg: BasePackage, start: float, status: str):
+        if trace is None:
+            return
+        trace.add_event(pkg.name, start, time(), tid=n, status=status)
+        if pkg.trace_path is not None and pkg.trace_path.is_file():
+            trace.merge(common.BuildTrace.load(pkg.trace_path), os.getpid(), n)
 
     def builder(n):
         print(f"Starting thread {n}")
+        if trace is not None:
+            trace.set_thread_name(n, f"Thread {n}")
         while True:
             pkg = build_queue.get()
+            budget.acquire(pkg)
 
             print(f"Thread {n} building {pkg.name}")
             t0 = perf_counter()
+            start = time()
             try:
                 pkg.build(outputdir, args)
             except Exception as e:
-                built_queue.put(e)
-                return
-
-            print(f"Thread {n} built {pkg.name} in {perf_counter() - t0:.1f} s")
-            built_queue.put(pkg)
+                budget.release(pkg)
+                durations[pkg.name] = perf_counter() - t0
+                record_trace(n, pkg, start, "failed")
+                print(f"Thread {n} failed to build {pkg.name}")
+                built_queue.put((pkg, e))
+                continue
+
+            budget.release(pkg)
+            record_trace(n, pkg, start, pkg.status)
+            build_time = perf_counter() - t0
+            durations[pkg.name] = build_time
+            print(f"Thread {n} built {pkg.name} in {build_time:.1f} s")
+            # Restoring from the build cache doesn't tell how long the
+            # package takes to build
+            if pkg.status == "built":
+                build_times[pkg.name] = build_time
+            built_queue.put((pkg, None))
             # Release the GIL so new packages get queued
             sleep(0.01)
 
-    for n in range(0, args.n_jobs):
+    for n in range(0, count_builder_threads(pkg_map, args.n_jobs)):
         Thread(target=builder, args=(n + 1,), daemon=True).start()
 
-    num_built = 0
-    while num_built < len(pkg_map):
-        pkg = built_queue.get()
-        if isinstance(pkg, Exception):
-            raise pkg
-
-        num_built += 1
+    num_done = 0
+    while num_done < len(pkg_map):
+        pkg, error = built_queue.get()
+        num_done += 1
+
+        if error is not None:
+            if not args.keep_going:
+                raise error
+            pkg.failed = True
+            # None of the transitive dependents can be built anymore
+            to_skip = list(pkg.dependents)
+            while to_skip:
+                dependent = pkg_map[to_skip.pop()]
+                if dependent.skipped:
+                    continue
+                dependent.skipped = True
+                num_done += 1
+                to_skip.extend(dependent.dependents)
+            continue
 
         for _dependent in pkg.dependents:
             dependent = pkg_map[_dependent]
@@ -261,6 +594,35 @@ def build_from_graph(pkg_map: Dict[str, BasePackage], outputdir: Path, args) ->
             if len(dependent.unbuilt_dependencies) == 0:
                 build_queue.put(dependent)
 
+    if args.keep_going:
+        print_build_summary(pkg_map, durations)
+
+    return build_times
+
+
+def print_build_summary(
+    pkg_map: Dict[str, BasePackage], durations: Dict[str, float]
+) -> None:
+    """Print the packages that were built, failed, or skipped"""
+
+    def format_packages(names: List[str]) -> str:
+        return ", ".join(
+            f"{name} ({durations[name]:.1f} s)" if name in durations else name
+            for name in sorted(names)
+        )
+
+    built = [name for name, pkg in pkg_map.items() if not (pkg.failed or pkg.skipped)]
+    failed = [name for name, pkg in pkg_map.items() if pkg.failed]
+    skipped = [name for name, pkg in pkg_map.items() if pkg.skipped]
+
+    print("\nBuild summary:")
+    print(f"  built ({len(built)}): {format_packages(built)}")
+    print(f"  failed ({len(failed)}): {format_packages(failed)}")
+    print(
+        f"  skipped due to a failed dependency ({len(skipped)}): "
+        f"{format_packages(skipped)}"
+    )
+
 
 def generate_packages_json(pkg_map: Dict[str, BasePackage]) -> Dict:
     """Generate the package.json file"""
@@ -288,6 +650,10 @@ def generate_packages_json(pkg_map: Dict[str, BasePackage]) -> Dict:
         pkg_entry = {"name": name, "version": pkg.version}
         if pkg.shared_library:
             pkg_entry["shared_library"] = True
+        if pkg.package_format != "data":
+            pkg_entry["format"] = pkg.package_format
+        if pkg.shared_files:
+            pkg_entry["shared_files"] = dict(sorted(pkg.shared_files.items()))
         pkg_entry["depends"] = [
             x.lower() for x in pkg.dependencies if x not in libraries
         ]
@@ -306,17 +672,260 @@ def generate_packages_json(pkg_map: Dict[str, BasePackage]) -> Dict:
     return package_data
 
 
+def merge_packages_json(
+    package_data: Dict,
+    previous_data: Dict,
+    pkg_map: Dict[str, BasePackage],
+    outputdir: Path,
+) -> Dict:
+    """Add the packages of a previous packages.json that are still in outputdir.
+
+    This is used when only a subset of the packages is built, so that the
+    packages built by earlier runs stay installable. Packages in pkg_map are
+    never taken from previous_data, as they were (re)built or failed to build
+    in this run.
+    """
+    names = {name.lower() for name in pkg_map}
+    packages = dict(package_data["packages"])
+    for name, pkg_entry in previous_data.get("packages", {}).items():
+        if name in packages or name in names:
+            continue
+        files = package_output_files(pkg_entry["name"], pkg_entry.get("format", "data"))
+        files += [
+            f"{SHARED_FILES_DIR}/{digest}"
+            for digest in pkg_entry.get("shared_files", {}).values()
+        ]
+        if all((outputdir / file).is_file() for file in files):
+            packages[name] = pkg_entry
+    return dict(package_data, packages=dict(sorted(packages.items())))
+
+
+# Directory of the output directory where the files deduplicated by
+# deduplicate_shared_files are stored, named by their sha256
+SHARED_FILES_DIR = "shared"
+
+
+def _is_shared_object(path: Path) -> bool:
+    return path.suffix == ".so" or ".so." in path.name
+
+
+def find_duplicate_files(
+    pkg_map: Dict[str, BasePackage], min_size: int
+) -> Dict[str, List[Tuple[str, str]]]:
+    """
+    Find the identical files installed by several packages, or several times
+    by a package.
+
+    Shared objects are always considered, and other files if they are at
+    least min_size bytes. Library packages are not packaged, and packages
+    whose installed files are not available (because they were restored from
+    the build cache) are skipped.
+
+    Returns
+    -------
+    A map from the sha256 of the duplicated files to the list of their
+    package names and paths relative to the install prefix of the package.
+    """
+    files: Dict[str, List[Tuple[str, str]]] = {}
+    for name, pkg in sorted(pkg_map.items()):
+        if pkg.library or isinstance(pkg, StdLibPackage):
+            continue
+        install_prefix = find_install_prefix(pkg.pkgdir)
+        if install_prefix is None:
+            print(f"Not deduplicating the files of {name}: no installed files")
+            continue
+        for path in sorted(install_prefix.rglob("*")):
+            if not path.is_file() or path.is_symlink():
+                continue
+            if not _is_shared_object(path) and path.stat().st_size < min_size:
+                continue
+            with open(path, "rb") as fd:
+                digest = hashlib.sha256(fd.read()).hexdigest()
+            files.setdefault(digest, []).append(
+                (name, path.relative_to(install_prefix).as_posix())
+            )
+    return {digest: paths for digest, paths in files.items() if len(paths) > 1}
+
+
+def load_profile_report(path: Path) -> Dict[str, Dict[str, Dict[str, float]]]:
+    """
+    Load the report of --profile-report, which maps build profiles to the
+    measures of the packages built with them: the size of their bundle, and
+    their import time if measured by benchmark/import_benchmark.py.
+    """
+    if not path.is_file():
+        return {}
+    try:
+        with open(path, "r") as fd:
+            return json.load(fd)
+    except ValueError:
+        print(f"Ignoring invalid profile report {path}")
+        return {}
+
+
+def save_profile_report(
+    path: Path, report: Dict[str, Dict[str, Dict[str, float]]]
+) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w") as fd:
+        json.dump(report, fd, indent=2, sort_keys=True)
+
+
+def update_profile_report(
+    path: Path, pkg_map: Dict[str, BasePackage], outputdir: Path
+) -> Dict[str, Dict[str, Dict[str, float]]]:
+    """Record the size of the bundles of the built packages in the profile
+    report, under their build profile"""
+    report = load_profile_report(path)
+    for name, pkg in pkg_map.items():
+        if pkg.library or isinstance(pkg, StdLibPackage):
+            continue
+        bundle = (
+            outputdir
+            / package_output_files(name, pkg.package_format, pkg.compression)[0]
+        )
+        if bundle.is_file():
+            measures = report.setdefault(pkg.build_profile, {}).setdefault(name, {})
+            measures["size"] = bundle.stat().st_size
+    save_profile_report(path, report)
+    return report
+
+
+def format_profile_report(report: Dict[str, Dict[str, Dict[str, float]]]) -> str:
+    """
+    Format the profile report as a table with a row per package and a column
+    per build profile. Sizes are compared to the ones of the default profile.
+    """
+    profiles = [profile for profile in BUILD_PROFILES if profile in report]
+    packages = sorted({name for profile in profiles for name in report[profile]})
+    rows = [["package"] + profiles]
+    for name in packages:
+        default_size = report.get("default", {}).get(name, {}).get("size")
+        row = [name]
+        for profile in profiles:
+            measures = report[profile].get(name, {})
+            cell = []
+            if "size" in measures:
+                cell.append(f"{measures['size'] / 1e6:.2f} MB")
+                if default_size and profile != "default":
+                    cell.append(f"({measures['size'] / default_size:.0%})")
+            if "import_time" in measures:
+                cell.append(f"{measures['import_time']:.3f} s")
+            row.append(" ".join(cell) or "-")
+        rows.append(row)
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    return "\n".join(
+        "  ".join(
+            cell.ljust(width) if i == 0 else cell.rjust(width)
+            for i, (cell, width) in enumerate(zip(row, widths))
+        ).rstrip()
+        for row in rows
+    )
+
+
+def deduplicate_shared_files(
+    pkg_map: Dict[str, BasePackage], outputdir: Path, args
+) -> int:
+    """
+    Move the files that are identical across packages to content-addressed
+    side bundles in outputdir/shared, which are listed in the shared_files
+    of the packages in packages.json and downloaded once, and repackage the
+    packages without them. Prints a report of the deduplicated files.
+
+    Returns
+    -------
+    The number of bytes saved.
+    """
+    duplicates = find_duplicate_files(pkg_map, args.deduplicate_min_size * 1024)
+    if not duplicates:
+        return 0
+
+    shared_dir = outputdir / SHARED_FILES_DIR
+    shared_dir.mkdir(exist_ok=True)
+    print("\nShared files:")
+    saved = 0
+    for digest, paths in sorted(duplicates.items()):
+        first_name, first_path = paths[0]
+        install_prefix = find_install_prefix(pkg_map[first_name].pkgdir)
+        assert install_prefix is not None
+        size = (install_prefix / first_path).stat().st_size
+        shutil.copyfile(install_prefix / first_path, shared_dir / digest)
+        for name, path in paths:
+            pkg = pkg_map[name]
+            pkg.shared_files = {**pkg.shared_files, "/" + path: digest}
+        saved += size * (len(paths) - 1)
+        packages = sorted({name for name, _ in paths})
+        print(
+            f"  {digest[:12]} {Path(first_path).name}: {size / 1e6:.2f} MB x "
+            f"{len(paths)} ({', '.join(packages)})"
+        )
+    print(f"Saved {saved / 1e6:.2f} MB by deduplicating {len(duplicates)} files")
+
+    for pkg in pkg_map.values():
+        if not pkg.shared_files:
+            continue
+        install_prefix = find_install_prefix(pkg.pkgdir)
+        assert install_prefix is not None
+        installed = [
+            file.relative_to(install_prefix).as_posix()
+            for file in sorted(install_prefix.rglob("*"))
+            if file.is_file()
+        ]
+        package_installed_subset(
+            pkg.meta,
+            install_prefix,
+            [path for path in installed if "/" + path not in pkg.shared_files],
+            outputdir,
+            args,
+        )
+    return saved
+
+
 def build_packages(packages_dir: Path, outputdir: Path, args) -> None:
     packages = common._parse_package_subset(args.only)
 
-    pkg_map = generate_dependency_graph(packages_dir, packages)
+    metadata_index = Path(args.cache_dir) / "metadata.json" if args.cache_dir else None
+    pkg_map = generate_dependency_graph(packages_dir, packages, metadata_index)
+
+    build_times_path = Path(args.build_times) if args.build_times else None
+    for name, build_time in load_build_times(build_times_path).items():
+        if name in pkg_map:
+            pkg_map[name].build_time = build_time
+
+    trace = common.BuildTrace() if args.trace_file else None
+    try:
+        build_times = build_from_graph(pkg_map, outputdir, args, trace)
+    finally:
+        if trace is not None:
+            trace.save(Path(args.trace_file))
+    save_build_times(build_times_path, build_times)
+
+    # With --keep-going, only list the packages that were successfully built
+    built_pkg_map = {
+        name: pkg for name, pkg in pkg_map.items() if not (pkg.failed or pkg.skipped)
+    }
+    if args.deduplicate:
+        deduplicate_shared_files(built_pkg_map, outputdir, args)
+    package_data = generate_packages_json(built_pkg_map)
+
+    packages_json = outputdir / "packages.json"
+    if packages is not None and packages_json.is_file():
+        with open(packages_json, "r") as fd:
+            package_data = merge_packages_json(
+                package_data, json.load(fd), pkg_map, outputdir
+            )
 
-    build_from_graph(pkg_map, outputdir, args)
+    with open(packages_json, "w") as fd:
+        json.dump(package_data, fd)
 
-    package_data = generate_packages_json(pkg_map)
+    if args.profile_report:
+        report = update_profile_report(
+            Path(args.profile_report), built_pkg_map, outputdir
+        )
+        print(format_profile_report(report))
 
-    with open(outputdir / "packages.json", "w") as fd:
-        json.dump(package_data, fd)
+    if len(built_pkg_map) < len(pkg_map):
+        sys.exit(1)
 
 
 def make_parser(parser):
@@ -377,6 +986,57 @@ def make_parser(parser):
             "needed if you want to build other packages that depend on this one."
         ),
     )
+    parser.add_argument(
+        "--cache-dir",
+        type=str,
+        nargs="?",
+        default=str(common.get_build_cache_dir()),
+        help=(
+            "Directory of the content-addressed cache of built packages and "
+            "of the index of parsed meta.yaml files. Set to an empty string to "
+            "disable the cache."
+        ),
+    )
+    parser.add_argument(
+        "--source-mirror",
+        type=str,
+        nargs="?",
+        default="",
+        help=(
+            "Local directory to look up source tarballs in before downloading "
+            "them. It has the same layout as the sources directory of the "
+            "cache directory."
+        ),
+    )
+    parser.add_argument(
+        "--reuse-build-log",
+        action="store_true",
+        help=(
+            "Cache the compiler commands captured by the native build in the "
+            "cache directory, and skip the native build when the source tree "
+            "is unchanged"
+        ),
+    )
+    parser.add_argument(
+        "--reuse-objects",
+        action="store_true",
+        help=(
+            "Cache the objects compiled by emscripten in the cache directory, "
+            "and reuse them when the compiler command and the preprocessed "
+            "source are unchanged"
+        ),
+    )
+    parser.add_argument(
+        "--build-times",
+        type=str,
+        nargs="?",
+        default=str(common.get_build_cache_dir() / "build_times.json"),
+        help=(
+            "JSON file in which package build times are recorded. They are "
+            "used to build the packages on the critical path first. Set to an "
+            "empty string to disable."
+        ),
+    )
     parser.add_argument(
         "--log-dir",
         type=str,
@@ -390,14 +1050,134 @@ def make_parser(parser):
         type=str,
         nargs="?",
         default=None,
-        help=("Only build the specified packages, provided as a comma-separated list"),
+        help=(
+            "Only build the specified packages, provided as a comma-separated "
+            "list. The packages built by previous runs that are still in the "
+            "output directory are kept in packages.json."
+        ),
     )
     parser.add_argument(
         "--n-jobs",
         type=int,
         nargs="?",
         default=4,
-        help="Number of packages to build in parallel",
+        help=(
+            "Number of packages to build in parallel. Packages with a "
+            "build/weight in their meta.yaml count as that many packages, "
+            "e.g. four packages of weight 0.25 are built per job"
+        ),
+    )
+    parser.add_argument(
+        "--memory-budget",
+        type=int,
+        nargs="?",
+        default=0,
+        help=(
+            "Total memory (in MB) of the packages built in parallel, as given "
+            "by build/memory in their meta.yaml. 0 means no limit"
+        ),
+    )
+    parser.add_argument(
+        "--keep-going",
+        action="store_true",
+        help=(
+            "Keep building packages that don't depend on a package that failed "
+            "to build, and exit with an error at the end"
+        ),
+    )
+    parser.add_argument(
+        "--package-format",
+        type=str,
+        choices=PACKAGE_FORMATS,
+        default="data",
+        help=(
+            "Output packages as a .data and a .js file generated by the "
+            "Emscripten file packager (data), or as zip archives from which "
+            "Python modules are extracted when they are imported, opened or "
+            "listed (zip), so os.stat does not find them before that. "
+            "Library and shared library packages are always output as data."
+        ),
+    )
+    parser.add_argument(
+        "--compression",
+        type=str,
+        choices=COMPRESSIONS,
+        default="lz4",
+        help=(
+            "Compression of the packages without build/compression in their "
+            "meta.yaml: lz4 (decompressed in the runtime), none, or gzip and "
+            "brotli (precompressed copies served with a Content-Encoding)"
+        ),
+    )
+    parser.add_argument(
+        "--build-profile",
+        type=str,
+        choices=BUILD_PROFILES,
+        default="default",
+        help=(
+            "Optimization profile of the packages without build/profile in "
+            "their meta.yaml: default (-O2 -g), size (-Oz), speed (-O3) or "
+            "debug (-O0 -g)"
+        ),
+    )
+    parser.add_argument(
+        "--compile-bytecode",
+        action="store_true",
+        help=(
+            "Compile the Python modules of the packages to bytecode with the "
+            "host Python, and package the .pyc files"
+        ),
+    )
+    parser.add_argument(
+        "--strip-sources",
+        action="store_true",
+        help=(
+            "With --compile-bytecode, package the .pyc files instead of the "
+            ".py files of the modules"
+        ),
+    )
+    parser.add_argument(
+        "--deduplicate",
+        action="store_true",
+        help=(
+            "Move the shared objects and large files which are identical in "
+            "several packages to shared bundles, which are downloaded once, "
+            "and print the size saved. Packages restored from the build cache "
+            "are not deduplicated."
+        ),
+    )
+    parser.add_argument(
+        "--deduplicate-min-size",
+        type=int,
+        nargs="?",
+        default=256,
+        help=(
+            "With --deduplicate, the minimum size (in KB) of the files other "
+            "than shared objects that are deduplicated"
+        ),
+    )
+    parser.add_argument(
+        "--profile-report",
+        type=str,
+        nargs="?",
+        default="",
+        help=(
+            "JSON file in which the bundle sizes of the packages are recorded "
+            "under their build profile, merged with the previous runs. A "
+            "comparison of the recorded profiles is printed."
+        ),
+    )
+    parser.add_argument(
+        "--trace-file",
+        type=str,
+        nargs="?",
+        default="",
+        help=(
+            "Write a timeline of the build of all packages, including the "
+            "duration and peak memory of their build phases, to this file in "
+            "the Chrome trace event format (open it in chrome://tracing or "
+            "https://ui.perfetto.dev)"
+        ),
     )
     return parser
 
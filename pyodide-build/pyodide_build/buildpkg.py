@@ -6,16 +6,24 @@ Builds a Pyodide package.
 
 import argparse
 import cgi
+import contextlib
 from datetime import datetime
+import fcntl
+import gzip
 import hashlib
-import json
 import os
 from pathlib import Path
+import re
+import shlex
 import shutil
 import subprocess
 import sys
-from typing import Any, Dict
+import tempfile
+import threading
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
 from urllib import request
+from urllib.error import HTTPError
+import zipfile
 
 
 from . import common
@@ -27,56 +35,176 @@ class BashRunnerWithSharedEnvironment:
 
     Environment is stored to "env" member between runs. This can be updated
     directly to adjust the environment, or read to get variables.
+
+    The scripts are run by a single bash process, started on the first run and
+    kept alive until close is called. Each script runs in a subshell of it with
+    ``set -e``, so that only exported variables are kept between runs, as if
+    every script was run by a new ``bash -ce``. The subshell sends back the
+    exported environment through a pipe when it exits, and only the variables
+    changed since are sent to bash before the next run.
     """
 
+    _DUMP_ENV_FUNC = "__pyodide_dump_env"
+
     def __init__(self, env=None):
         if env is None:
             env = dict(os.environ)
         self.env: Dict[str, str] = env
-        self._fd_read, self._fd_write = os.pipe()
-        self._reader = os.fdopen(self._fd_read, "r")
+        self._proc: Optional[subprocess.Popen] = None
+        # environment exported in the bash process
+        self._bash_env: Dict[str, str] = {}
 
-    def run(self, cmd, **opts):
-        """Run a bash script. Any keyword arguments are passed on to subprocess.run."""
-        write_env_pycode = ";".join(
+    def _start(self):
+        cmd_read, self._cmd_write = os.pipe()
+        self._result_read, result_write = os.pipe()
+        init = "\n".join(
             [
-                "import os",
-                "import json",
-                f'os.write({self._fd_write}, json.dumps(dict(os.environ)).encode() + b"\\n")',
+                f"{self._DUMP_ENV_FUNC}() {{",
+                "  local name",
+                "  for name in $(compgen -e); do",
+                f'    printf \'%s=%s\\0\' "$name" "${{!name}}" >&{result_write}',
+                "  done",
+                "}",
+                f"while IFS= read -r -d '' __pyodide_cmd <&{cmd_read}; do",
+                '  eval "$__pyodide_cmd"',
+                "done",
             ]
         )
-        write_env_shell_cmd = f"{sys.executable} -c '{write_env_pycode}'"
-        cmd += "\n" + write_env_shell_cmd
-        result = subprocess.run(
-            ["bash", "-ce", cmd], pass_fds=[self._fd_write], env=self.env, **opts
+        self._proc = subprocess.Popen(
+            ["bash", "--noprofile", "--norc", "-c", init],
+            pass_fds=[cmd_read, result_write],
+            env=self.env,
+        )
+        os.close(cmd_read)
+        os.close(result_write)
+        # pass_fds keeps the file descriptor numbers in bash
+        self._result_fd_in_bash = result_write
+        self._bash_env = dict(self.env)
+        self._result_buffer = b""
+
+    def _env_diff(self) -> List[str]:
+        """Shell commands that update the environment of bash to self.env"""
+        commands = []
+        for name in self._bash_env.keys() - self.env.keys():
+            if name.isidentifier():
+                commands.append(f"unset {name}")
+        for name, value in self.env.items():
+            if self._bash_env.get(name) != value and name.isidentifier():
+                commands.append(f"export {name}={shlex.quote(value)}")
+        self._bash_env = dict(self.env)
+        return commands
+
+    def _read_result(self) -> Tuple[Dict[str, str], int]:
+        """Read the environment and the exit status of the last script"""
+        while True:
+            records = self._result_buffer.split(b"\0")
+            # The environment ends with an empty record, followed by the status
+            complete = records[:-1]
+            if b"" in complete:
+                end = complete.index(b"")
+                if end + 1 < len(complete):
+                    break
+            chunk = os.read(self._result_read, CHUNK_SIZE)
+            if not chunk:
+                raise RuntimeError("bash exited unexpectedly")
+            self._result_buffer += chunk
+        self._result_buffer = b"\0".join(records[end + 2 :])
+        env = {}
+        for record in complete[:end]:
+            name, _, value = os.fsdecode(record).partition("=")
+            if name != "_":
+                env[name] = value
+        return env, int(complete[end + 1])
+
+    def run(self, cmd, check=False, stdout=None, stderr=None):
+        """Run a bash script.
+
+        The arguments have the same meaning as for subprocess.run. stdout and
+        stderr may be None, subprocess.PIPE or subprocess.DEVNULL, and stderr
+        may also be subprocess.STDOUT.
+        """
+        if self._proc is None:
+            self._start()
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            redirects = []
+            for fd, stream in [(1, stdout), (2, stderr)]:
+                if stream is None:
+                    continue
+                elif stream == subprocess.PIPE:
+                    target = shlex.quote(str(Path(tmpdir) / str(fd)))
+                elif stream == subprocess.DEVNULL:
+                    target = "/dev/null"
+                elif fd == 2 and stream == subprocess.STDOUT:
+                    target = "&1"
+                else:
+                    raise ValueError(f"Unsupported output stream {stream!r}")
+                redirects.append(f"{fd}>{target}")
+
+            script = "; ".join(
+                self._env_diff()
+                + [
+                    f"cd -- {shlex.quote(os.getcwd())}",
+                    f"__pyodide_script={shlex.quote(cmd)}",
+                    f"( trap {self._DUMP_ENV_FUNC} EXIT; set -e; "
+                    f'eval "$__pyodide_script" ) {" ".join(redirects)}',
+                    f"printf '\\0%d\\0' \"$?\" >&{self._result_fd_in_bash}",
+                ]
+            )
+            os.write(self._cmd_write, script.encode() + b"\0")
+            self.env, returncode = self._read_result()
+
+            output = {}
+            for fd, stream in [(1, stdout), (2, stderr)]:
+                if stream == subprocess.PIPE:
+                    output[fd] = (Path(tmpdir) / str(fd)).read_bytes()
+
+        if check and returncode:
+            raise subprocess.CalledProcessError(
+                returncode, cmd, output.get(1), output.get(2)
+            )
+        return subprocess.CompletedProcess(
+            cmd, returncode, output.get(1), output.get(2)
         )
-        self.env = json.loads(self._reader.readline())
-        return result
 
     def close(self):
-        """Free the file descriptors."""
-        if self._fd_read:
-            os.close(self._fd_read)
-            os.close(self._fd_write)
-            self._fd_read = None
-            self._fd_write = None
+        """Stop the bash process and free the file descriptors."""
+        if self._proc is not None:
+            # bash exits when it can't read any more commands
+            os.close(self._cmd_write)
+            self._proc.wait()
+            os.close(self._result_read)
+            self._proc = None
 
 
-def check_checksum(path: Path, pkg: Dict[str, Any]):
+CHUNK_SIZE = 1 << 16
+
+
+def get_checksum(pkg: Dict[str, Any]) -> Optional[Tuple[str, str]]:
     """
-    Checks that a tarball matches the checksum in the package metadata.
+    Get the checksum algorithm and value of a tarball from the package
+    metadata, or None if no checksum is given.
     """
     checksum_keys = {"md5", "sha256"}.intersection(pkg["source"])
     if not checksum_keys:
-        return
+        return None
     elif len(checksum_keys) != 1:
         raise ValueError(
             "Only one checksum should be included in a package "
             "setup; found {}.".format(checksum_keys)
         )
     checksum_algorithm = checksum_keys.pop()
-    checksum = pkg["source"][checksum_algorithm]
-    CHUNK_SIZE = 1 << 16
+    return checksum_algorithm, pkg["source"][checksum_algorithm]
+
+
+def check_checksum(path: Path, pkg: Dict[str, Any]):
+    """
+    Checks that a tarball matches the checksum in the package metadata.
+    """
+    checksum_spec = get_checksum(pkg)
+    if checksum_spec is None:
+        return
+    checksum_algorithm, checksum = checksum_spec
     h = getattr(hashlib, checksum_algorithm)()
     with open(path, "rb") as fd:
         while True:
@@ -88,16 +216,32 @@ def check_checksum(path: Path, pkg: Dict[str, Any]):
         raise ValueError("Invalid {} checksum".format(checksum_algorithm))
 
 
-def download_and_extract(
-    buildpath: Path, packagedir: Path, pkg: Dict[str, Any], args
-) -> Path:
-    srcpath = buildpath / packagedir
+def download_tarball(url: str, destdir: Path, pkg: Dict[str, Any]) -> Path:
+    """
+    Download a tarball to destdir and return its path.
 
-    if "source" not in pkg:
-        return srcpath
+    The response is streamed to disk in chunks while computing the checksum.
+    The data is first written to a `.download.partial` file: if a previous
+    download was interrupted, it is resumed with an HTTP range request.
+    """
+    partial_path = destdir / ".download.partial"
+    checksum_spec = get_checksum(pkg)
+    h = hashlib.new(checksum_spec[0] if checksum_spec else "sha256")
 
-    if "url" in pkg["source"]:
-        response = request.urlopen(pkg["source"]["url"])
+    offset = partial_path.stat().st_size if partial_path.is_file() else 0
+    req = request.Request(url)
+    if offset:
+        req.add_header("Range", f"bytes={offset}-")
+    try:
+        response = request.urlopen(req)
+    except HTTPError as e:
+        if e.code != 416:
+            raise
+        # The partial download is complete or invalid, start over
+        partial_path.unlink()
+        return download_tarball(url, destdir, pkg)
+
+    with response:
         _, parameters = cgi.parse_header(
             response.headers.get("Content-Disposition", "")
         )
@@ -106,19 +250,126 @@ def download_and_extract(
         else:
             tarballname = Path(response.geturl()).name
 
-        tarballpath = buildpath / tarballname
-        if not tarballpath.is_file():
-            try:
-                os.makedirs(os.path.dirname(tarballpath), exist_ok=True)
-                with open(tarballpath, "wb") as f:
-                    f.write(response.read())
-                check_checksum(tarballpath, pkg)
-            except Exception:
-                tarballpath.unlink()
-                raise
+        if offset and response.status != 206:
+            # The server doesn't support range requests
+            offset = 0
+        os.makedirs(destdir, exist_ok=True)
+        with open(partial_path, "r+b" if offset else "wb") as fd:
+            # Hash the data of the previous download
+            while fd.tell() < offset:
+                h.update(fd.read(min(CHUNK_SIZE, offset - fd.tell())))
+            fd.seek(offset)
+            fd.truncate()
+            while True:
+                chunk = response.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                fd.write(chunk)
+                h.update(chunk)
+
+    if checksum_spec is not None and h.hexdigest() != checksum_spec[1]:
+        partial_path.unlink()
+        raise ValueError("Invalid {} checksum".format(checksum_spec[0]))
+
+    tarballpath = destdir / tarballname
+    partial_path.rename(tarballpath)
+    return tarballpath
+
+
+@contextlib.contextmanager
+def _lock_directory(directory: Path) -> Iterator[None]:
+    """Hold an exclusive lock on a directory, shared by the threads and
+    processes using it. The lock is released if the process dies."""
+    os.makedirs(directory, exist_ok=True)
+    with open(directory / ".lock", "a") as fd:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+def fetch_tarball(
+    buildpath: Path,
+    pkg: Dict[str, Any],
+    source_cache: Optional[Path] = None,
+    source_mirror: Optional[Path] = None,
+) -> Path:
+    """
+    Get the source tarball of a package and return its path.
+
+    Tarballs with a checksum are stored in source_cache, in a directory named
+    after the checksum, so they are shared across packages and rebuilds. They
+    are looked up in the same layout in source_mirror, a local directory (for
+    instance a copy of the sources directory of a build cache), before being
+    downloaded. Other tarballs are downloaded to buildpath.
+
+    The entries of source_cache are locked while they are populated, so that
+    concurrent builds don't write the same partial download: the ones
+    waiting for the lock reuse the tarball fetched by the first one.
+    """
+    url = pkg["source"]["url"]
+    checksum_spec = get_checksum(pkg)
+    if checksum_spec is None or source_cache is None:
+        return download_tarball(url, buildpath, pkg)
+
+    entry_name = "-".join(checksum_spec)
+
+    def find_tarball(directory: Path) -> Optional[Path]:
+        if not directory.is_dir():
+            return None
+        for path in directory.iterdir():
+            if path.is_file() and not path.name.startswith("."):
+                return path
+        return None
+
+    entry = source_cache / entry_name
+    tarballpath = find_tarball(entry)
+    if tarballpath is not None:
+        return tarballpath
+
+    with _lock_directory(entry):
+        # Fetched by another build while waiting for the lock
+        tarballpath = find_tarball(entry)
+        if tarballpath is not None:
+            return tarballpath
+
+        if source_mirror is not None:
+            mirror_tarball = find_tarball(source_mirror / entry_name)
+            if mirror_tarball is not None:
+                check_checksum(mirror_tarball, pkg)
+                tarballpath = entry / mirror_tarball.name
+                shutil.copyfile(mirror_tarball, entry / ".download.partial")
+                (entry / ".download.partial").rename(tarballpath)
+                return tarballpath
+
+        return download_tarball(url, entry, pkg)
+
+
+def download_and_extract(
+    buildpath: Path, packagedir: Path, pkg: Dict[str, Any], args
+) -> Path:
+    srcpath = buildpath / packagedir
+
+    if "source" not in pkg:
+        return srcpath
+
+    if "url" in pkg["source"]:
+        source_cache = None
+        source_mirror = None
+        if args is not None:
+            if args.cache_dir:
+                source_cache = Path(args.cache_dir) / "sources"
+            if args.source_mirror:
+                source_mirror = Path(args.source_mirror)
+
+        with common.build_trace.phase("download"):
+            tarballpath = fetch_tarball(buildpath, pkg, source_cache, source_mirror)
+        tarballname = tarballpath.name
 
         if not srcpath.is_dir():
-            shutil.unpack_archive(str(tarballpath), str(buildpath))
+            with common.build_trace.phase("extract"):
+                shutil.unpack_archive(str(tarballpath), str(buildpath))
 
         for extension in [
             ".tar.gz",
@@ -143,7 +394,8 @@ def download_and_extract(
             raise ValueError(f"path={srcdir} must point to a directory that exists")
 
         if not srcpath.is_dir():
-            shutil.copytree(srcdir, srcpath)
+            with common.build_trace.phase("extract"):
+                shutil.copytree(srcdir, srcpath)
 
         return srcpath
     else:
@@ -174,6 +426,85 @@ def patch(path: Path, srcpath: Path, pkg: Dict[str, Any], args):
         fd.write(b"\n")
 
 
+BUILD_PROFILES = ["default", "size", "speed", "debug"]
+
+# The optimization level of a build profile (the link optimization level also
+# selects the wasm-opt passes), and whether it keeps the debug info
+PROFILE_FLAGS = {
+    "size": ("-Oz", False),
+    "speed": ("-O3", False),
+    "debug": ("-O0", True),
+}
+
+
+def get_build_profile(pkg: Dict[str, Any], args) -> str:
+    """
+    The build profile of a package, given by ``build/profile`` in its
+    meta.yaml or else by ``args.build_profile``:
+
+    - "default": the flags of Makefile.envs, i.e. -O2 -g
+    - "size": -Oz without debug info, for packages which are rarely hot
+    - "speed": -O3 without debug info
+    - "debug": -O0 with debug info, also kept by the link
+
+    The profile adjusts the cflags, cxxflags and ldflags of ``args`` (see
+    get_compiler_flags). The flags in ``build/cflags`` and ``build/ldflags``
+    come after them and take precedence.
+    """
+    profile = pkg.get("build", {}).get("profile", args.build_profile)
+    if profile not in BUILD_PROFILES:
+        raise ValueError(
+            f"Unknown build profile {profile!r} of package "
+            f"{pkg['package']['name']}, expected one of " + ", ".join(BUILD_PROFILES)
+        )
+    return profile
+
+
+def apply_build_profile(flags: str, profile: str) -> str:
+    """Replace the optimization and debug flags of compiler or linker flags
+    with the ones of a build profile
+
+    >>> apply_build_profile("-O2 -g -fPIC", "size")
+    '-Oz -fPIC'
+    >>> apply_build_profile("-O2 -fPIC", "debug")
+    '-O0 -fPIC -g'
+    """
+    if profile == "default":
+        return flags
+    optflag, debug = PROFILE_FLAGS[profile]
+    new_flags = []
+    for flag in flags.split():
+        if re.fullmatch(r"-O[0-4sz]", flag):
+            new_flags.append(optflag)
+        elif not re.fullmatch(r"-g[0-3]?", flag):
+            new_flags.append(flag)
+    if debug:
+        new_flags.append("-g")
+    return " ".join(new_flags)
+
+
+def get_compiler_flags(pkg: Dict[str, Any], args) -> Tuple[str, str, str]:
+    """
+    The cflags, cxxflags and ldflags passed to pywasmcross: the flags of
+    ``args`` adjusted to the build profile of the package, followed by the
+    flags of its meta.yaml.
+
+    C++ sources are compiled with the cflags followed by the cxxflags, so the
+    profile is applied to the whole cxxflags, including ``build/cxxflags``:
+    their optimization and debug flags would otherwise override it.
+    """
+    profile = get_build_profile(pkg, args)
+    build = pkg.get("build", {})
+    cflags = apply_build_profile(args.cflags, profile) + " " + build.get("cflags", "")
+    cxxflags = apply_build_profile(
+        args.cxxflags + " " + build.get("cxxflags", ""), profile
+    )
+    ldflags = (
+        apply_build_profile(args.ldflags, profile) + " " + build.get("ldflags", "")
+    )
+    return cflags, cxxflags, ldflags
+
+
 def compile(path: Path, srcpath: Path, pkg: Dict[str, Any], args, bash_runner):
     if (srcpath / ".built").is_file():
         return
@@ -183,6 +514,20 @@ def compile(path: Path, srcpath: Path, pkg: Dict[str, Any], args, bash_runner):
     if pkg.get("build", {}).get("skip_host", True):
         bash_runner.env["SKIP_HOST"] = ""
 
+    cflags, cxxflags, ldflags = get_compiler_flags(pkg, args)
+    f2c_cache = str(Path(args.cache_dir) / "f2c") if args.cache_dir else ""
+    build_log_cache = ""
+    if args.reuse_build_log and args.cache_dir:
+        name = pkg["package"]["name"]
+        build_log_cache = str(
+            Path(args.cache_dir) / "build-logs" / f"{name}-{pkg['package']['version']}"
+        )
+    object_cache = ""
+    if args.reuse_objects and args.cache_dir:
+        object_cache = str(Path(args.cache_dir) / "objects" / pkg["package"]["name"])
+    # pywasmcross records its own phases, which are merged into ours
+    pywasmcross_trace = srcpath / ".pywasmcross-trace.json"
+
     try:
         subprocess.run(
             [
@@ -191,23 +536,40 @@ def compile(path: Path, srcpath: Path, pkg: Dict[str, Any], args, bash_runner):
                 "pyodide_build",
                 "pywasmcross",
                 "--cflags",
-                args.cflags + " " + pkg.get("build", {}).get("cflags", ""),
+                cflags,
                 "--cxxflags",
-                args.cxxflags + " " + pkg.get("build", {}).get("cxxflags", ""),
+                cxxflags,
                 "--ldflags",
-                args.ldflags + " " + pkg.get("build", {}).get("ldflags", ""),
+                ldflags,
                 "--target",
                 args.target,
                 "--install-dir",
                 args.install_dir,
                 "--replace-libs",
                 ";".join(pkg.get("build", {}).get("replace-libs", [])),
+                "--jobs",
+                str(args.replay_jobs),
+                "--f2c-cache",
+                f2c_cache,
+                "--build-log-cache",
+                build_log_cache,
+                "--object-cache",
+                object_cache,
+                "--trace-file",
+                str(pywasmcross_trace) if args.trace_file else "",
             ],
             check=True,
             env=bash_runner.env,
         )
     finally:
         os.chdir(orig_dir)
+        if pywasmcross_trace.is_file():
+            common.build_trace.merge(
+                common.BuildTrace.load(pywasmcross_trace),
+                pid=os.getpid(),
+                tid=threading.get_ident(),
+            )
+            pywasmcross_trace.unlink()
 
     post = pkg.get("build", {}).get("post")
     if post is not None:
@@ -225,38 +587,275 @@ def compile(path: Path, srcpath: Path, pkg: Dict[str, Any], args, bash_runner):
         bash_runner.env.update(
             {"SITEPACKAGES": str(site_packages_dir), "PKGDIR": str(pkgdir)}
         )
-        bash_runner.run(post, check=True)
+        with common.build_trace.phase("post"):
+            bash_runner.run(post, check=True)
 
     with open(srcpath / ".built", "wb") as fd:
         fd.write(b"\n")
 
 
+PACKAGE_FORMATS = ["data", "zip"]
+
+
+def get_package_format(pkg: Dict[str, Any], args) -> str:
+    """
+    The format in which a package is output, as requested by
+    ``args.package_format``:
+
+    - "data": a ``.data`` file with the contents of the package, and a ``.js``
+      file that installs it, generated by the Emscripten file packager.
+    - "zip": a ``.zip`` archive from which the Python modules are only
+      extracted when they are imported, opened or listed, see
+      ``_pyodide._importhook.ZipPackageFinder``.
+
+    Library and shared library packages are always output as "data". Shared
+    libraries are loaded by the preload plugins of the file packager before
+    the packages that depend on them.
+    """
+    build = pkg.get("build", {})
+    if build.get("library") or build.get("sharedlibrary"):
+        return "data"
+    return args.package_format
+
+
+COMPRESSIONS = ["lz4", "none", "gzip", "brotli"]
+
+# Suffix of the precompressed copies of the bundles, by compression
+PRECOMPRESSED_SUFFIXES = {"gzip": ".gz", "brotli": ".br"}
+
+
+def get_compression(pkg: Dict[str, Any], args) -> str:
+    """
+    The compression of the bundle of a package, given by ``build/compression``
+    in its meta.yaml or else by ``args.compression``:
+
+    - "lz4": the file packager compresses the files with LZ4, and they are
+      decompressed in the runtime when they are read. The members of zip
+      packages are compressed with deflate.
+    - "none": the bundle is not compressed.
+    - "gzip", "brotli": the bundle is not compressed, and a precompressed copy
+      of it (see PRECOMPRESSED_SUFFIXES) is written next to it. Web servers
+      which support precompressed files serve it with a Content-Encoding, so
+      that it is decompressed by the browser while it is downloaded.
+    """
+    compression = pkg.get("build", {}).get("compression", args.compression)
+    if compression not in COMPRESSIONS:
+        raise ValueError(
+            f"Unknown compression {compression!r} of package "
+            f"{pkg['package']['name']}, expected one of " + ", ".join(COMPRESSIONS)
+        )
+    return compression
+
+
+def package_output_files(
+    name: str, package_format: str, compression: str = "lz4"
+) -> List[str]:
+    """The files making up a package in the given format and compression"""
+    if package_format == "zip":
+        files = [name + ".zip"]
+    else:
+        files = [name + ".data", name + ".js"]
+    if compression in PRECOMPRESSED_SUFFIXES:
+        files.append(files[0] + PRECOMPRESSED_SUFFIXES[compression])
+    return files
+
+
+def precompress(path: Path, compression: str) -> Path:
+    """
+    Write a copy of a file compressed with gzip or brotli next to it, and
+    return its path. brotli needs the brotli module.
+    """
+    data = path.read_bytes()
+    if compression == "gzip":
+        compressed = gzip.compress(data, compresslevel=9, mtime=0)
+    elif compression == "brotli":
+        try:
+            import brotli
+        except ImportError:
+            raise RuntimeError(
+                "The brotli module is needed to compress packages with brotli. "
+                "Install it with: pip install brotli"
+            ) from None
+        compressed = brotli.compress(data, quality=11)
+    else:
+        raise ValueError(f"Can't precompress with {compression}")
+    output = path.with_name(path.name + PRECOMPRESSED_SUFFIXES[compression])
+    output.write_bytes(compressed)
+    return output
+
+
+def make_zip_package(
+    zip_path: Path,
+    install_prefix: Path,
+    include_pycache: bool = False,
+    compression: int = zipfile.ZIP_DEFLATED,
+):
+    """
+    Archive the installed files of a package. The paths in the archive are
+    relative to the root of the Emscripten filesystem.
+    """
+    with zipfile.ZipFile(zip_path, "w", compression=compression) as zf:
+        for file in sorted(install_prefix.rglob("*")):
+            if not file.is_file():
+                continue
+            if "__pycache__" in file.parts and not include_pycache:
+                continue
+            zf.write(file, file.relative_to(install_prefix))
+
+
+def compile_bytecode(install_prefix: Path, hostpython: str, strip_sources: bool):
+    """
+    Compile the Python modules of a package to bytecode.
+
+    Pyodide doesn't write bytecode, so without this every module is compiled
+    each time it is imported. The bytecode is compiled by the host Python,
+    which has the same version as the target Python. The ``.pyc`` files are
+    not checked against the sources, whose modification times aren't
+    preserved by the file packager.
+
+    Parameters
+    ----------
+    install_prefix
+        the directory where the package is installed
+    hostpython
+        the host Python executable
+    strip_sources
+        if True, the ``.pyc`` files replace the ``.py`` files of the modules
+        instead of going into ``__pycache__``
+    """
+    for pycache in list(install_prefix.rglob("__pycache__")):
+        shutil.rmtree(pycache)
+    # Modules with syntax errors (e.g. for another Python version) are left
+    # uncompiled and keep their sources
+    subprocess.run(
+        [hostpython, "-m", "compileall", "-q", "-j", "0"]
+        + ["--invalidation-mode", "unchecked-hash"]
+        + (["-b"] if strip_sources else [])
+        + [str(install_prefix)],
+        check=False,
+    )
+    if strip_sources:
+        for source in install_prefix.rglob("*.py"):
+            if source.with_suffix(".pyc").is_file():
+                source.unlink()
+
+
 def package_files(buildpath: Path, srcpath: Path, pkg: Dict[str, Any], args):
     if (buildpath / ".packaged").is_file():
         return
 
     name = pkg["package"]["name"]
     install_prefix = (srcpath / "install").resolve()
-    subprocess.run(
-        [
-            str(common.file_packager_path()),
-            name + ".data",
-            "--js-output={}".format(name + ".js"),
-            "--preload",
-            "{}@/".format(install_prefix),
-        ],
-        cwd=buildpath,
-        check=True,
-    )
-    subprocess.run(
-        ["uglifyjs", buildpath / (name + ".js"), "-o", buildpath / (name + ".js")],
-        check=True,
-    )
+    compression = get_compression(pkg, args)
+    if args.compile_bytecode:
+        with common.build_trace.phase("compile_bytecode"):
+            compile_bytecode(
+                install_prefix, common.get_make_flag("HOSTPYTHON"), args.strip_sources
+            )
+    if get_package_format(pkg, args) == "zip":
+        with common.build_trace.phase("zip"):
+            make_zip_package(
+                buildpath / (name + ".zip"),
+                install_prefix,
+                include_pycache=args.compile_bytecode,
+                compression=(
+                    zipfile.ZIP_DEFLATED if compression == "lz4" else zipfile.ZIP_STORED
+                ),
+            )
+        if compression in PRECOMPRESSED_SUFFIXES:
+            with common.build_trace.phase("precompress"):
+                precompress(buildpath / (name + ".zip"), compression)
+        with open(buildpath / ".packaged", "wb") as fd:
+            fd.write(b"\n")
+        return
+
+    with common.build_trace.phase("file_packager"):
+        subprocess.run(
+            [
+                str(common.file_packager_path()),
+                name + ".data",
+                "--js-output={}".format(name + ".js"),
+                "--preload",
+                "{}@/".format(install_prefix),
+            ],
+            cwd=buildpath,
+            check=True,
+            env=dict(
+                os.environ,
+                PYODIDE_PACKAGE_PYCACHE="1" if args.compile_bytecode else "",
+                PYODIDE_PACKAGE_COMPRESSION=compression,
+            ),
+        )
+    with common.build_trace.phase("uglifyjs"):
+        subprocess.run(
+            ["uglifyjs", buildpath / (name + ".js"), "-o", buildpath / (name + ".js")],
+            check=True,
+        )
+    if compression in PRECOMPRESSED_SUFFIXES:
+        with common.build_trace.phase("precompress"):
+            precompress(buildpath / (name + ".data"), compression)
 
     with open(buildpath / ".packaged", "wb") as fd:
         fd.write(b"\n")
 
 
+def find_install_prefix(pkg_root: Path) -> Optional[Path]:
+    """
+    The directory where the files of a package were installed by its last
+    build. It is missing when the package was restored from the build cache.
+    """
+    install_prefixes = list((pkg_root / "build").glob("*/install"))
+    if len(install_prefixes) != 1:
+        return None
+    return install_prefixes[0]
+
+
+def package_installed_subset(
+    pkg: Dict[str, Any],
+    install_prefix: Path,
+    paths: Iterable[str],
+    outputdir: Path,
+    args,
+) -> List[str]:
+    """
+    Package some of the installed files of a package, and copy the packaged
+    files (see package_output_files) to outputdir.
+
+    Parameters
+    ----------
+    pkg
+        the package metadata
+    install_prefix
+        the directory where the package is installed
+    paths
+        the paths of the files to package, relative to install_prefix
+    outputdir
+        the directory where the packaged files are copied
+    args
+        the arguments of package_files
+
+    Returns
+    -------
+    The names of the packaged files.
+    """
+    name = pkg["package"]["name"]
+    with tempfile.TemporaryDirectory() as tmp:
+        buildpath = Path(tmp)
+        srcpath = buildpath / "src"
+        (srcpath / "install").mkdir(parents=True)
+        for path in paths:
+            target = srcpath / "install" / path
+            target.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copy2(install_prefix / path, target)
+        package_files(buildpath, srcpath, pkg, args)
+        files = package_output_files(
+            name, get_package_format(pkg, args), get_compression(pkg, args)
+        )
+        for file in files:
+            shutil.copyfile(buildpath / file, outputdir / file)
+    return files
+
+
 def run_script(buildpath: Path, srcpath: Path, pkg: Dict[str, Any], bash_runner):
     if pkg.get("build", {}).get("library"):
         # in libraries this  writes the packaged flag
@@ -278,15 +877,25 @@ def run_script(buildpath: Path, srcpath: Path, pkg: Dict[str, Any], bash_runner)
             fd.write(b"\n")
 
 
-def needs_rebuild(pkg: Dict[str, Any], path: Path, buildpath: Path) -> bool:
+def needs_rebuild(
+    pkg: Dict[str, Any], path: Path, buildpath: Path, cache_key: Optional[str] = None
+) -> bool:
     """
-    Determines if a package needs a rebuild because its meta.yaml, patches, or
+    Determines if a package needs a rebuild.
+
+    If the `.packaged` thunk records a cache key (see `compute_cache_key`), the
+    package needs a rebuild exactly when that key differs from `cache_key`.
+    Otherwise we fall back to checking whether its meta.yaml, patches, or
     sources are newer than the `.packaged` thunk.
     """
     packaged_token = buildpath / ".packaged"
     if not packaged_token.is_file():
         return True
 
+    packaged_key = packaged_token.read_text().strip()
+    if cache_key is not None and packaged_key:
+        return packaged_key != cache_key
+
     package_time = packaged_token.stat().st_mtime
 
     def source_files():
@@ -301,7 +910,140 @@ def needs_rebuild(pkg: Dict[str, Any], path: Path, buildpath: Path) -> bool:
     return False
 
 
-def build_package(path: Path, args):
+def compute_cache_key(path: Path, args, _keys: Optional[Dict[Path, str]] = None) -> str:
+    """
+    Compute the content-addressed cache key of a package.
+
+    The key is a sha256 hash of the meta.yaml file, the contents of the patches,
+    extras and local source directory, the compiler flags, the Emscripten
+    version, and (recursively) the cache keys of all the run requirements.
+
+    Parameters
+    ----------
+    path
+        path to the meta.yaml of the package
+    args
+        build arguments, in particular ``args.cflags``, ``args.cxxflags`` and
+        ``args.ldflags``
+    _keys
+        memo of already computed keys, indexed by meta.yaml path
+
+    Returns
+    -------
+    the hex digest of the cache key
+    """
+    if _keys is None:
+        _keys = {}
+    path = path.resolve()
+    if path in _keys:
+        return _keys[path]
+    # Guard against dependency cycles
+    _keys[path] = ""
+
+    pkg = parse_package_config(path)
+    pkgdir = path.parent
+    h = hashlib.sha256()
+
+    def update(*chunks):
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            h.update(len(chunk).to_bytes(8, "little"))
+            h.update(chunk)
+
+    update("meta.yaml", path.read_bytes())
+    source = pkg.get("source", {})
+    for patch_name in source.get("patches", []):
+        update("patch", patch_name, (pkgdir / patch_name).read_bytes())
+    for src, dst in source.get("extras", []):
+        update("extra", src, dst, (pkgdir / src).read_bytes())
+    if "path" in source:
+        srcdir = pkgdir / source["path"]
+        for file in sorted(srcdir.rglob("*")):
+            if file.is_file() and "__pycache__" not in file.parts:
+                update("source", str(file.relative_to(srcdir)), file.read_bytes())
+
+    update("cflags", args.cflags, "cxxflags", args.cxxflags, "ldflags", args.ldflags)
+    update("emscripten", common.get_make_flag("PYODIDE_EMSCRIPTEN_VERSION"))
+    update("format", get_package_format(pkg, args))
+    update("compression", get_compression(pkg, args))
+    update("profile", get_build_profile(pkg, args))
+    update("bytecode", str(args.compile_bytecode), str(args.strip_sources))
+
+    for dep in sorted(pkg.get("requirements", {}).get("run", [])):
+        dep_path = pkgdir.parent / dep / "meta.yaml"
+        if not dep_path.is_file():
+            # unvendored stdlib modules don't have a meta.yaml
+            update("dependency", dep)
+            continue
+        update("dependency", dep, compute_cache_key(dep_path, args, _keys))
+
+    key = h.hexdigest()
+    _keys[path] = key
+    return key
+
+
+def restore_from_cache(
+    buildpath: Path,
+    name: str,
+    cache_key: str,
+    cache_dir: Path,
+    package_format: str = "data",
+    compression: str = "lz4",
+) -> bool:
+    """
+    Restore the packaged files of a package (see package_output_files) from
+    the build cache. Returns True on a cache hit.
+    """
+    entry = cache_dir / "packages" / name / cache_key
+    files = package_output_files(name, package_format, compression)
+    if not all((entry / file).is_file() for file in files):
+        return False
+    os.makedirs(buildpath, exist_ok=True)
+    for file in files:
+        shutil.copyfile(entry / file, buildpath / file)
+    return True
+
+
+def store_in_cache(
+    buildpath: Path,
+    name: str,
+    cache_key: str,
+    cache_dir: Path,
+    package_format: str = "data",
+    compression: str = "lz4",
+):
+    """
+    Store the packaged files of a package (see package_output_files) in the
+    build cache.
+    """
+    entry = cache_dir / "packages" / name / cache_key
+    if entry.is_dir():
+        return
+    os.makedirs(entry.parent, exist_ok=True)
+    # Populate a temporary directory and rename it so that concurrent builds
+    # never see a partially written entry.
+    tmpdir = Path(tempfile.mkdtemp(dir=entry.parent))
+    try:
+        for file in package_output_files(name, package_format, compression):
+            shutil.copyfile(buildpath / file, tmpdir / file)
+        tmpdir.rename(entry)
+    except OSError:
+        if entry.is_dir():
+            # Another build stored the same entry in the meantime
+            return
+        raise
+    finally:
+        if tmpdir.is_dir():
+            shutil.rmtree(tmpdir)
+
+
+# Outcomes of build_package, written to --status-file for buildall
+BUILD_STATUSES = ["built", "restored", "up to date"]
+
+
+def build_package(path: Path, args) -> str:
+    """Build a package, and return how it was built, see BUILD_STATUSES"""
     pkg = parse_package_config(path)
     name = pkg["package"]["name"]
     t0 = datetime.now()
@@ -312,27 +1054,67 @@ def build_package(path: Path, args):
     os.chdir(dirpath)
     buildpath = dirpath / "build"
     bash_runner = BashRunnerWithSharedEnvironment()
+    # Library and shared library packages are not cached: their build trees
+    # and installed files are consumed by the packages that depend on them.
+    build_info = pkg.get("build", {})
+    cacheable = not (build_info.get("library") or build_info.get("sharedlibrary"))
+    cache_dir = Path(args.cache_dir) if args.cache_dir and cacheable else None
+    package_format = get_package_format(pkg, args)
+    compression = get_compression(pkg, args)
     try:
-        if not needs_rebuild(pkg, path, buildpath):
-            return
+        cache_key = compute_cache_key(path, args)
+        if not needs_rebuild(pkg, path, buildpath, cache_key):
+            return "up to date"
         if "source" in pkg:
             if buildpath.resolve().is_dir():
                 shutil.rmtree(buildpath)
             os.makedirs(buildpath)
-        srcpath = download_and_extract(buildpath, packagedir, pkg, args)
-        patch(path, srcpath, pkg, args)
-        if pkg.get("build", {}).get("script"):
-            run_script(buildpath, srcpath, pkg, bash_runner)
-        if not pkg.get("build", {}).get("library", False):
-            # shared libraries get built by the script and put into install
-            # subfolder, then packaged into a pyodide module
-            # i.e. they need package running, but not compile
-            if not pkg.get("build", {}).get("sharedlibrary"):
-                compile(path, srcpath, pkg, args, bash_runner)
-            package_files(buildpath, srcpath, pkg, args)
+        if cache_dir is not None:
+            with common.build_trace.phase("restore_from_cache"):
+                restored = restore_from_cache(
+                    buildpath, name, cache_key, cache_dir, package_format, compression
+                )
+        else:
+            restored = False
+        if restored:
+            print(f"Restored {name} from the build cache ({cache_key[:12]})")
+        else:
+            srcpath = download_and_extract(buildpath, packagedir, pkg, args)
+            with common.build_trace.phase("patch"):
+                patch(path, srcpath, pkg, args)
+            if build_info.get("script"):
+                with common.build_trace.phase("script"):
+                    run_script(buildpath, srcpath, pkg, bash_runner)
+            if not build_info.get("library", False):
+                # shared libraries get built by the script and put into install
+                # subfolder, then packaged into a pyodide module
+                # i.e. they need package running, but not compile
+                if not build_info.get("sharedlibrary"):
+                    with common.build_trace.phase("compile"):
+                        compile(path, srcpath, pkg, args, bash_runner)
+                package_files(buildpath, srcpath, pkg, args)
+            if cache_dir is not None:
+                with common.build_trace.phase("store_in_cache"):
+                    store_in_cache(
+                        buildpath,
+                        name,
+                        cache_key,
+                        cache_dir,
+                        package_format,
+                        compression,
+                    )
+        # Record the key so that needs_rebuild can compare contents rather
+        # than modification times
+        with open(buildpath / ".packaged", "w") as fd:
+            fd.write(cache_key + "\n")
+        return "restored" if restored else "built"
     finally:
         bash_runner.close()
         os.chdir(orig_path)
+        if args.trace_file:
+            trace_file = Path(args.trace_file)
+            trace_file.parent.mkdir(parents=True, exist_ok=True)
+            common.build_trace.save(trace_file)
         t1 = datetime.now()
         print(
             "[{}] done building package {} in {:.1f} s.".format(
@@ -389,12 +1171,134 @@ def make_parser(parser: argparse.ArgumentParser):
             "needed if you want to build other packages that depend on this one."
         ),
     )
+    parser.add_argument(
+        "--cache-dir",
+        type=str,
+        nargs="?",
+        default=str(common.get_build_cache_dir()),
+        help=(
+            "Directory of the content-addressed cache of built packages. "
+            "Set to an empty string to disable the cache."
+        ),
+    )
+    parser.add_argument(
+        "--source-mirror",
+        type=str,
+        nargs="?",
+        default="",
+        help=(
+            "Local directory to look up source tarballs in before downloading "
+            "them. It has the same layout as the sources directory of the "
+            "cache directory."
+        ),
+    )
+    parser.add_argument(
+        "--reuse-build-log",
+        action="store_true",
+        help=(
+            "Cache the compiler commands captured by the native build in the "
+            "cache directory, and skip the native build when the source tree "
+            "is unchanged"
+        ),
+    )
+    parser.add_argument(
+        "--reuse-objects",
+        action="store_true",
+        help=(
+            "Cache the objects compiled by emscripten in the cache directory, "
+            "and reuse them when the compiler command and the preprocessed "
+            "source are unchanged"
+        ),
+    )
+    parser.add_argument(
+        "--replay-jobs",
+        type=int,
+        default=os.cpu_count(),
+        help=(
+            "Number of compiler commands to replay in parallel. Defaults to "
+            "the number of CPUs; buildall passes the CPU share of the package."
+        ),
+    )
+    parser.add_argument(
+        "--package-format",
+        type=str,
+        choices=PACKAGE_FORMATS,
+        default="data",
+        help=(
+            "Output the package as a .data and a .js file generated by the "
+            "Emscripten file packager (data), or as a zip archive from which "
+            "Python modules are extracted when they are imported, opened or "
+            "listed (zip)"
+        ),
+    )
+    parser.add_argument(
+        "--compression",
+        type=str,
+        choices=COMPRESSIONS,
+        default="lz4",
+        help=(
+            "Compression of the package, unless given by build/compression in its "
+            "meta.yaml: lz4 (decompressed in the runtime), none, or gzip and "
+            "brotli (precompressed copies served with a Content-Encoding)"
+        ),
+    )
+    parser.add_argument(
+        "--build-profile",
+        type=str,
+        choices=BUILD_PROFILES,
+        default="default",
+        help=(
+            "Optimization profile of the package, unless given by build/profile "
+            "in its meta.yaml: default (-O2 -g), size (-Oz), speed (-O3) or "
+            "debug (-O0 -g)"
+        ),
+    )
+    parser.add_argument(
+        "--compile-bytecode",
+        action="store_true",
+        help=(
+            "Compile the Python modules of the package to bytecode with the "
+            "host Python, and package the .pyc files"
+        ),
+    )
+    parser.add_argument(
+        "--strip-sources",
+        action="store_true",
+        help=(
+            "With --compile-bytecode, package the .pyc files instead of the "
+            ".py files of the modules"
+        ),
+    )
+    parser.add_argument(
+        "--status-file",
+        type=str,
+        nargs="?",
+        default="",
+        help=(
+            "Write the outcome of the build to this file: built, restored "
+            "(from the build cache) or up to date"
+        ),
+    )
+    parser.add_argument(
+        "--trace-file",
+        type=str,
+        nargs="?",
+        default="",
+        help=(
+            "Write the duration and the peak memory of the build phases to "
+            "this file, in the Chrome trace event format"
+        ),
+    )
     return parser
 
 
 def main(args):
     path = Path(args.package[0]).resolve()
-    build_package(path, args)
+    status = build_package(path, args)
+    if args.status_file:
+        status_file = Path(args.status_file)
+        status_file.parent.mkdir(parents=True, exist_ok=True)
+        status_file.write_text(status + "\n")
 
 
 if __name__ == "__main__":
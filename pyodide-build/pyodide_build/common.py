@@ -1,7 +1,15 @@
 from pathlib import Path
-from typing import Optional, Set
+from typing import Any, Dict, Iterator, List, Optional, Set
+import atexit
+import contextlib
+import json
+import os
 import subprocess
 import functools
+import sys
+import tempfile
+import threading
+import time
 
 UNVENDORED_STDLIB_MODULES = ["test", "distutils"]
 
@@ -63,11 +71,130 @@ def _parse_package_subset(query: Optional[str]) -> Optional[Set[str]]:
     return packages
 
 
+def _max_child_rss_kb() -> int:
+    """Peak resident set size (in kB) of the child processes waited for so far
+    by this process: a running maximum, not the peak of the current phase"""
+    import resource
+
+    max_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    if sys.platform == "darwin":
+        # ru_maxrss is in bytes on macOS
+        max_rss //= 1024
+    return max_rss
+
+
+class BuildTrace:
+    """Record the phases of a build as Chrome trace events.
+
+    The resulting file can be opened in chrome://tracing or
+    https://ui.perfetto.dev. Timestamps are taken from the wall clock so that
+    traces of different processes can be merged into one timeline.
+    """
+
+    def __init__(self):
+        self.events: List[Dict[str, Any]] = []
+
+    def add_event(
+        self,
+        name: str,
+        start: float,
+        end: float,
+        pid: Optional[int] = None,
+        tid: Optional[int] = None,
+        **args,
+    ):
+        """Add a complete event, with start and end times in seconds"""
+        self.events.append(
+            {
+                "name": name,
+                "ph": "X",
+                "ts": int(start * 1e6),
+                "dur": int((end - start) * 1e6),
+                "pid": os.getpid() if pid is None else pid,
+                "tid": threading.get_ident() if tid is None else tid,
+                "args": args,
+            }
+        )
+
+    @contextlib.contextmanager
+    def phase(self, name: str, **args) -> Iterator[None]:
+        """Record the duration of the enclosed block.
+
+        The peak RSS of the child processes of the whole process so far is
+        recorded as max_child_rss_kb_so_far. The OS only keeps this running
+        maximum, so the peak of the child processes of the block is only known
+        when the block raises it: it is then recorded as max_child_rss_kb.
+        """
+        start = time.time()
+        rss_before = _max_child_rss_kb()
+        try:
+            yield
+        finally:
+            rss_after = _max_child_rss_kb()
+            if rss_after > rss_before:
+                args["max_child_rss_kb"] = rss_after
+            self.add_event(
+                name, start, time.time(), max_child_rss_kb_so_far=rss_after, **args
+            )
+
+    def merge(
+        self,
+        events: List[Dict[str, Any]],
+        pid: Optional[int] = None,
+        tid: Optional[int] = None,
+    ):
+        """Add events recorded by another process, optionally moving them to
+        another process or thread lane"""
+        for event in events:
+            event = dict(event)
+            if pid is not None:
+                event["pid"] = pid
+            if tid is not None:
+                event["tid"] = tid
+            self.events.append(event)
+
+    def set_thread_name(self, tid: int, name: str):
+        self.events.append(
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": os.getpid(),
+                "tid": tid,
+                "args": {"name": name},
+            }
+        )
+
+    def save(self, path: Path):
+        with open(path, "w") as fd:
+            json.dump({"traceEvents": self.events}, fd)
+
+    @staticmethod
+    def load(path: Path) -> List[Dict[str, Any]]:
+        with open(path, "r") as fd:
+            return json.load(fd)["traceEvents"]
+
+
+# Phases of the build in the current process, saved with --trace-file
+build_trace = BuildTrace()
+
+
 def file_packager_path() -> Path:
     ROOTDIR = Path(__file__).parents[2].resolve()
     return ROOTDIR / "tools" / "file_packager.sh"
 
 
+def get_build_cache_dir() -> Path:
+    """Get the directory where pyodide-build caches build artifacts.
+
+    This is $PYODIDE_BUILD_CACHE if set, otherwise pyodide-build in the user
+    cache directory ($XDG_CACHE_HOME or ~/.cache).
+    """
+    if "PYODIDE_BUILD_CACHE" in os.environ:
+        return Path(os.environ["PYODIDE_BUILD_CACHE"])
+    cache_home = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(cache_home) / "pyodide-build"
+
+
 def get_make_flag(name):
     """Get flags from makefile.envs.
 
@@ -80,16 +207,71 @@ def get_make_flag(name):
     return get_make_environment_vars()[name]
 
 
+# Resolving the variables of Makefile.envs runs make, a shell and Python. The
+# first process of a build saves them into a file whose path it exports in
+# this environment variable, so that its child processes (buildpkg, the
+# compiler wrappers of pywasmcross, ...) read them instead.
+MAKE_ENVIRONMENT_CACHE_VAR = "PYODIDE_MAKE_ENVIRONMENT_CACHE"
+
+
+def _makefile_envs_stamp(makefile_envs: Path) -> List[Any]:
+    stat = makefile_envs.stat()
+    return [str(makefile_envs), stat.st_mtime_ns, stat.st_size]
+
+
+def _read_make_environment_cache(stamp: List[Any]) -> Optional[Dict[str, str]]:
+    """Read the saved variables, if they were resolved from the same
+    Makefile.envs"""
+    path = os.environ.get(MAKE_ENVIRONMENT_CACHE_VAR)
+    if not path:
+        return None
+    try:
+        cache = json.loads(Path(path).read_text())
+    except (OSError, ValueError):
+        return None
+    if not isinstance(cache, dict) or cache.get("stamp") != stamp:
+        return None
+    return cache.get("vars")
+
+
+def _write_make_environment_cache(stamp: List[Any], environment: Dict[str, str]):
+    """Save the variables for the child processes, see
+    MAKE_ENVIRONMENT_CACHE_VAR"""
+    path = os.environ.get(MAKE_ENVIRONMENT_CACHE_VAR)
+    if not path:
+        fd, path = tempfile.mkstemp(prefix="pyodide-make-environment-", suffix=".json")
+        os.close(fd)
+        atexit.register(_remove_file, path)
+        os.environ[MAKE_ENVIRONMENT_CACHE_VAR] = path
+    # Written atomically, as other processes of the build may read it
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    Path(tmp_path).write_text(json.dumps({"stamp": stamp, "vars": environment}))
+    os.replace(tmp_path, path)
+
+
+def _remove_file(path: str):
+    with contextlib.suppress(OSError):
+        os.unlink(path)
+
+
 @functools.lru_cache(maxsize=None)
 def get_make_environment_vars():
     """Load environment variables from Makefile.envs
 
-    This allows us to set all build vars in one place"""
+    This allows us to set all build vars in one place. The variables are
+    resolved once per build: they are read from the file saved by a parent
+    process, unless Makefile.envs changed since (see
+    MAKE_ENVIRONMENT_CACHE_VAR)."""
     # TODO: make this not rely on paths outside of pyodide-build
     __ROOTDIR = Path(__file__).parents[2].resolve()
+    makefile_envs = __ROOTDIR / "Makefile.envs"
+    stamp = _makefile_envs_stamp(makefile_envs)
+    cached = _read_make_environment_cache(stamp)
+    if cached is not None:
+        return cached
     environment = {}
     result = subprocess.run(
-        ["make", "-f", str(__ROOTDIR / "Makefile.envs"), ".output_vars"],
+        ["make", "-f", str(makefile_envs), ".output_vars"],
         capture_output=True,
         text=True,
     )
@@ -100,4 +282,6 @@ def get_make_environment_vars():
             value = line[equalPos + 1 :]
             value = value.strip("'").strip()
             environment[varname] = value
+    if result.returncode == 0:
+        _write_make_environment_cache(stamp, environment)
     return environment
@@ -0,0 +1,258 @@
+/*
+ * Compiler wrapper used by pywasmcross capture_compile.
+ *
+ * This does the same as pywasmcross.collect_args without starting Python: it
+ * is installed under the names of the compilers and linkers, appends its
+ * arguments to build.log as a JSON list (in the format written by Python's
+ * json.dump), and executes the real compiler.
+ *
+ * capture_compile passes the settings in the environment:
+ *  - PYWASMCROSS_HOST_PATH: PATH without the directory of the wrappers
+ *  - PYWASMCROSS_CCACHE: the path to ccache, if it is installed
+ *  - SKIP_HOST: skip the compilation, only create the output file
+ */
+
+#include <errno.h>
+#include <fcntl.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <unistd.h>
+
+struct buffer
+{
+  char* data;
+  size_t size;
+  size_t capacity;
+};
+
+static void
+buffer_append(struct buffer* buf, const char* data, size_t size)
+{
+  if (buf->size + size > buf->capacity) {
+    buf->capacity = 2 * (buf->size + size);
+    buf->data = realloc(buf->data, buf->capacity);
+    if (buf->data == NULL) {
+      perror("pywasmcross");
+      exit(1);
+    }
+  }
+  memcpy(buf->data + buf->size, data, size);
+  buf->size += size;
+}
+
+static void
+buffer_append_escape(struct buffer* buf, unsigned int code)
+{
+  char escape[7];
+  snprintf(escape, sizeof(escape), "\\u%04x", code);
+  buffer_append(buf, escape, 6);
+}
+
+/*
+ * Decode a UTF-8 sequence. Returns its length, or 0 if it is invalid.
+ */
+static size_t
+decode_utf8(const unsigned char* s, unsigned int* code)
+{
+  size_t length;
+  unsigned int min;
+  if (s[0] < 0x80) {
+    *code = s[0];
+    return 1;
+  } else if ((s[0] & 0xe0) == 0xc0) {
+    length = 2;
+    min = 0x80;
+    *code = s[0] & 0x1f;
+  } else if ((s[0] & 0xf0) == 0xe0) {
+    length = 3;
+    min = 0x800;
+    *code = s[0] & 0x0f;
+  } else if ((s[0] & 0xf8) == 0xf0) {
+    length = 4;
+    min = 0x10000;
+    *code = s[0] & 0x07;
+  } else {
+    return 0;
+  }
+  for (size_t i = 1; i < length; i++) {
+    if ((s[i] & 0xc0) != 0x80) {
+      return 0;
+    }
+    *code = (*code << 6) | (s[i] & 0x3f);
+  }
+  if (*code < min || *code > 0x10ffff ||
+      (*code >= 0xd800 && *code <= 0xdfff)) {
+    return 0;
+  }
+  return length;
+}
+
+/*
+ * Append a JSON string, escaped as json.dump does with ensure_ascii. Bytes
+ * which are not valid UTF-8 are escaped as lone surrogates, as Python decodes
+ * them in sys.argv.
+ */
+static void
+buffer_append_json_string(struct buffer* buf, const char* str)
+{
+  const unsigned char* s = (const unsigned char*)str;
+  buffer_append(buf, "\"", 1);
+  while (*s) {
+    unsigned int code;
+    size_t length = decode_utf8(s, &code);
+    if (length == 0) {
+      buffer_append_escape(buf, 0xdc00 + *s);
+      s++;
+      continue;
+    }
+    s += length;
+    switch (code) {
+      case '"':
+        buffer_append(buf, "\\\"", 2);
+        break;
+      case '\\':
+        buffer_append(buf, "\\\\", 2);
+        break;
+      case '\n':
+        buffer_append(buf, "\\n", 2);
+        break;
+      case '\r':
+        buffer_append(buf, "\\r", 2);
+        break;
+      case '\t':
+        buffer_append(buf, "\\t", 2);
+        break;
+      case '\b':
+        buffer_append(buf, "\\b", 2);
+        break;
+      case '\f':
+        buffer_append(buf, "\\f", 2);
+        break;
+      default:
+        if (code >= 0x10000) {
+          code -= 0x10000;
+          buffer_append_escape(buf, 0xd800 + (code >> 10));
+          buffer_append_escape(buf, 0xdc00 + (code & 0x3ff));
+        } else if (code < 0x20 || code > 0x7e) {
+          buffer_append_escape(buf, code);
+        } else {
+          char c = (char)code;
+          buffer_append(buf, &c, 1);
+        }
+    }
+  }
+  buffer_append(buf, "\"", 1);
+}
+
+static int
+write_build_log(const char* basename, int argc, char** argv)
+{
+  struct buffer line = { NULL, 0, 0 };
+  buffer_append(&line, "[", 1);
+  buffer_append_json_string(&line, basename);
+  for (int i = 1; i < argc; i++) {
+    buffer_append(&line, ", ", 2);
+    buffer_append_json_string(&line, argv[i]);
+  }
+  buffer_append(&line, "]\n", 2);
+
+  // A single write with O_APPEND, so that the lines of parallel compiler
+  // processes are not interleaved
+  int fd = open("build.log", O_WRONLY | O_APPEND | O_CREAT, 0644);
+  if (fd == -1) {
+    return -1;
+  }
+  const char* data = line.data;
+  size_t size = line.size;
+  while (size > 0) {
+    ssize_t written = write(fd, data, size);
+    if (written == -1) {
+      if (errno == EINTR) {
+        continue;
+      }
+      close(fd);
+      return -1;
+    }
+    data += written;
+    size -= written;
+  }
+  free(line.data);
+  return close(fd);
+}
+
+static int
+is_compiler(const char* basename)
+{
+  const char* compilers[] = { "gcc", "cc", "c++", "gfortran", "ld", NULL };
+  for (int i = 0; compilers[i] != NULL; i++) {
+    if (strcmp(basename, compilers[i]) == 0) {
+      return 1;
+    }
+  }
+  return 0;
+}
+
+int
+main(int argc, char** argv)
+{
+  const char* basename = strrchr(argv[0], '/');
+  basename = basename ? basename + 1 : argv[0];
+
+  const char* host_path = getenv("PYWASMCROSS_HOST_PATH");
+  if (host_path == NULL) {
+    fprintf(stderr, "%s: PYWASMCROSS_HOST_PATH is not set\n", argv[0]);
+    return 1;
+  }
+
+  // Skip compilations of C/Fortran extensions for the target environment,
+  // see pywasmcross.collect_args
+  int skip = 0;
+  if (getenv("SKIP_HOST") != NULL && is_compiler(basename)) {
+    for (int i = 1; i < argc; i++) {
+      if (strcmp(argv[i], "-o") == 0) {
+        if (i + 1 < argc) {
+          int fd = open(argv[i + 1], O_WRONLY | O_CREAT | O_TRUNC, 0666);
+          if (fd == -1) {
+            perror(argv[i + 1]);
+            return 1;
+          }
+          close(fd);
+          skip = 1;
+        }
+        break;
+      }
+    }
+  }
+
+  if (write_build_log(basename, argc, argv) != 0) {
+    perror("build.log");
+    return 1;
+  }
+  if (skip) {
+    return 0;
+  }
+
+  if (setenv("PATH", host_path, 1) != 0) {
+    perror("setenv");
+    return 1;
+  }
+  const char* ccache = getenv("PYWASMCROSS_CCACHE");
+  char** command = malloc((argc + 2) * sizeof(char*));
+  if (command == NULL) {
+    perror("pywasmcross");
+    return 1;
+  }
+  int n = 0;
+  if (ccache != NULL && ccache[0] != '\0') {
+    command[n++] = (char*)ccache;
+  }
+  command[n++] = (char*)basename;
+  for (int i = 1; i < argc; i++) {
+    command[n++] = argv[i];
+  }
+  command[n] = NULL;
+  execvp(command[0], command);
+  perror(command[0]);
+  return 127;
+}
@@ -1,8 +1,7 @@
+import copy
 from pathlib import Path
-from typing import Dict, Any, List, Optional
-
-
-# TODO: support more complex types for validation
+from threading import Lock
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 PACKAGE_CONFIG_SPEC: Dict[str, Dict[str, Any]] = {
     "package": {
@@ -13,10 +12,10 @@ PACKAGE_CONFIG_SPEC: Dict[str, Dict[str, Any]] = {
         "url": str,
         "extract_dir": str,
         "path": str,
-        "patches": list,  # List[str]
+        "patches": List[str],
         "md5": str,
         "sha256": str,
-        "extras": list,  # List[Tuple[str, str]],
+        "extras": List[Tuple[str, str]],
     },
     "build": {
         "skip_host": bool,
@@ -27,13 +26,17 @@ PACKAGE_CONFIG_SPEC: Dict[str, Dict[str, Any]] = {
         "sharedlibrary": bool,
         "script": str,
         "post": str,
-        "replace-libs": list,
+        "replace-libs": List[str],
+        "weight": float,
+        "memory": int,
+        "compression": str,
+        "profile": str,
     },
     "requirements": {
-        "run": list,  # List[str],
+        "run": List[str],
     },
     "test": {
-        "imports": list,  # List[str]
+        "imports": List[str],
     },
     "about": {
         "home": str,
@@ -43,6 +46,56 @@ PACKAGE_CONFIG_SPEC: Dict[str, Dict[str, Any]] = {
     },
 }
 
+# Keys which every meta.yaml must have
+MANDATORY_KEYS: List[Tuple[str, str]] = [("package", "name"), ("package", "version")]
+
+
+def _type_name(expected_type: Any) -> str:
+    if isinstance(expected_type, type):
+        return expected_type.__name__
+    return str(expected_type).replace("typing.", "")
+
+
+def _compile_type_check(expected_type: Any) -> Callable[[Any], bool]:
+    """
+    Make a function checking that a value loaded from YAML has the given
+    type, which may be a List or Tuple of types. Tuples are loaded as lists.
+    """
+    origin = getattr(expected_type, "__origin__", None)
+    if origin is list:
+        (item_type,) = expected_type.__args__
+        check_item = _compile_type_check(item_type)
+        return lambda value: isinstance(value, list) and all(
+            check_item(item) for item in value
+        )
+    if origin is tuple:
+        checks = [_compile_type_check(arg) for arg in expected_type.__args__]
+        return (
+            lambda value: isinstance(value, (list, tuple))
+            and len(value) == len(checks)
+            and all(check(item) for check, item in zip(checks, value))
+        )
+    if expected_type is int:
+        # bool is a subclass of int
+        return lambda value: isinstance(value, int) and not isinstance(value, bool)
+    if expected_type is float:
+        # YAML loads integral numbers as int
+        return lambda value: isinstance(value, (int, float)) and not isinstance(
+            value, bool
+        )
+    return lambda value: isinstance(value, expected_type)
+
+
+# The type checks of PACKAGE_CONFIG_SPEC, as (check, type name) by section
+# and key
+_TYPE_CHECKS: Dict[str, Dict[str, Tuple[Callable[[Any], bool], str]]] = {
+    section_key: {
+        key: (_compile_type_check(expected_type), _type_name(expected_type))
+        for key, expected_type in section.items()
+    }
+    for section_key, section in PACKAGE_CONFIG_SPEC.items()
+}
+
 
 def check_package_config(
     config: Dict[str, Any], raise_errors: bool = True, file_path: Optional[Path] = None
@@ -50,10 +103,10 @@ def check_package_config(
     """Check the validity of a loaded meta.yaml file
 
     Currently the following checks are applied:
-     -
-
-    TODO:
-     - check for mandatory fields
+     - the sections and keys are in PACKAGE_CONFIG_SPEC
+     - the values have the types in PACKAGE_CONFIG_SPEC, including the types
+       of the items of lists
+     - the keys in MANDATORY_KEYS are present
 
     Parameter
     ---------
@@ -67,6 +120,10 @@ def check_package_config(
     """
     errors_msg = []
 
+    if not isinstance(config, dict):
+        errors_msg.append(f"Expected a mapping, got {type(config).__name__}.")
+        config = {}
+
     # Check top level sections
     wrong_keys = set(config.keys()).difference(PACKAGE_CONFIG_SPEC.keys())
     if wrong_keys:
@@ -75,38 +132,46 @@ def check_package_config(
             f"sections are {list(PACKAGE_CONFIG_SPEC)}."
         )
 
-    # Check subsections
-    for section_key in config:
-        if section_key not in PACKAGE_CONFIG_SPEC:
+    for section_key, section in config.items():
+        if section_key not in _TYPE_CHECKS:
             # Don't check subsections is the main section is invalid
             continue
-        actual_keys = set(config[section_key].keys())
-        expected_keys = set(PACKAGE_CONFIG_SPEC[section_key].keys())
+        if not isinstance(section, dict):
+            errors_msg.append(
+                f"Wrong type for '{section_key}': expected a mapping, got "
+                f"{type(section).__name__}."
+            )
+            continue
+        checks = _TYPE_CHECKS[section_key]
 
-        wrong_keys = set(actual_keys).difference(expected_keys)
+        # Check subsections
+        wrong_keys = set(section.keys()).difference(checks.keys())
         if wrong_keys:
             errors_msg.append(
                 f"Found unknown keys "
                 f"{[section_key + '/' + key for key in wrong_keys]}. "
                 f"Expected keys are "
-                f"{[section_key + '/' + key for key in expected_keys]}."
+                f"{[section_key + '/' + key for key in checks]}."
             )
 
-    # Check value types
-    for section_key, section in config.items():
+        # Check value types
         for subsection_key, value in section.items():
-            try:
-                expected_type = PACKAGE_CONFIG_SPEC[section_key][subsection_key]
-            except KeyError:
+            if subsection_key not in checks:
                 # Unkown key, which was already reported previously, don't
                 # check types
                 continue
-            if not isinstance(value, expected_type):
+            check, type_name = checks[subsection_key]
+            if not check(value):
                 errors_msg.append(
                     f"Wrong type for '{section_key}/{subsection_key}': "
-                    f"expected {expected_type.__name__}, got {type(value).__name__}."
+                    f"expected {type_name}, got {value!r}."
                 )
 
+    for section_key, key in MANDATORY_KEYS:
+        section = config.get(section_key)
+        if not isinstance(section, dict) or key not in section:
+            errors_msg.append(f"Missing mandatory key '{section_key}/{key}'.")
+
     if raise_errors and errors_msg:
         if file_path is None:
             file_path = Path("meta.yaml")
@@ -117,9 +182,18 @@ def check_package_config(
     return errors_msg
 
 
+# Parsed meta.yaml files by resolved path, with the modification time and
+# size of the file when it was parsed, and whether it was checked
+_config_cache: Dict[Path, Tuple[int, int, bool, Dict[str, Any]]] = {}
+_config_cache_lock = Lock()
+
+
 def parse_package_config(path: Path, check: bool = True) -> Dict[str, Any]:
     """Load a meta.yaml file
 
+    The parsed files are memoized until they are modified. The libyaml based
+    loader of PyYAML is used when available.
+
     Parameters
     ----------
     path
@@ -129,16 +203,28 @@ def parse_package_config(path: Path, check: bool = True) -> Dict[str, Any]:
 
     Returns
     -------
-    the loaded config as a Dict
+    the loaded config as a Dict, which the caller may modify
     """
     # Import yaml here because pywasmcross needs to run in the built native
     # Python, which won't have PyYAML
     import yaml
 
-    with open(path, "rb") as fd:
-        config = yaml.safe_load(fd)
-
-    if check:
+    path = Path(path).resolve()
+    stat = path.stat()
+    with _config_cache_lock:
+        cached = _config_cache.get(path)
+    if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+        config, checked = cached[3], cached[2]
+    else:
+        loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+        with open(path, "rb") as fd:
+            config = yaml.load(fd, Loader=loader)
+        checked = False
+
+    if check and not checked:
         check_package_config(config, file_path=path)
+        checked = True
 
-    return config
+    with _config_cache_lock:
+        _config_cache[path] = (stat.st_mtime_ns, stat.st_size, checked, config)
+    return copy.deepcopy(config)
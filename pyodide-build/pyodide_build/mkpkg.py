@@ -1,20 +1,26 @@
 #!/usr/bin/env python3
 
 import argparse
+from concurrent.futures import ThreadPoolExecutor
+import http.client
 import json
 import os
 import shutil
+import threading
+import urllib.parse
 import urllib.request
 import urllib.error
 import sys
 from pathlib import Path
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, NamedTuple, Optional, Tuple
 import warnings
 
 from .io import parse_package_config
 
 PACKAGES_ROOT = Path(__file__).parent.parent / "packages"
 
+PYPI_URL = "https://pypi.org/pypi"
+
 
 class MkpkgFailedException(Exception):
     pass
@@ -42,20 +48,80 @@ def _extract_sdist(pypi_metadata: Dict[str, Any]) -> Dict:
     )
 
 
-def _get_metadata(package: str, version: Optional[str] = None) -> Dict:
-    """Download metadata for a package from PyPi"""
-    version = ("/" + version) if version is not None else ""
-    url = f"https://pypi.org/pypi/{package}{version}/json"
+class PyPIClient:
+    """
+    Download package metadata from the PyPI JSON API.
 
-    try:
-        with urllib.request.urlopen(url) as fd:
-            pypi_metadata = json.load(fd)
-    except urllib.error.HTTPError as e:
-        raise MkpkgFailedException(
-            f"Failed to load metadata for {package}{version} from https://pypi.org/pypi/{package}{version}/json: {e}"
-        )
+    The HTTPS connections are kept alive and reused by each thread, so that
+    the metadata of many packages can be downloaded by a pool of threads
+    sharing a client.
 
-    return pypi_metadata
+    Parameters
+    ----------
+    index
+        the URL of the JSON API, or a local directory with the same layout
+        (``<index>/<package>/json``), e.g. a fixture in tests
+    """
+
+    def __init__(self, index: str = PYPI_URL):
+        if "://" not in index:
+            index = Path(index).resolve().as_uri()
+        self.index = index.rstrip("/")
+        self._local = threading.local()
+
+    def _connection(self, netloc: str) -> http.client.HTTPSConnection:
+        connections = self._local.__dict__.setdefault("connections", {})
+        if netloc not in connections:
+            connections[netloc] = http.client.HTTPSConnection(netloc, timeout=60)
+        return connections[netloc]
+
+    def _get(self, url: str) -> bytes:
+        parsed = urllib.parse.urlsplit(url)
+        if parsed.scheme != "https":
+            with urllib.request.urlopen(url) as fd:
+                return fd.read()
+        path = parsed.path + ("?" + parsed.query if parsed.query else "")
+        connection = self._connection(parsed.netloc)
+        try:
+            connection.request("GET", path)
+            response = connection.getresponse()
+        except (http.client.HTTPException, OSError):
+            # The server closed the connection since the previous request
+            connection.close()
+            connection.request("GET", path)
+            response = connection.getresponse()
+        body = response.read()
+        if response.status in (301, 302, 307, 308):
+            # e.g. to the normalized name of the package
+            return self._get(urllib.parse.urljoin(url, response.headers["Location"]))
+        if response.status != 200:
+            raise urllib.error.HTTPError(
+                url, response.status, response.reason, response.headers, None
+            )
+        return body
+
+    def get_metadata(self, package: str, version: Optional[str] = None) -> Dict:
+        """Download metadata for a package from PyPi"""
+        version = ("/" + version) if version is not None else ""
+        url = f"{self.index}/{package}{version}/json"
+
+        try:
+            return json.loads(self._get(url))
+        except (
+            urllib.error.URLError,
+            http.client.HTTPException,
+            OSError,
+            # invalid JSON
+            ValueError,
+        ) as e:
+            raise MkpkgFailedException(
+                f"Failed to load metadata for {package}{version} from {url}: {e}"
+            )
+
+
+def _get_metadata(package: str, version: Optional[str] = None) -> Dict:
+    """Download metadata for a package from PyPi"""
+    return PyPIClient().get_metadata(package, version)
 
 
 def make_package(package: str, version: Optional[str] = None):
@@ -122,57 +188,248 @@ def success(msg):
     print(bcolors.OKBLUE + msg + bcolors.ENDC)
 
 
-def update_package(package: str, update_patched: bool = True):
-    from ruamel.yaml import YAML
+class UpdatePlan(NamedTuple):
+    """The result of checking a package for updates on PyPI"""
 
-    yaml = YAML()
+    package: str
+    # One of "update", "up-to-date", "skip" or "error"
+    action: str
+    message: str
+    # The new source of the package when action is "update"
+    version: str = ""
+    url: str = ""
+    sha256: str = ""
+    # Warnings to print, e.g. about patches that may need to be updated
+    warnings: Tuple[str, ...] = ()
 
-    meta_path = PACKAGES_ROOT / package / "meta.yaml"
-    yaml_content = parse_package_config(meta_path)
 
+def _check_local_package(package: str, yaml_content: Dict) -> Optional[UpdatePlan]:
+    """Skip the packages which are not downloaded from PyPI"""
     if "url" not in yaml_content["source"]:
-        print(f"Skipping: {package} is a local package!")
-        sys.exit(0)
+        return UpdatePlan(package, "skip", f"Skipping: {package} is a local package!")
 
     build_info = yaml_content.get("build", {})
     if build_info.get("library", False) or build_info.get("sharedlibrary", False):
-        print(f"Skipping: {package} is a library!")
-        sys.exit(0)
+        return UpdatePlan(package, "skip", f"Skipping: {package} is a library!")
+    return None
 
-    pypi_metadata = _get_metadata(package)
+
+def _verify_checksum(
+    package: str, yaml_content: Dict, pypi_metadata: Dict
+) -> Tuple[str, ...]:
+    """
+    Check that the checksum in meta.yaml is the one of an sdist of the same
+    version on PyPI, when PyPI lists the files of this version.
+    """
+    source = yaml_content["source"]
+    files = pypi_metadata.get("releases", {}).get(yaml_content["package"]["version"])
+    if not files:
+        return ()
+    for algorithm in ["sha256", "md5"]:
+        if algorithm in source:
+            digests = [file["digests"].get(algorithm) for file in files]
+            if source[algorithm] not in digests:
+                return (
+                    f"{package}: the {algorithm} checksum in meta.yaml doesn't "
+                    f"match any file of version {yaml_content['package']['version']} "
+                    "on PyPI",
+                )
+            return ()
+    return ()
+
+
+def plan_update(
+    package: str, yaml_content: Dict, pypi_metadata: Dict, update_patched: bool = True
+) -> UpdatePlan:
+    """Decide whether and how to update a package given its PyPI metadata"""
     pypi_ver = pypi_metadata["info"]["version"]
     local_ver = yaml_content["package"]["version"]
     if pypi_ver <= local_ver:
-        print(f"{package} already up to date. Local: {local_ver} PyPi: {pypi_ver}")
-        sys.exit(0)
+        return UpdatePlan(
+            package,
+            "up-to-date",
+            f"{package} already up to date. Local: {local_ver} PyPi: {pypi_ver}",
+            warnings=_verify_checksum(package, yaml_content, pypi_metadata),
+        )
 
-    print(f"{package} is out of date: {local_ver} <= {pypi_ver}.")
     if set(yaml_content.keys()).difference(
         ("package", "source", "test", "requirements")
     ):
-        abort(
+        return UpdatePlan(
+            package,
+            "error",
             f"{package}: Only pure python packages can be updated using this script. "
-            f"Aborting."
+            f"Aborting.",
         )
 
+    messages: Tuple[str, ...] = ()
     if "patches" in yaml_content["source"]:
         if update_patched:
-            warn(
+            messages = (
                 f"Pyodide applies patches to {package}. Update the "
-                "patches (if needed) to avoid build failing."
+                "patches (if needed) to avoid build failing.",
             )
         else:
-            abort(f"Pyodide applies patches to {package}. Skipping update.")
+            return UpdatePlan(
+                package,
+                "error",
+                f"Pyodide applies patches to {package}. Skipping update.",
+            )
 
-    sdist_metadata = _extract_sdist(pypi_metadata)
+    try:
+        sdist_metadata = _extract_sdist(pypi_metadata)
+    except MkpkgFailedException as e:
+        return UpdatePlan(package, "error", e.args[0])
+    return UpdatePlan(
+        package,
+        "update",
+        f"Updated {package} from {local_ver} to {pypi_ver}.",
+        version=pypi_ver,
+        url=sdist_metadata["url"],
+        sha256=sdist_metadata["digests"]["sha256"],
+        warnings=messages,
+    )
+
+
+def apply_update(meta_path: Path, plan: UpdatePlan):
+    """Write the new source of a package to its meta.yaml"""
+    from ruamel.yaml import YAML
+
+    yaml = YAML()
 
-    yaml_content["source"]["url"] = sdist_metadata["url"]
+    yaml_content = parse_package_config(meta_path)
+    yaml_content["source"]["url"] = plan.url
     yaml_content["source"].pop("md5", None)
-    yaml_content["source"]["sha256"] = sdist_metadata["digests"]["sha256"]
-    yaml_content["package"]["version"] = pypi_metadata["info"]["version"]
-    with open(PACKAGES_ROOT / package / "meta.yaml", "w") as fd:
+    yaml_content["source"]["sha256"] = plan.sha256
+    yaml_content["package"]["version"] = plan.version
+    with open(meta_path, "w") as fd:
         yaml.dump(yaml_content, fd)
-    success(f"Updated {package} from {local_ver} to {pypi_ver}.")
+
+
+def update_package(package: str, update_patched: bool = True):
+    meta_path = PACKAGES_ROOT / package / "meta.yaml"
+    yaml_content = parse_package_config(meta_path)
+
+    plan = _check_local_package(package, yaml_content)
+    if plan is not None:
+        print(plan.message)
+        sys.exit(0)
+
+    pypi_metadata = _get_metadata(package)
+    plan = plan_update(package, yaml_content, pypi_metadata, update_patched)
+    if plan.action == "up-to-date":
+        print(plan.message)
+        sys.exit(0)
+
+    print(
+        f"{package} is out of date: {yaml_content['package']['version']} <= "
+        f"{pypi_metadata['info']['version']}."
+    )
+    for msg in plan.warnings:
+        warn(msg)
+    if plan.action == "error":
+        abort(plan.message)
+
+    apply_update(meta_path, plan)
+    success(plan.message)
+
+
+def update_packages(
+    packages_root: Path,
+    packages: Optional[List[str]] = None,
+    update_patched: bool = True,
+    jobs: int = 16,
+    index: str = PYPI_URL,
+    dry_run: bool = False,
+) -> List[UpdatePlan]:
+    """
+    Update many packages at once.
+
+    The metadata of the packages is downloaded concurrently by ``jobs``
+    threads. Then the meta.yaml files of the packages to update are written,
+    unless ``dry_run`` is set.
+
+    Parameters
+    ----------
+    packages_root
+        the directory containing the packages
+    packages
+        the names of the packages to update, by default all the packages in
+        packages_root
+    update_patched
+        if False, the packages with patches are not updated
+    jobs
+        the number of concurrent requests to PyPI
+    index
+        see PyPIClient
+
+    Returns
+    -------
+    The update plans of the packages, sorted by name.
+    """
+    if packages is None:
+        packages = sorted(
+            path.name
+            for path in packages_root.iterdir()
+            if (path / "meta.yaml").is_file()
+        )
+    contents = {
+        package: parse_package_config(packages_root / package / "meta.yaml")
+        for package in packages
+    }
+
+    plans: Dict[str, UpdatePlan] = {}
+    to_fetch = []
+    for package, yaml_content in contents.items():
+        plan = _check_local_package(package, yaml_content)
+        if plan is not None:
+            plans[package] = plan
+        else:
+            to_fetch.append(package)
+
+    client = PyPIClient(index)
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {
+            package: executor.submit(client.get_metadata, package)
+            for package in to_fetch
+        }
+        for package, future in futures.items():
+            try:
+                pypi_metadata = future.result()
+            except MkpkgFailedException as e:
+                plans[package] = UpdatePlan(package, "error", e.args[0])
+                continue
+            plans[package] = plan_update(
+                package, contents[package], pypi_metadata, update_patched
+            )
+
+    if not dry_run:
+        for plan in plans.values():
+            if plan.action == "update":
+                apply_update(packages_root / plan.package / "meta.yaml", plan)
+    return [plans[package] for package in sorted(plans)]
+
+
+def print_update_summary(plans: List[UpdatePlan], dry_run: bool = False):
+    for plan in plans:
+        for msg in plan.warnings:
+            warn(msg)
+        if plan.action == "update":
+            success(("Would update: " if dry_run else "") + plan.message)
+        elif plan.action == "error":
+            print(bcolors.FAIL + plan.message + bcolors.ENDC)
+        else:
+            print(plan.message)
+
+    counts = {
+        action: sum(plan.action == action for plan in plans)
+        for action in ["update", "up-to-date", "skip", "error"]
+    }
+    print(
+        f"\n{counts['update']} {'to update' if dry_run else 'updated'}, "
+        f"{counts['up-to-date']} up to date, {counts['skip']} skipped, "
+        f"{counts['error']} failed"
+    )
 
 
 def make_parser(parser):
@@ -180,13 +437,52 @@ def make_parser(parser):
 Make a new pyodide package. Creates a simple template that will work
 for most pure Python packages, but will have to be edited for more
 complex things.""".strip()
-    parser.add_argument("package", type=str, nargs=1, help="The package name on PyPI")
+    parser.add_argument(
+        "package",
+        type=str,
+        nargs="*",
+        help="The package name on PyPI (several with --update-all)",
+    )
     parser.add_argument("--update", action="store_true", help="Update existing package")
     parser.add_argument(
         "--update-if-not-patched",
         action="store_true",
         help="Update existing package if it has no patches",
     )
+    parser.add_argument(
+        "--update-all",
+        action="store_true",
+        help=(
+            "Update the given packages, or all the packages, at once. With "
+            "--update-if-not-patched, the packages with patches are not updated"
+        ),
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="With --update-all, only print the updates",
+    )
+    parser.add_argument(
+        "--packages-dir",
+        type=Path,
+        default=PACKAGES_ROOT,
+        help="With --update-all, the directory containing the packages",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=16,
+        help="With --update-all, the number of concurrent requests to PyPI",
+    )
+    parser.add_argument(
+        "--pypi",
+        type=str,
+        default=PYPI_URL,
+        help=(
+            "With --update-all, the URL of the PyPI JSON API, or a directory "
+            "with the same layout"
+        ),
+    )
     parser.add_argument(
         "--version",
         type=str,
@@ -199,6 +495,21 @@ complex things.""".strip()
 
 def main(args):
     try:
+        if args.update_all:
+            plans = update_packages(
+                args.packages_dir,
+                args.package or None,
+                update_patched=not args.update_if_not_patched,
+                jobs=args.jobs,
+                index=args.pypi,
+                dry_run=args.dry_run,
+            )
+            print_update_summary(plans, args.dry_run)
+            if any(plan.action == "error" for plan in plans):
+                sys.exit(1)
+            return
+        if len(args.package) != 1:
+            abort("Expected exactly one package name")
         package = args.package[0]
         if args.update:
             update_package(package, update_patched=True)
@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+
+"""
+Prune the files of packages which are not used by a set of scripts.
+
+``pyodide-build prune record`` runs representative scripts in Pyodide and
+records the files that they import or open. ``pyodide-build prune bundle``
+then rebuilds the bundles of packages with only these files. The removed
+files are written next to the bundles along with a manifest, and are fetched
+on demand by ``_pyodide._importhook.PrunedFilesFinder`` if they turn out to
+be needed: when they are imported, opened, or when their directory is listed.
+Until then, ``os.stat`` and ``os.path.exists`` report them as missing.
+"""
+
+import argparse
+from fnmatch import fnmatch
+import json
+from pathlib import Path, PurePosixPath
+import shutil
+import sys
+from typing import Any, Dict, Iterable, List, Set
+
+from . import buildpkg
+from .io import parse_package_config
+from .serve import BUILD_PATH
+
+ROOTDIR = Path(__file__).parents[2].resolve()
+
+PACKAGES_DIR = ROOTDIR / "packages"
+
+# Shared libraries are loaded when the package is loaded, and can only be
+# compiled synchronously in workers, so they are not pruned by default.
+# Package metadata is small and read by importlib.metadata.
+DEFAULT_KEEP = ["*.so", "*.dist-info/*", "*.egg-info/*"]
+
+# Run in Pyodide before the scripts, records the files opened in
+# site-packages, including the imported modules
+TRACE_HOOK_CODE = """
+import sys
+
+__pyodide_trace = set()
+
+def __pyodide_trace_hook(event, args):
+    if event == "open" and isinstance(args[0], str) and "site-packages" in args[0]:
+        __pyodide_trace.add(args[0])
+
+sys.addaudithook(__pyodide_trace_hook)
+"""
+
+TRACE_RESULT_CODE = """
+import json, sys
+
+for module in list(sys.modules.values()):
+    file = getattr(module, "__file__", None)
+    if isinstance(file, str) and "site-packages" in file:
+        __pyodide_trace.add(file)
+
+json.dumps(sorted(__pyodide_trace))
+"""
+
+
+def record_trace(scripts: Iterable[Path], runtime: str, build_dir: Path) -> Set[str]:
+    """
+    Run scripts in Pyodide and return the paths of the files that they
+    import or open in site-packages.
+
+    Each script runs in a new Pyodide instance, after loading the packages
+    that it imports.
+    """
+    sys.path.insert(0, str(ROOTDIR))
+    import conftest
+
+    wrappers = {
+        "firefox": conftest.FirefoxWrapper,
+        "chrome": conftest.ChromeWrapper,
+    }
+    files: Set[str] = set()
+    with conftest.spawn_web_server(build_dir) as (_, port, _):
+        for script in scripts:
+            print(f"Tracing {script}")
+            selenium = wrappers[runtime](port, script_timeout=600)
+            try:
+                selenium.run(TRACE_HOOK_CODE)
+                selenium.run_async(script.read_text())
+                files.update(json.loads(selenium.run(TRACE_RESULT_CODE)))
+            finally:
+                selenium.driver.quit()
+    return files
+
+
+def load_trace(path: Path) -> Set[str]:
+    return set(json.loads(path.read_text())["files"])
+
+
+def save_trace(path: Path, files: Set[str]):
+    path.write_text(json.dumps({"files": sorted(files)}, indent=2))
+
+
+def select_files(
+    install_prefix: Path, trace: Set[str], keep: List[str]
+) -> Dict[str, bool]:
+    """
+    Decide which installed files of a package are kept in its bundle.
+
+    Parameters
+    ----------
+    install_prefix
+        the directory where the package is installed
+    trace
+        absolute paths in the Emscripten filesystem of the files used by
+        the traced scripts
+    keep
+        glob patterns of files which are always kept
+
+    Returns
+    -------
+    A dictionary mapping the paths of the files, relative to install_prefix,
+    to whether they are kept.
+    """
+    files = sorted(
+        path.relative_to(install_prefix).as_posix()
+        for path in install_prefix.rglob("*")
+        if path.is_file()
+    )
+    kept = {
+        path: "/" + path in trace or any(fnmatch(path, pattern) for pattern in keep)
+        for path in files
+    }
+    for path in files:
+        # The bytecode of a module is kept along with its source
+        pure = PurePosixPath(path)
+        if pure.parent.name == "__pycache__":
+            source = pure.parent.parent / (pure.name.split(".")[0] + ".py")
+            if kept.get(str(source)):
+                kept[path] = True
+    for path in [path for path, keep in kept.items() if keep]:
+        # Without its __init__.py, a directory holding kept files would be
+        # imported as a namespace package instead of being fetched
+        for parent in PurePosixPath(path).parents:
+            for init in ["__init__.py", "__init__.pyc"]:
+                if str(parent / init) in kept:
+                    kept[str(parent / init)] = True
+    return kept
+
+
+def prune_package(
+    pkg_root: Path, trace: Set[str], keep: List[str], output_dir: Path, args
+) -> Dict[str, Any]:
+    """
+    Bundle the files of a package which are kept, and write the other ones
+    and their manifest into output_dir.
+
+    Returns
+    -------
+    The manifest, which lists the absolute paths of the removed files in the
+    Emscripten filesystem, and the format of the bundle.
+    """
+    pkg = parse_package_config(pkg_root / "meta.yaml")
+    name = pkg["package"]["name"]
+    install_prefix = buildpkg.find_install_prefix(pkg_root)
+    if install_prefix is None:
+        raise ValueError(
+            f"Couldn't find the installed files of {name}, rebuild it without "
+            "the build cache"
+        )
+    kept = select_files(install_prefix, trace, keep)
+
+    pruned_dir = output_dir / (name + "-pruned")
+    if pruned_dir.exists():
+        shutil.rmtree(pruned_dir)
+    for path, keep_file in kept.items():
+        if not keep_file:
+            (pruned_dir / path).parent.mkdir(parents=True, exist_ok=True)
+            shutil.copy2(install_prefix / path, pruned_dir / path)
+    buildpkg.package_installed_subset(
+        pkg,
+        install_prefix,
+        [path for path, keep_file in kept.items() if keep_file],
+        output_dir,
+        args,
+    )
+
+    def total_size(keep_file: bool) -> int:
+        return sum(
+            (install_prefix / path).stat().st_size
+            for path, keep in kept.items()
+            if keep == keep_file
+        )
+
+    manifest = {
+        "format": buildpkg.get_package_format(pkg, args),
+        "removed": ["/" + path for path, keep_file in kept.items() if not keep_file],
+        "kept_size": total_size(True),
+        "removed_size": total_size(False),
+    }
+    (output_dir / (name + ".pruned.json")).write_text(json.dumps(manifest, indent=2))
+    return manifest
+
+
+def make_parser(parser):
+    parser.description = __doc__.strip().splitlines()[0]
+    subparsers = parser.add_subparsers(dest="prune_command")
+
+    record = subparsers.add_parser(
+        "record", help="Record the files used by scripts running in Pyodide"
+    )
+    record.add_argument("scripts", type=Path, nargs="+", help="Python scripts")
+    record.add_argument(
+        "--output",
+        type=Path,
+        required=True,
+        help="The trace file, merged with the existing one if any",
+    )
+    record.add_argument("--runtime", choices=["firefox", "chrome"], default="firefox")
+    record.add_argument(
+        "--build-dir",
+        type=Path,
+        default=BUILD_PATH,
+        help="The Pyodide build directory",
+    )
+
+    bundle = subparsers.add_parser(
+        "bundle", help="Rebuild package bundles with only the recorded files"
+    )
+    bundle.add_argument("packages", nargs="+", help="The packages to prune")
+    bundle.add_argument("--trace", type=Path, required=True, help="The trace file")
+    bundle.add_argument(
+        "--keep",
+        action="append",
+        default=list(DEFAULT_KEEP),
+        help=(
+            "Glob pattern of files to keep, relative to the root of the "
+            "filesystem (may be repeated). Default: " + ", ".join(DEFAULT_KEEP)
+        ),
+    )
+    bundle.add_argument("--packages-dir", type=Path, default=PACKAGES_DIR)
+    bundle.add_argument(
+        "--build-dir",
+        type=Path,
+        default=BUILD_PATH,
+        help="The Pyodide build directory, whose packages.json is updated",
+    )
+    bundle.add_argument(
+        "--output-dir",
+        type=Path,
+        default=None,
+        help="Where to write the pruned packages. Default: the build directory",
+    )
+    bundle.add_argument(
+        "--package-format",
+        choices=buildpkg.PACKAGE_FORMATS,
+        default="data",
+        help="The format of the pruned bundles",
+    )
+    bundle.add_argument(
+        "--compression",
+        choices=buildpkg.COMPRESSIONS,
+        default="lz4",
+        help="The compression of the pruned bundles, see buildall --compression",
+    )
+    bundle.add_argument(
+        "--compile-bytecode",
+        action="store_true",
+        help="Compile the kept Python modules to bytecode, as buildall does",
+    )
+    bundle.add_argument(
+        "--strip-sources",
+        action="store_true",
+        help="With --compile-bytecode, remove the sources of compiled modules",
+    )
+    return parser
+
+
+def main(args):
+    if args.prune_command == "record":
+        files = record_trace(args.scripts, args.runtime, args.build_dir)
+        if args.output.exists():
+            files |= load_trace(args.output)
+        save_trace(args.output, files)
+        print(f"Recorded {len(files)} files in {args.output}")
+    elif args.prune_command == "bundle":
+        trace = load_trace(args.trace)
+        output_dir = args.output_dir or args.build_dir
+        output_dir.mkdir(parents=True, exist_ok=True)
+        packages_json = output_dir / "packages.json"
+        if not packages_json.exists():
+            shutil.copyfile(args.build_dir / "packages.json", packages_json)
+        package_data = json.loads(packages_json.read_text())
+        bundle_args = argparse.Namespace(
+            package_format=args.package_format,
+            compression=args.compression,
+            compile_bytecode=args.compile_bytecode,
+            strip_sources=args.strip_sources,
+        )
+        for name in args.packages:
+            manifest = prune_package(
+                args.packages_dir / name, trace, args.keep, output_dir, bundle_args
+            )
+            entry = package_data["packages"][name.lower()]
+            entry["pruned"] = True
+            if manifest["format"] != "data":
+                entry["format"] = manifest["format"]
+            else:
+                entry.pop("format", None)
+            print(
+                f"{name}: kept {manifest['kept_size'] / 1e6:.2f} MB, removed "
+                f"{len(manifest['removed'])} files "
+                f"({manifest['removed_size'] / 1e6:.2f} MB)"
+            )
+        packages_json.write_text(json.dumps(package_data))
+    else:
+        raise ValueError("Expected a command: record or bundle")
+
+
+if __name__ == "__main__":
+    parser = make_parser(argparse.ArgumentParser())
+    args = parser.parse_args()
+    main(args)
@@ -24,6 +24,15 @@ configuration with build.
 
 
 import argparse
+from collections import defaultdict
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+import functools
+import hashlib
 import importlib.machinery
 import json
 import os
@@ -32,12 +41,16 @@ import re
 import subprocess
 import shutil
 import sys
+import tarfile
+import tempfile
+import threading
+from typing import Dict, List, Optional, Set, Tuple
 
 
 # absolute import is necessary as this file will be symlinked
 # under tools
 from pyodide_build import common
-from pyodide_build._f2c_fixes import fix_f2c_clapack_calls
+from pyodide_build._f2c_fixes import LAPACK_NAMES, fix_f2c_clapack_calls
 
 
 symlinks = set(["cc", "c++", "ld", "ar", "gcc", "gfortran"])
@@ -62,10 +75,7 @@ def collect_args(basename):
     # Remove the symlink compiler from the PATH, so we can delegate to the
     # native compiler
     env = dict(os.environ)
-    path = env["PATH"]
-    while str(TOOLSDIR) + ":" in path:
-        path = path.replace(str(TOOLSDIR) + ":", "")
-    env["PATH"] = path
+    env["PATH"] = _host_path(TOOLSDIR)
 
     skip_host = "SKIP_HOST" in os.environ
 
@@ -107,22 +117,77 @@ def collect_args(basename):
     sys.exit(subprocess.run(compiler_command + sys.argv[1:], env=env).returncode)
 
 
-def make_symlinks(env):
+# The compiler wrapper of capture_compile, compiled from this source when a
+# native C compiler is available, see build_compiler_shim
+COMPILER_SHIM_SOURCE = Path(__file__).parent / "compiler_shim.c"
+
+
+def _host_path(toolsdir: Path) -> str:
+    """PATH without the directory of the compiler wrappers"""
+    path = os.environ["PATH"]
+    while str(toolsdir) + ":" in path:
+        path = path.replace(str(toolsdir) + ":", "")
+    return path
+
+
+def build_compiler_shim(toolsdir: Path, host_path: str) -> Optional[Path]:
     """
-    Makes sure all of the symlinks that make this script look like a compiler
-    exist.
+    Compile the C compiler wrapper into toolsdir.
+
+    Starting Python and importing pyodide_build for each compiler call
+    (collect_args) is slow for packages which run many of them. The C wrapper
+    writes the same build.log and execs the compiler directly.
+
+    The executable is named after the hash of its source, so that it is only
+    compiled once and concurrent builds don't replace it while it runs.
+
+    Returns
+    -------
+    The path to the executable, or None if it couldn't be compiled, in which
+    case collect_args is used.
+    """
+    source = COMPILER_SHIM_SOURCE.read_bytes()
+    shim = toolsdir / f"pywasmcross-shim-{hashlib.sha256(source).hexdigest()[:16]}"
+    if shim.is_file():
+        return shim
+    compiler = shutil.which("cc", path=host_path)
+    if compiler is None:
+        return None
+    tmp_shim = shim.with_name(f"{shim.name}.{os.getpid()}.tmp")
+    result = subprocess.run(
+        [compiler, "-O2", "-o", str(tmp_shim), str(COMPILER_SHIM_SOURCE)],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        print(
+            "Couldn't compile the compiler wrapper, falling back to "
+            f"pywasmcross:\n{result.stderr}"
+        )
+        if tmp_shim.exists():
+            tmp_shim.unlink()
+        return None
+    os.replace(tmp_shim, shim)
+    return shim
+
+
+def make_symlinks(env, target: Optional[Path] = None):
+    """
+    Makes sure all of the symlinks that make this script, or the compiler
+    wrapper target, look like a compiler exist.
     """
     TOOLSDIR = Path(common.get_make_flag("TOOLSDIR"))
-    exec_path = Path(__file__).resolve()
+    if target is None:
+        target = Path(__file__).resolve()
     for symlink in symlinks:
         symlink_path = TOOLSDIR / symlink
-        if os.path.lexists(symlink_path) and not symlink_path.exists():
-            # remove broken symlink so it can be re-created
-            symlink_path.unlink()
-        try:
-            symlink_path.symlink_to(exec_path)
-        except FileExistsError:
-            pass
+        if not (
+            os.path.lexists(symlink_path) and os.readlink(symlink_path) == str(target)
+        ):
+            # replaced atomically, as another build may be running it
+            tmp_path = TOOLSDIR / f".{symlink}.{os.getpid()}.tmp"
+            tmp_path.symlink_to(target)
+            os.replace(tmp_path, symlink_path)
         if symlink == "c++":
             var = "CXX"
         else:
@@ -133,7 +198,12 @@ def make_symlinks(env):
 def capture_compile(args):
     TOOLSDIR = Path(common.get_make_flag("TOOLSDIR"))
     env = dict(os.environ)
-    make_symlinks(env)
+    host_path = _host_path(TOOLSDIR)
+    env["PYWASMCROSS_HOST_PATH"] = host_path
+    ccache = shutil.which("ccache", path=host_path)
+    if ccache is not None:
+        env["PYWASMCROSS_CCACHE"] = ccache
+    make_symlinks(env, build_compiler_shim(TOOLSDIR, host_path))
     env["PATH"] = str(TOOLSDIR) + ":" + os.environ["PATH"]
 
     cmd = [sys.executable, "setup.py", "install"]
@@ -197,7 +267,233 @@ def f2c(args, dryrun=False):
     return new_args
 
 
-def handle_command(line, args, dryrun=False):
+def is_skipped_command(line):
+    """Whether a compilation command is not actually part of the build"""
+    # This is a special case to skip the compilation tests in numpy that aren't
+    # actually part of the build
+    for arg in line:
+        if r"/file.c" in arg or "_configtest" in arg:
+            return True
+        if re.match(r"/tmp/.*/source\.[bco]+", arg):
+            return True
+        if arg == "-print-multiarch":
+            return True
+        if arg.startswith("/tmp"):
+            return True
+    return False
+
+
+OPTFLAGS = frozenset(f"-O{tok}" for tok in "01234sz")
+
+# Arguments of the native commands which are dropped
+SKIPPED_ARGS = frozenset(
+    [
+        # some gcc flags that clang does not support actually
+        "-Bsymbolic-functions",
+        "-Wl,-Bsymbolic-functions",
+        # breaks emscripten see https://github.com/emscripten-core/emscripten/issues/14460
+        "-Wl,--strip-all",
+        # threading is disabled for now
+        "-pthread",
+        # this only applies to compiling fortran code, but we already f2c'd
+        "-ffixed-form",
+        # On Mac, we need to omit some darwin-specific arguments
+        "-bundle",
+        "-undefined",
+        "dynamic_lookup",
+        "-lffi",
+    ]
+)
+
+EMSCRIPTEN_SKIPPED_ARGS = frozenset(
+    [
+        # See https://github.com/emscripten-core/emscripten/issues/8650
+        "-lfreetype",
+        "-lz",
+        "-lpng",
+        "-lgfortran",
+        # don't use -shared, SIDE_MODULE is already used
+        # and -shared breaks it
+        "-shared",
+    ]
+)
+
+PYTHON_ABI_RE = re.compile(r"/python([0-9]\.[0-9]+)m")
+
+
+class RewriteRules:
+    """
+    The rules which translate the native compiler commands to emscripten, see
+    handle_command.
+
+    They are built once per replay from the build arguments. The same include
+    paths, libraries and flags appear in most commands of a package, so the
+    translation of each distinct argument (which resolves include paths and
+    matches library names against the replace_libs patterns) is memoized.
+    Replayed commands all run in the source directory, in which relative
+    include paths are resolved.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        # some libraries have different names on wasm e.g. png16 = png
+        self.replace_libs = {}
+        for l in args.replace_libs.split(";"):
+            if len(l) > 0:
+                from_lib, to_lib = l.split("=")
+                self.replace_libs[from_lib] = to_lib
+
+        cflags = args.cflags.split()
+        self.flags = {
+            "ldflags": args.ldflags.split(),
+            "emcc": cflags,
+            "em++": cflags + args.cxxflags.split(),
+        }
+        # The optflag (e.g. -O3) in cflags/cxxflags/ldflags. Last one has
+        # priority.
+        self.optflags = {
+            key: next((arg for arg in flags[::-1] if arg in OPTFLAGS), None)
+            for key, flags in self.flags.items()
+        }
+        self.translate_arg = functools.lru_cache(maxsize=None)(self._translate_arg)
+        self.finalize_arg = functools.lru_cache(maxsize=None)(self._finalize_arg)
+
+    def _translate_arg(self, arg: str) -> Optional[str]:
+        """Adjust include paths and library names, or return None to drop
+        the argument"""
+        if arg.startswith("-I"):
+            if (
+                str(Path(arg[2:]).resolve()).startswith(sys.prefix + "/include/python")
+                and "site-packages" not in arg
+            ):
+                arg = arg.replace("-I" + sys.prefix, "-I" + self.args.target)
+            # Don't include any system directories
+            elif arg[2:].startswith("/usr"):
+                return None
+        # Don't include any system directories
+        if arg.startswith("-L/usr"):
+            return None
+        if arg.startswith("-l"):
+            lib_name = arg[2:]
+            for pattern, replacement in self.replace_libs.items():
+                # this enables glob style **/* matching
+                if PurePosixPath(lib_name).match(pattern) and len(replacement) > 0:
+                    lib_name = replacement
+            arg = "-l" + lib_name
+        return arg
+
+    def _finalize_arg(self, arg: str) -> Tuple[str, bool]:
+        """Apply the rewrites following the deduplication of libraries
+
+        Returns
+        -------
+        The rewritten argument, and whether it is kept
+        """
+        if arg in SKIPPED_ARGS:
+            return arg, False
+        # The native build is possibly multithreaded, but the emscripten one
+        # definitely isn't
+        arg = PYTHON_ABI_RE.sub(r"/python\1", arg)
+        # don't include libraries from native builds
+        if (
+            len(self.args.install_dir) > 0
+            and arg.startswith("-l" + self.args.install_dir)
+            or arg.startswith("-L" + self.args.install_dir)
+        ):
+            return arg, False
+        return arg, arg not in EMSCRIPTEN_SKIPPED_ARGS
+
+
+class ObjectCache:
+    """
+    Cache of the objects compiled by emscripten for a package.
+
+    Objects are keyed by the hash of the emscripten command, of the
+    preprocessed source and of the version of emscripten. When a package is
+    rebuilt after changing some of its sources (e.g. its patches), only the
+    changed sources are compiled again.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.compiler_version = subprocess.run(
+            ["emcc", "--version"], capture_output=True
+        ).stdout
+        self.used: Set[str] = set()
+        self.hits = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _output(new_args: List[str]) -> Optional[str]:
+        """The object file written by a command, or None if it only compiles
+        a single source to an object file"""
+        if new_args[0] not in ["emcc", "em++"] or "-c" not in new_args:
+            return None
+        outputs = _command_outputs(new_args)
+        if outputs is None or not outputs[0].endswith(".o"):
+            return None
+        return outputs[0]
+
+    def key(self, new_args: List[str]) -> Optional[str]:
+        """The key of a compilation, or None if its source can't be
+        preprocessed"""
+        preprocess_args = []
+        skip_next = False
+        for arg in new_args:
+            if skip_next:
+                skip_next = False
+            elif arg == "-o":
+                skip_next = True
+            elif arg != "-c":
+                preprocess_args.append(arg)
+        result = subprocess.run(preprocess_args + ["-E"], capture_output=True)
+        if result.returncode != 0:
+            # the compilation reports the error
+            return None
+        h = hashlib.sha256()
+        for data in [self.compiler_version, *map(str.encode, new_args)]:
+            h.update(data + b"\0")
+        h.update(result.stdout)
+        return h.hexdigest()
+
+    def compile(self, new_args: List[str]) -> int:
+        """Run a compiler command, or copy its object file from the cache
+
+        Returns
+        -------
+        The exit status of the command
+        """
+        output = self._output(new_args)
+        key = self.key(new_args) if output is not None else None
+        if output is None or key is None:
+            return subprocess.run(new_args).returncode
+        cached = self.path / f"{key}.o"
+        with self._lock:
+            self.used.add(key)
+        if cached.is_file():
+            shutil.copyfile(cached, output)
+            with self._lock:
+                self.hits += 1
+            return 0
+        result = subprocess.run(new_args)
+        if result.returncode == 0 and os.path.isfile(output):
+            # written atomically, as commands run in parallel
+            tmp_path = cached.with_name(f"{key}.{threading.get_ident()}.tmp")
+            shutil.copyfile(output, tmp_path)
+            os.replace(tmp_path, cached)
+        return result.returncode
+
+    def prune(self):
+        """Remove the objects which were not used by the replay"""
+        for path in self.path.glob("*.o"):
+            if path.stem not in self.used:
+                path.unlink()
+
+
+def handle_command(
+    line, args, dryrun=False, run_f2c=True, rules=None, object_cache=None
+):
     """Handle a compilation command
 
     Parameters
@@ -209,6 +505,14 @@ def handle_command(line, args, dryrun=False):
        in particular containing ``args.cflags``, ``args.cxxflags``, and ``args.ldflags``
     dryrun : bool, default=False
        if True do not run the resulting command, only return it
+    run_f2c : bool, default=True
+       if False, assume Fortran sources were already translated by
+       translate_fortran_sources
+    rules : RewriteRules, optional
+       the rules built from args, shared by the commands of a replay
+    object_cache : ObjectCache, optional
+       if given, reuse the objects compiled by identical commands from
+       identical sources
 
     Examples
     --------
@@ -220,27 +524,14 @@ def handle_command(line, args, dryrun=False):
     emcc test.c
     ['emcc', 'test.c']
     """
-    # some libraries have different names on wasm e.g. png16 = png
-    replace_libs = {}
-    for l in args.replace_libs.split(";"):
-        if len(l) > 0:
-            from_lib, to_lib = l.split("=")
-            replace_libs[from_lib] = to_lib
+    if rules is None:
+        rules = RewriteRules(args)
 
-    # This is a special case to skip the compilation tests in numpy that aren't
-    # actually part of the build
-    for arg in line:
-        if r"/file.c" in arg or "_configtest" in arg:
-            return
-        if re.match(r"/tmp/.*/source\.[bco]+", arg):
-            return
-        if arg == "-print-multiarch":
-            return
-        if arg.startswith("/tmp"):
-            return
+    if is_skipped_command(line):
+        return
 
     if line[0] == "gfortran":
-        result = f2c(line)
+        result = f2c(line, dryrun=dryrun or not run_f2c)
         if result is None:
             return
         line = result
@@ -260,86 +551,39 @@ def handle_command(line, args, dryrun=False):
             library_output = True
 
     if library_output:
-        new_args.extend(args.ldflags.split())
-    elif new_args[0] == "emcc":
-        new_args.extend(args.cflags.split())
-    elif new_args[0] == "em++":
-        new_args.extend(args.cflags.split() + args.cxxflags.split())
-
-    optflags_valid = [f"-O{tok}" for tok in "01234sz"]
+        flags_key: Optional[str] = "ldflags"
+    elif new_args[0] in rules.flags:
+        flags_key = new_args[0]
+    else:
+        flags_key = None
     optflag = None
-    # Identify the optflag (e.g. -O3) in cflags/cxxflags/ldflags. Last one has
-    # priority.
-    for arg in new_args[::-1]:
-        if arg in optflags_valid:
-            optflag = arg
-            break
+    if flags_key is not None:
+        new_args.extend(rules.flags[flags_key])
+        optflag = rules.optflags[flags_key]
 
     used_libs = set()
 
     # Go through and adjust arguments
     for arg in line[1:]:
-        if arg in optflags_valid and optflag is not None and arg != optflag:
+        if arg in OPTFLAGS and optflag is not None and arg != optflag:
             # There are multiple contradictory optflags provided, use the one
             # from cflags/cxxflags/ldflags
             continue
 
-        if arg.startswith("-I"):
-            if (
-                str(Path(arg[2:]).resolve()).startswith(sys.prefix + "/include/python")
-                and "site-packages" not in arg
-            ):
-                arg = arg.replace("-I" + sys.prefix, "-I" + args.target)
-            # Don't include any system directories
-            elif arg[2:].startswith("/usr"):
-                continue
-        # Don't include any system directories
-        if arg.startswith("-L/usr"):
+        arg = rules.translate_arg(arg)
+        if arg is None:
             continue
-        if arg.startswith("-l"):
-            for lib_name in replace_libs.keys():
-                # this enables glob style **/* matching
-                if PurePosixPath(arg[2:]).match(lib_name):
-                    if len(replace_libs[lib_name]) > 0:
-                        arg = "-l" + replace_libs[lib_name]
-                    else:
-                        continue
         if arg.startswith("-l"):
             # WASM link doesn't like libraries being included twice
             # skip second one
             if arg in used_libs:
                 continue
             used_libs.add(arg)
-        # some gcc flags that clang does not support actually
-        if arg == "-Bsymbolic-functions":
-            continue
-        if arg == "-Wl,-Bsymbolic-functions":
-            continue
-        # breaks emscripten see https://github.com/emscripten-core/emscripten/issues/14460
-        if arg == "-Wl,--strip-all":
-            continue
-        # threading is disabled for now
-        if arg == "-pthread":
-            continue
-        # this only applies to compiling fortran code, but we already f2c'd
-        if arg == "-ffixed-form":
-            continue
-        # On Mac, we need to omit some darwin-specific arguments
-        if arg in ["-bundle", "-undefined", "dynamic_lookup"]:
-            continue
-        if arg == "-lffi":
-            continue
-        # The native build is possibly multithreaded, but the emscripten one
-        # definitely isn't
-        arg = re.sub(r"/python([0-9]\.[0-9]+)m", r"/python\1", arg)
+
+        arg, keep = rules.finalize_arg(arg)
         if arg.endswith(".so"):
             output = arg
-        # don't include libraries from native builds
-        if (
-            len(args.install_dir) > 0
-            and arg.startswith("-l" + args.install_dir)
-            or arg.startswith("-L" + args.install_dir)
-        ):
+        if not keep:
             continue
 
         if new_args[-1].startswith("-B") and "compiler_compat" in arg:
@@ -348,28 +592,17 @@ def handle_command(line, args, dryrun=False):
             del new_args[-1]
             continue
 
-        # See https://github.com/emscripten-core/emscripten/issues/8650
-        if arg in ["-lfreetype", "-lz", "-lpng", "-lgfortran"]:
-            continue
-        # don't use -shared, SIDE_MODULE is already used
-        # and -shared breaks it
-        if arg in ["-shared"]:
-            continue
-
         new_args.append(arg)
 
-    # This can only be used for incremental rebuilds -- it generates
-    # an error during clean build of numpy
-    # if os.path.isfile(output):
-    #     print('SKIPPING: ' + ' '.join(new_args))
-    #     return
-
     print(" ".join(new_args))
 
     if not dryrun:
-        result = subprocess.run(new_args)
-        if result.returncode != 0:
-            sys.exit(result.returncode)
+        if object_cache is not None:
+            returncode = object_cache.compile(new_args)
+        else:
+            returncode = subprocess.run(new_args).returncode
+        if returncode != 0:
+            sys.exit(returncode)
 
     # Emscripten .so files shouldn't have the native platform slug
     if library_output:
@@ -385,15 +618,259 @@ def handle_command(line, args, dryrun=False):
     return new_args
 
 
+def _command_outputs(line: List[str]) -> Optional[List[str]]:
+    """Get the files written by a compiler command, or None if unknown"""
+    if line[0] == "ar":
+        archives = [arg for arg in line[1:] if arg.endswith(".a")]
+        return archives[:1] or None
+    if "-o" in line:
+        out_idx = line.index("-o") + 1
+        if out_idx < len(line):
+            return [line[out_idx]]
+    return None
+
+
+def build_job_graph(commands: List[List[str]]) -> List[Set[int]]:
+    """Compute the dependencies between the commands of a build.log
+
+    A command depends on the last previous command writing one of its input
+    files (including static libraries referenced with -l) or its output file,
+    and on the commands reading its output file since it was last written, so
+    that it is not overwritten while they read it.
+    Commands for which the output can't be determined are barriers: they
+    depend on all previous commands, and all subsequent commands depend on
+    them.
+
+    Parameters
+    ----------
+    commands : list
+        the compiler commands, in the order they were captured
+
+    Returns
+    -------
+    deps : list
+        for each command, the set of indices of the commands it depends on
+
+    Examples
+    --------
+
+    >>> build_job_graph([
+    ...     ['gcc', '-c', 'a.c', '-o', 'a.o'],
+    ...     ['gcc', '-c', 'b.c', '-o', 'b.o'],
+    ...     ['ar', 'rcs', 'libab.a', 'a.o', 'b.o'],
+    ...     ['gcc', '-shared', 'c.o', '-L.', '-lab', '-o', 'c.so'],
+    ... ])
+    [set(), set(), {0, 1}, {2}]
+    >>> build_job_graph([
+    ...     ['gcc', '-c', 'a.c', '-o', 'a.o'],
+    ...     ['ar', 'rcs', 'liba.a', 'a.o'],
+    ...     ['gcc', '-c', 'a2.c', '-o', 'a.o'],
+    ...     ['ar', 'rcs', 'libb.a', 'a.o'],
+    ... ])
+    [set(), {0}, {0, 1}, {2}]
+    """
+    producers: Dict[str, int] = {}
+    libraries: Dict[str, int] = {}
+    # The commands reading a file, or a library with -l, since it was written
+    readers: Dict[str, Set[int]] = defaultdict(set)
+    library_readers: Dict[str, Set[int]] = defaultdict(set)
+    barrier: Optional[int] = None
+    since_barrier: List[int] = []
+    deps: List[Set[int]] = []
+    for idx, line in enumerate(commands):
+        line_deps = set() if barrier is None else {barrier}
+        outputs = _command_outputs(line)
+        if outputs is None:
+            line_deps.update(since_barrier)
+            barrier = idx
+            since_barrier = []
+        else:
+            since_barrier.append(idx)
+            for arg in line[1:]:
+                if arg.startswith("-l"):
+                    producer = libraries.get(arg[2:])
+                    library_readers[arg[2:]].add(idx)
+                else:
+                    path = os.path.normpath(arg)
+                    producer = producers.get(path)
+                    readers[path].add(idx)
+                if producer is not None:
+                    line_deps.add(producer)
+            for output in outputs:
+                output = os.path.normpath(output)
+                producers[output] = idx
+                line_deps.update(readers.pop(output, ()))
+                name = os.path.basename(output)
+                if name.startswith("lib") and name.endswith((".a", ".so")):
+                    library = name[3:].rsplit(".", 1)[0]
+                    libraries[library] = idx
+                    line_deps.update(library_readers.pop(library, ()))
+            line_deps.discard(idx)
+        deps.append(line_deps)
+    return deps
+
+
+def _f2c_cache_key(fortran_file: str) -> str:
+    h = hashlib.sha256()
+    # f2c writes the file name in the output, and the CLAPACK fixes depend on
+    # the list of wrapped LAPACK names.
+    h.update(os.path.basename(fortran_file).encode() + b"\0")
+    h.update(" ".join(LAPACK_NAMES).encode() + b"\0")
+    with open(fortran_file, "rb") as fd:
+        h.update(fd.read())
+    return h.hexdigest()
+
+
+def f2c_translate(fortran_file: str, cache_dir: Optional[Path] = None) -> None:
+    """Translate a Fortran file to C with f2c and fix the CLAPACK calls
+
+    If cache_dir is given, translated files are cached there, keyed by the
+    hash of the Fortran file.
+    """
+    filename = os.path.abspath(fortran_file)
+    c_file = filename[:-2] + ".c"
+    cached_file = None
+    if cache_dir is not None:
+        key = _f2c_cache_key(filename)
+        cached_file = cache_dir / key[:2] / (key + ".c")
+        if cached_file.is_file():
+            shutil.copyfile(cached_file, c_file)
+            return
+
+    subprocess.check_call(
+        ["f2c", os.path.basename(filename)], cwd=os.path.dirname(filename)
+    )
+    fix_f2c_clapack_calls(c_file)
+
+    if cached_file is not None:
+        os.makedirs(cached_file.parent, exist_ok=True)
+        tmp_file = cached_file.with_name(f"{cached_file.name}.{os.getpid()}.tmp")
+        shutil.copyfile(c_file, tmp_file)
+        os.replace(tmp_file, cached_file)
+
+
+def translate_fortran_sources(
+    commands: List[List[str]], n_jobs: int, cache_dir: Optional[Path] = None
+) -> None:
+    """Run f2c on all Fortran sources compiled by commands, in parallel
+
+    This runs before replaying the commands, which then only need to compile
+    the translated C files.
+    """
+    sources = sorted(
+        {
+            arg
+            for line in commands
+            if line[0] == "gfortran" and not is_skipped_command(line)
+            for arg in line
+            if arg.endswith(".f")
+        }
+    )
+    if not sources:
+        return
+    translate = functools.partial(f2c_translate, cache_dir=cache_dir)
+    if n_jobs <= 1:
+        for source in sources:
+            translate(source)
+        return
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        # Consume the results to propagate exceptions
+        list(executor.map(translate, sources))
+
+
+def run_jobs(
+    commands: List[List[str]],
+    deps: List[Set[int]],
+    args,
+    n_jobs: int,
+    rules: Optional[RewriteRules] = None,
+    object_cache: Optional[ObjectCache] = None,
+):
+    """Run handle_command on commands in parallel, respecting dependencies
+
+    The commands run in a pool of n_jobs threads, since the actual work is
+    done by the compiler subprocesses. The first failing command aborts the
+    replay. Fortran sources must already be translated (see
+    translate_fortran_sources).
+    """
+    if rules is None:
+        rules = RewriteRules(args)
+    dependents: List[List[int]] = [[] for _ in commands]
+    for idx, line_deps in enumerate(deps):
+        for dep in line_deps:
+            dependents[dep].append(idx)
+    remaining = [len(line_deps) for line_deps in deps]
+
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        running = {}
+
+        def submit(idx):
+            future = executor.submit(
+                handle_command,
+                commands[idx],
+                args,
+                run_f2c=False,
+                rules=rules,
+                object_cache=object_cache,
+            )
+            running[future] = idx
+
+        for idx in range(len(commands)):
+            if remaining[idx] == 0:
+                submit(idx)
+
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                idx = running.pop(future)
+                try:
+                    future.result()
+                except BaseException:
+                    for pending in running:
+                        pending.cancel()
+                    raise
+                for dependent in dependents[idx]:
+                    remaining[dependent] -= 1
+                    if remaining[dependent] == 0:
+                        submit(dependent)
+
+
 def replay_compile(args):
     # If pure Python, there will be no build.log file, which is fine -- just do
     # nothing
     build_log_path = Path("build.log")
-    if build_log_path.is_file():
-        with open(build_log_path, "r") as fd:
-            for line in fd:
-                line = json.loads(line)
-                handle_command(line, args)
+    if not build_log_path.is_file():
+        return
+    with open(build_log_path, "r") as fd:
+        commands = [json.loads(line) for line in fd]
+
+    f2c_cache = Path(args.f2c_cache) if args.f2c_cache else None
+    with common.build_trace.phase("f2c"):
+        translate_fortran_sources(commands, args.jobs, f2c_cache)
+
+    rules = RewriteRules(args)
+    object_cache = ObjectCache(Path(args.object_cache)) if args.object_cache else None
+    with common.build_trace.phase("replay_compile", commands=len(commands)):
+        if args.jobs <= 1:
+            for line in commands:
+                handle_command(
+                    line, args, run_f2c=False, rules=rules, object_cache=object_cache
+                )
+        else:
+            run_jobs(
+                commands,
+                build_job_graph(commands),
+                args,
+                args.jobs,
+                rules,
+                object_cache,
+            )
+    if object_cache is not None:
+        object_cache.prune()
+        print(
+            f"Reused {object_cache.hits} of {len(object_cache.used)} cached objects "
+            f"from {object_cache.path}"
+        )
 
 
 def clean_out_native_artifacts():
@@ -425,13 +902,119 @@ def install_for_distribution(args):
         subprocess.check_call(commands[:-1])
 
 
+# Placeholder for the source directory in cached build logs
+SRCDIR_PLACEHOLDER = "@PYODIDE_SRCDIR@"
+
+
+def _snapshot_source_tree() -> Dict[str, Tuple[int, int]]:
+    """Map the files in the current directory to their size and mtime"""
+    snapshot = {}
+    for root, dirs, files in os.walk("."):
+        if root == ".":
+            # install is created by install_for_distribution
+            dirs[:] = [d for d in dirs if d != "install"]
+        for file in files:
+            path = os.path.normpath(os.path.join(root, file))
+            if path == "build.log":
+                continue
+            st = os.stat(path)
+            snapshot[path] = (st.st_size, st.st_mtime_ns)
+    return snapshot
+
+
+def source_tree_hash(snapshot: Dict[str, Tuple[int, int]]) -> str:
+    """Hash the contents of the files of a source tree snapshot
+
+    The host Python version is included, since the captured commands depend
+    on it.
+    """
+    h = hashlib.sha256(sys.version.encode())
+    for path in sorted(snapshot):
+        h.update(path.encode() + b"\0")
+        with open(path, "rb") as fd:
+            h.update(hashlib.sha256(fd.read()).digest())
+    return h.hexdigest()
+
+
+def store_captured_build(cache_dir: Path, snapshot: Dict[str, Tuple[int, int]]) -> None:
+    """Store build.log and the files generated by capture_compile in cache_dir
+
+    Absolute paths to the source directory are replaced by a placeholder in
+    the stored build.log, so that it can be restored to another directory.
+    """
+    if cache_dir.is_dir():
+        return
+    os.makedirs(cache_dir.parent, exist_ok=True)
+    tmpdir = Path(tempfile.mkdtemp(dir=cache_dir.parent))
+    try:
+        if Path("build.log").is_file():
+            build_log = Path("build.log").read_text()
+            build_log = build_log.replace(os.getcwd(), SRCDIR_PLACEHOLDER)
+            (tmpdir / "build.log").write_text(build_log)
+        with tarfile.open(tmpdir / "generated.tar", "w") as tar:
+            for path, state in sorted(_snapshot_source_tree().items()):
+                # native build products get rebuilt by replay_compile
+                if Path(path).suffix in (".o", ".so", ".a"):
+                    continue
+                if snapshot.get(path) != state:
+                    tar.add(path)
+        tmpdir.rename(cache_dir)
+    except OSError:
+        if not cache_dir.is_dir():
+            raise
+    finally:
+        if tmpdir.is_dir():
+            shutil.rmtree(tmpdir)
+
+
+def restore_captured_build(cache_dir: Path) -> bool:
+    """Restore build.log and the generated files from cache_dir
+
+    Returns True on a cache hit.
+    """
+    if not (cache_dir / "generated.tar").is_file():
+        return False
+    with tarfile.open(cache_dir / "generated.tar") as tar:
+        tar.extractall()
+    if (cache_dir / "build.log").is_file():
+        build_log = (cache_dir / "build.log").read_text()
+        build_log = build_log.replace(SRCDIR_PLACEHOLDER, os.getcwd())
+        Path("build.log").write_text(build_log)
+    print(f"Reusing captured compiler commands from {cache_dir}")
+    return True
+
+
 def build_wrap(args):
+    try:
+        _build_wrap(args)
+    finally:
+        if args.trace_file:
+            common.build_trace.save(Path(args.trace_file))
+
+
+def _build_wrap(args):
+    trace = common.build_trace
     build_log_path = Path("build.log")
     if not build_log_path.is_file():
-        capture_compile(args)
-    clean_out_native_artifacts()
+        # Packages built on the host (skip_host: False) are needed by other
+        # packages at build time, so they always go through capture_compile.
+        if args.build_log_cache and "SKIP_HOST" in os.environ:
+            snapshot = _snapshot_source_tree()
+            cache_dir = Path(args.build_log_cache) / source_tree_hash(snapshot)
+            with trace.phase("restore_captured_build"):
+                restored = restore_captured_build(cache_dir)
+            if not restored:
+                with trace.phase("capture_compile"):
+                    capture_compile(args)
+                store_captured_build(cache_dir, snapshot)
+        else:
+            with trace.phase("capture_compile"):
+                capture_compile(args)
+    with trace.phase("clean_out_native_artifacts"):
+        clean_out_native_artifacts()
     replay_compile(args)
-    install_for_distribution(args)
+    with trace.phase("install_for_distribution"):
+        install_for_distribution(args)
 
 
 def make_parser(parser):
@@ -496,6 +1079,60 @@ def make_parser(parser):
             help="Libraries to replace in final link",
             action=EnvironmentRewritingArgument,
         )
+        parser.add_argument(
+            "--jobs",
+            type=int,
+            nargs="?",
+            default=os.cpu_count(),
+            help=(
+                "Number of compiler commands to replay in parallel. Defaults "
+                "to the number of CPUs"
+            ),
+        )
+        parser.add_argument(
+            "--f2c-cache",
+            type=str,
+            nargs="?",
+            default="",
+            help=(
+                "Directory in which to cache the C files translated from "
+                "Fortran by f2c, keyed by the hash of the Fortran file"
+            ),
+        )
+        parser.add_argument(
+            "--object-cache",
+            type=str,
+            nargs="?",
+            default="",
+            help=(
+                "Directory in which to cache the objects compiled by "
+                "emscripten, keyed by the hash of the compiler command and of "
+                "the preprocessed source. Objects which are not used by the "
+                "replay are removed from it."
+            ),
+        )
+        parser.add_argument(
+            "--build-log-cache",
+            type=str,
+            nargs="?",
+            default="",
+            help=(
+                "Directory in which to cache the captured compiler commands "
+                "and generated files, keyed by the hash of the source tree. "
+                "When the hash matches, the native build is skipped. Only used "
+                "when SKIP_HOST is set."
+            ),
+        )
+        parser.add_argument(
+            "--trace-file",
+            type=str,
+            nargs="?",
+            default="",
+            help=(
+                "Write the duration and the peak memory of the build phases "
+                "to this file, in the Chrome trace event format"
+            ),
+        )
     return parser
 
 
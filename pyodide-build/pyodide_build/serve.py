@@ -1,20 +1,253 @@
 import os
 import sys
 import argparse
+import email.utils
+import functools
+import hashlib
 import http.server
-import socketserver
 import pathlib
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
 
 BUILD_PATH = pathlib.Path(__file__).resolve().parents[2] / "build"
 
+# Content-Encoding of the precompressed copies of files, in order of
+# preference, see buildpkg.PRECOMPRESSED_SUFFIXES
+PRECOMPRESSED_ENCODINGS = [("br", ".br"), ("gzip", ".gz")]
+
+# Files whose name contains a content hash never change, e.g. the shared
+# files of buildall --deduplicate
+HASHED_NAME_RE = re.compile(r"(?:^|[._-])[0-9a-f]{16,}(?:[._-]|$)")
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Other files are revalidated with their ETag on each use
+DEFAULT_CACHE_CONTROL = "no-cache"
+
+_etags: Dict[str, Tuple[int, int, str]] = {}
+_etags_lock = threading.Lock()
+
+
+def compute_etag(path: str, stat: os.stat_result) -> str:
+    """A strong ETag of a file: the hash of its contents, memoized until the
+    file is modified"""
+    with _etags_lock:
+        cached = _etags.get(path)
+    if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+        return cached[2]
+    h = hashlib.sha256()
+    with open(path, "rb") as fd:
+        for chunk in iter(functools.partial(fd.read, 1 << 20), b""):
+            h.update(chunk)
+    etag = f'"{h.hexdigest()[:32]}"'
+    with _etags_lock:
+        _etags[path] = (stat.st_mtime_ns, stat.st_size, etag)
+    return etag
+
+
+def accepted_encodings(header: str) -> List[str]:
+    """The content codings of an Accept-Encoding header, without the ones with
+    a zero quality
+
+    >>> accepted_encodings("gzip, deflate;q=0.5, br;q=0")
+    ['gzip', 'deflate']
+    """
+    encodings = []
+    for item in header.split(","):
+        coding, *params = item.strip().split(";")
+        quality = 1.0
+        for param in params:
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    pass
+        if coding and quality > 0:
+            encodings.append(coding.strip().lower())
+    return encodings
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a Range header with a single byte range.
+
+    Returns
+    -------
+    The first and last byte positions, or None if the header is not a valid
+    single byte range, in which case the whole file is sent. Raises
+    ValueError if the range is not satisfiable.
+
+    >>> parse_range("bytes=10-19", 100)
+    (10, 19)
+    >>> parse_range("bytes=-10", 100)
+    (90, 99)
+    >>> parse_range("bytes=90-", 100)
+    (90, 99)
+    >>> parse_range("bytes=0-1, 5-6", 100) is None
+    True
+    """
+    match = re.fullmatch(r"\s*bytes\s*=\s*(\d*)\s*-\s*(\d*)\s*", header)
+    if match is None or match.group(1) == match.group(2) == "":
+        return None
+    first, last = match.groups()
+    if first == "":
+        # the last bytes of the file
+        start, end = max(size - int(last), 0), size - 1
+        if int(last) == 0:
+            raise ValueError(f"Unsatisfiable range {header}")
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+        if last and int(last) < start:
+            return None
+    if start > end or start >= size:
+        raise ValueError(f"Unsatisfiable range {header}")
+    return start, end
+
 
 class Handler(http.server.SimpleHTTPRequestHandler):
+    """
+    Serve files with the headers needed to load Pyodide efficiently:
+
+    - the precompressed copy of a file (.br or .gz), if the client accepts its
+      Content-Encoding
+    - strong ETags, and Cache-Control headers which make browsers cache
+      files with a content hash in their name forever, and revalidate the
+      other ones
+    - single byte ranges, for large .data files
+    - application/wasm, so that WebAssembly modules can be compiled while
+      they are downloaded
+
+    Files are sent with sendfile when possible, and connections are kept
+    alive.
+    """
+
+    protocol_version = "HTTP/1.1"
+    # The headers and the body are sent separately, which would wait for the
+    # delayed ACK of the client with keep-alive connections
+    disable_nagle_algorithm = True
+
     def end_headers(self):
         self.send_header("Access-Control-Allow-Origin", "*")
         super().end_headers()
 
+    def send_head(self):
+        # The range of the file sent by copyfile, where None is the rest of it
+        self._range: Tuple[int, Optional[int]] = (0, None)
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path) or self.path.endswith("/"):
+            return super().send_head()
+
+        content_type = self.guess_type(path)
+        encoding = None
+        vary = False
+        accepted = accepted_encodings(self.headers.get("Accept-Encoding", ""))
+        for name, suffix in PRECOMPRESSED_ENCODINGS:
+            if os.path.isfile(path + suffix):
+                vary = True
+                if encoding is None and name in accepted:
+                    encoding = name
+                    path += suffix
+
+        try:
+            f = open(path, "rb")
+        except OSError:
+            self.send_error(http.HTTPStatus.NOT_FOUND, "File not found")
+            return None
+        try:
+            stat = os.fstat(f.fileno())
+            etag = compute_etag(path, stat)
+            size = stat.st_size
+
+            if self._not_modified(etag, stat):
+                self.send_response(http.HTTPStatus.NOT_MODIFIED)
+                self._send_cache_headers(etag, stat, vary)
+                self.end_headers()
+                f.close()
+                return None
+
+            byte_range = None
+            if "Range" in self.headers and self.headers.get("If-Range", etag) in (
+                etag,
+                self.date_time_string(stat.st_mtime),
+            ):
+                try:
+                    byte_range = parse_range(self.headers["Range"], size)
+                except ValueError:
+                    self.send_response(http.HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+                    self.send_header("Content-Range", f"bytes */{size}")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    f.close()
+                    return None
+
+            if byte_range is None:
+                self.send_response(http.HTTPStatus.OK)
+                self._range = (0, size)
+            else:
+                start, end = byte_range
+                self.send_response(http.HTTPStatus.PARTIAL_CONTENT)
+                self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+                self._range = (start, end - start + 1)
+            self.send_header("Content-Type", content_type)
+            if encoding is not None:
+                self.send_header("Content-Encoding", encoding)
+            self.send_header("Content-Length", str(self._range[1]))
+            self.send_header("Accept-Ranges", "bytes")
+            self._send_cache_headers(etag, stat, vary)
+            self.end_headers()
+            return f
+        except BaseException:
+            f.close()
+            raise
+
+    def _not_modified(self, etag: str, stat: os.stat_result) -> bool:
+        if "If-None-Match" in self.headers:
+            tags = [tag.strip() for tag in self.headers["If-None-Match"].split(",")]
+            return etag in tags or "*" in tags
+        if "If-Modified-Since" in self.headers:
+            try:
+                since = email.utils.parsedate_to_datetime(
+                    self.headers["If-Modified-Since"]
+                )
+            except (TypeError, ValueError):
+                return False
+            return since is not None and int(stat.st_mtime) <= since.timestamp()
+        return False
+
+    def _send_cache_headers(self, etag: str, stat: os.stat_result, vary: bool):
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", self.date_time_string(stat.st_mtime))
+        name = self.path.split("?", 1)[0].rsplit("/", 1)[-1]
+        if HASHED_NAME_RE.search(name):
+            self.send_header("Cache-Control", IMMUTABLE_CACHE_CONTROL)
+        else:
+            self.send_header("Cache-Control", DEFAULT_CACHE_CONTROL)
+        if vary:
+            self.send_header("Vary", "Accept-Encoding")
+
+    def copyfile(self, source, outputfile):
+        """Send the requested range of a file opened by send_head"""
+        offset, count = getattr(self, "_range", (0, None))
+        if count is None:
+            return super().copyfile(source, outputfile)
+        try:
+            self.connection.sendfile(source, offset, count)
+        except (AttributeError, ValueError):
+            # e.g. a file object which isn't a regular file, or a
+            # non-blocking socket
+            source.seek(offset)
+            while count > 0:
+                chunk = source.read(min(count, 1 << 16))
+                if not chunk:
+                    break
+                outputfile.write(chunk)
+                count -= len(chunk)
+
 
 Handler.extensions_map[".wasm"] = "application/wasm"
+Handler.extensions_map[".data"] = "application/octet-stream"
 
 
 def make_parser(parser):
@@ -32,16 +265,21 @@ def make_parser(parser):
     return parser
 
 
-def server(port):
-    httpd = socketserver.TCPServer(("", port), Handler)
+def server(port, build_dir=None):
+    """A server handling each request in a new thread, serving build_dir or
+    else the current directory"""
+    handler = Handler
+    if build_dir is not None:
+        handler = functools.partial(Handler, directory=str(build_dir))  # type: ignore
+    httpd = http.server.ThreadingHTTPServer(("", port), handler)
+    httpd.daemon_threads = True
     return httpd
 
 
 def main(args):
     build_dir = args.build_dir
     port = args.port
-    httpd = server(port)
-    os.chdir(build_dir)
+    httpd = server(port, build_dir)
     print("serving from {0} at localhost:".format(build_dir) + str(port))
     try:
         httpd.serve_forever()
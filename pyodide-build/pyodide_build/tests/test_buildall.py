@@ -1,13 +1,25 @@
+import argparse
 from collections import namedtuple
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+from threading import Lock
 from time import sleep
+import zipfile
 
 from pathlib import Path
 
-from pyodide_build import buildall
+from pyodide_build import buildall, common
 import pytest
 
 PACKAGES_DIR = (Path(__file__).parents[3] / "packages").resolve()
 
+Args = namedtuple(
+    "Args", ["n_jobs", "keep_going", "memory_budget"], defaults=[False, 0]
+)
+
 
 def test_generate_dependency_graph():
     pkg_map = buildall.generate_dependency_graph(PACKAGES_DIR, {"beautifulsoup4"})
@@ -47,6 +59,156 @@ def test_generate_packages_json():
     }
 
 
+def test_metadata_index(tmpdir, monkeypatch):
+    packages_dir = Path(tmpdir) / "packages"
+    for name in ["beautifulsoup4", "soupsieve"]:
+        shutil.copytree(PACKAGES_DIR / name, packages_dir / name)
+    index_path = Path(tmpdir) / "metadata.json"
+
+    parsed = []
+    parse_package_config = buildall.parse_package_config
+
+    def mock_parse_package_config(path, *args, **kwargs):
+        parsed.append(path.parent.name)
+        return parse_package_config(path, *args, **kwargs)
+
+    monkeypatch.setattr(buildall, "parse_package_config", mock_parse_package_config)
+
+    pkg_map = buildall.generate_dependency_graph(packages_dir, None, index_path)
+    assert sorted(parsed) == ["beautifulsoup4", "soupsieve"]
+
+    # Unchanged files are not parsed again
+    parsed.clear()
+    cached_pkg_map = buildall.generate_dependency_graph(packages_dir, None, index_path)
+    assert parsed == []
+    assert cached_pkg_map["beautifulsoup4"].meta == pkg_map["beautifulsoup4"].meta
+
+    # Neither are files whose modification time changed but not their content
+    os.utime(packages_dir / "soupsieve" / "meta.yaml")
+    buildall.generate_dependency_graph(packages_dir, None, index_path)
+    assert parsed == []
+
+    meta_path = packages_dir / "soupsieve" / "meta.yaml"
+    meta_path.write_text(meta_path.read_text().replace("version:", "version: 0.0.1 #"))
+    pkg_map = buildall.generate_dependency_graph(packages_dir, None, index_path)
+    assert parsed == ["soupsieve"]
+    assert pkg_map["soupsieve"].version == "0.0.1"
+
+    # An index written before a change of the validation is ignored
+    index = json.loads(index_path.read_text())
+    index["version"] = buildall.METADATA_INDEX_VERSION - 1
+    index_path.write_text(json.dumps(index))
+    parsed.clear()
+    buildall.generate_dependency_graph(packages_dir, None, index_path)
+    assert sorted(parsed) == ["beautifulsoup4", "soupsieve"]
+
+
+def test_merge_packages_json(tmpdir):
+    outputdir = Path(tmpdir)
+    previous_data = buildall.generate_packages_json(
+        buildall.generate_dependency_graph(PACKAGES_DIR, {"beautifulsoup4", "pytz"})
+    )
+    # beautifulsoup4 was built by a previous run, pytz was removed
+    for name in ["soupsieve", "beautifulsoup4"]:
+        (outputdir / f"{name}.data").touch()
+        (outputdir / f"{name}.js").touch()
+    # only the .js file of pytz is left
+    (outputdir / "pytz.js").touch()
+
+    pkg_map = buildall.generate_dependency_graph(PACKAGES_DIR, {"micropip"})
+    package_data = buildall.generate_packages_json(pkg_map)
+    merged = buildall.merge_packages_json(
+        package_data, previous_data, pkg_map, outputdir
+    )
+
+    assert list(merged["packages"]) == sorted(
+        set(package_data["packages"]) | {"soupsieve", "beautifulsoup4"}
+    )
+    assert merged["packages"]["beautifulsoup4"] == (
+        previous_data["packages"]["beautifulsoup4"]
+    )
+    assert merged["info"] == package_data["info"]
+
+
+def test_generate_packages_json_zip(monkeypatch):
+    pkg_map = buildall.generate_dependency_graph(PACKAGES_DIR, {"CLAPACK", "pytz"})
+    Args = namedtuple("Args", ["package_format"])
+    for pkg in pkg_map.values():
+        pkg.package_format = buildall.get_package_format(pkg.meta, Args("zip"))
+
+    package_data = buildall.generate_packages_json(pkg_map)
+    assert package_data["packages"]["pytz"]["format"] == "zip"
+    # shared libraries are loaded by the preload plugins of the file packager
+    assert "format" not in package_data["packages"]["clapack"]
+
+
+def test_deduplicate_shared_files(tmpdir, capsys):
+    packages_dir = Path(tmpdir) / "packages"
+    outputdir = Path(tmpdir) / "dist"
+    outputdir.mkdir()
+    site_packages = "lib/python3.9/site-packages"
+    for name in ["pkga", "pkgb"]:
+        (packages_dir / name).mkdir(parents=True)
+        (packages_dir / name / "meta.yaml").write_text(
+            f"package:\n  name: {name}\n  version: '1.0'\n"
+        )
+        install_prefix = packages_dir / name / "build" / f"{name}-1.0" / "install"
+        pkgdir = install_prefix / site_packages / name
+        pkgdir.mkdir(parents=True)
+        (pkgdir / "__init__.py").write_text("")
+        (pkgdir / "libshared.so").write_bytes(b"wasm")
+        (pkgdir / "big.dat").write_bytes(b"0" * 2048)
+        (pkgdir / "unique.dat").write_bytes(name.encode() * 2048)
+
+    pkg_map = buildall.generate_dependency_graph(packages_dir, {"pkga", "pkgb"})
+    Args = namedtuple(
+        "Args",
+        [
+            "package_format",
+            "compression",
+            "compile_bytecode",
+            "strip_sources",
+            "deduplicate_min_size",
+        ],
+    )
+    for pkg in pkg_map.values():
+        pkg.package_format = "zip"
+
+    saved = buildall.deduplicate_shared_files(
+        pkg_map, outputdir, Args("zip", "lz4", False, False, 1)
+    )
+
+    assert saved == 4 + 2048
+    assert "Saved" in capsys.readouterr().out
+    so_digest = hashlib.sha256(b"wasm").hexdigest()
+    dat_digest = hashlib.sha256(b"0" * 2048).hexdigest()
+    assert sorted(path.name for path in (outputdir / "shared").iterdir()) == sorted(
+        [so_digest, dat_digest]
+    )
+    assert pkg_map["pkga"].shared_files == {
+        f"/{site_packages}/pkga/big.dat": dat_digest,
+        f"/{site_packages}/pkga/libshared.so": so_digest,
+    }
+    with zipfile.ZipFile(outputdir / "pkga.zip") as zf:
+        assert zf.namelist() == [
+            f"{site_packages}/pkga/__init__.py",
+            f"{site_packages}/pkga/unique.dat",
+        ]
+
+    package_data = buildall.generate_packages_json(pkg_map)
+    assert package_data["packages"]["pkgb"]["shared_files"] == {
+        f"/{site_packages}/pkgb/big.dat": dat_digest,
+        f"/{site_packages}/pkgb/libshared.so": so_digest,
+    }
+    # the shared files are needed to keep a package in packages.json
+    (outputdir / "pkgb.zip").rename(outputdir / "pkgb.zip.bak")
+    merged = buildall.merge_packages_json({"packages": {}}, package_data, {}, outputdir)
+    assert "pkga" in merged["packages"]
+    (outputdir / "shared" / so_digest).unlink()
+    merged = buildall.merge_packages_json({"packages": {}}, package_data, {}, outputdir)
+    assert "pkga" not in merged["packages"]
+
+
 @pytest.mark.parametrize("n_jobs", [1, 4])
 def test_build_dependencies(n_jobs, monkeypatch):
     build_list = []
@@ -59,7 +221,6 @@ def test_build_dependencies(n_jobs, monkeypatch):
 
     pkg_map = buildall.generate_dependency_graph(PACKAGES_DIR, {"lxml", "micropip"})
 
-    Args = namedtuple("args", ["n_jobs"])
     buildall.build_from_graph(pkg_map, Path("."), Args(n_jobs=n_jobs))
 
     assert set(build_list) == {
@@ -100,7 +261,6 @@ def test_build_all_dependencies(n_jobs, monkeypatch):
 
     pkg_map = buildall.generate_dependency_graph(PACKAGES_DIR, packages=None)
 
-    Args = namedtuple("args", ["n_jobs"])
     buildall.build_from_graph(pkg_map, Path("."), Args(n_jobs=n_jobs))
 
 
@@ -117,5 +277,265 @@ def test_build_error(n_jobs, monkeypatch):
     pkg_map = buildall.generate_dependency_graph(PACKAGES_DIR, {"lxml"})
 
     with pytest.raises(ValueError, match="Failed build"):
-        Args = namedtuple("args", ["n_jobs"])
         buildall.build_from_graph(pkg_map, Path("."), Args(n_jobs=n_jobs))
+
+
+def test_critical_path_priority(monkeypatch):
+    build_list = []
+
+    class MockPackage(buildall.Package):
+        def build(self, outputdir: Path, args) -> None:
+            build_list.append(self.name)
+            self.status = "built"
+
+    monkeypatch.setattr(buildall, "Package", MockPackage)
+
+    pkg_map = buildall.generate_dependency_graph(PACKAGES_DIR, {"scipy", "pytz", "six"})
+    for name, build_time in [("numpy", 100.0), ("scipy", 300.0), ("CLAPACK", 10.0)]:
+        pkg_map[name].build_time = build_time
+    buildall.compute_critical_paths(pkg_map)
+
+    assert pkg_map["scipy"].critical_path == 300.0
+    assert pkg_map["numpy"].critical_path == 400.0
+    assert pkg_map["CLAPACK"].critical_path == 310.0
+    # the priority queue pops the smallest element first
+    assert pkg_map["numpy"] < pkg_map["pytz"]
+
+    build_times = buildall.build_from_graph(pkg_map, Path("."), Args(n_jobs=1))
+    # numpy holds up the longest chain, so it is built first
+    assert build_list[0] == "numpy"
+    assert set(build_times) == set(pkg_map)
+
+
+def test_build_trace(tmpdir, monkeypatch):
+    class MockPackage(buildall.Package):
+        def build(self, outputdir: Path, args) -> None:
+            # buildpkg writes the trace of its phases next to the package
+            self.trace_path = Path(tmpdir) / f"{self.name}.json"
+            phases = common.BuildTrace()
+            with phases.phase("compile"):
+                pass
+            phases.save(self.trace_path)
+            if self.name == "libxml":
+                raise ValueError("Failed build")
+
+    monkeypatch.setattr(buildall, "Package", MockPackage)
+
+    pkg_map = buildall.generate_dependency_graph(PACKAGES_DIR, {"lxml", "pytz"})
+    trace = common.BuildTrace()
+    buildall.build_from_graph(
+        pkg_map, Path("."), Args(n_jobs=2, keep_going=True), trace
+    )
+
+    packages = {
+        event["name"]: event
+        for event in trace.events
+        if event["ph"] == "X" and event["name"] != "compile"
+    }
+    assert set(packages) == {name for name, pkg in pkg_map.items() if not pkg.skipped}
+    assert packages["libxml"]["args"]["status"] == "failed"
+    assert {event["tid"] for event in packages.values()} <= {1, 2}
+    # each package has the phases recorded by buildpkg in its thread lane
+    compile_tids = [
+        event["tid"] for event in trace.events if event["name"] == "compile"
+    ]
+    assert sorted(compile_tids) == sorted(event["tid"] for event in packages.values())
+
+
+@pytest.mark.parametrize("status", ["built", "restored", "up to date"])
+def test_build_status(status, tmpdir, monkeypatch):
+    packages_dir = Path(tmpdir) / "packages"
+    (packages_dir / "pkga").mkdir(parents=True)
+    (packages_dir / "pkga" / "meta.yaml").write_text(
+        "package:\n  name: pkga\n  version: '1.0'\nbuild:\n  library: true\n"
+    )
+    (packages_dir / "pkga" / "build.log").write_text("previous build\n")
+
+    def run(cmd, stdout, **kwargs):
+        # buildpkg prints more than two lines when restoring from the cache
+        stdout.write("Building pkga\nRestored pkga\ndone building pkga\n")
+        status_file = Path(cmd[cmd.index("--status-file") + 1])
+        status_file.parent.mkdir(exist_ok=True)
+        status_file.write_text(status + "\n")
+        return subprocess.CompletedProcess(cmd, 0)
+
+    monkeypatch.setattr(buildall.subprocess, "run", run)
+    args = argparse.Namespace(
+        **{name: "" for name in ["cflags", "cxxflags", "ldflags", "target"]},
+        **{name: "" for name in ["install_dir", "cache_dir", "source_mirror"]},
+        package_format="data",
+        compression="lz4",
+        build_profile="default",
+        reuse_build_log=False,
+        reuse_objects=False,
+        compile_bytecode=False,
+        strip_sources=False,
+        trace_file="",
+        log_dir="",
+        n_jobs=1,
+        keep_going=False,
+        memory_budget=0,
+    )
+    pkg_map = buildall.generate_dependency_graph(packages_dir, {"pkga"})
+    build_times = buildall.build_from_graph(pkg_map, Path(tmpdir), args)
+
+    assert pkg_map["pkga"].status == status
+    build_log = (packages_dir / "pkga" / "build.log").read_text()
+    times_path = Path(tmpdir) / "build_times.json"
+    buildall.save_build_times(times_path, {"pkga": 100.0})
+    buildall.save_build_times(times_path, build_times)
+    if status == "built":
+        assert "Restored" in build_log
+        assert buildall.load_build_times(times_path)["pkga"] < 100.0
+    else:
+        # the log and the duration of the last actual build are kept
+        assert build_log == "previous build\n"
+        assert buildall.load_build_times(times_path) == {"pkga": 100.0}
+
+
+def test_build_times_file(tmpdir):
+    path = Path(tmpdir) / "build_times.json"
+    assert buildall.load_build_times(path) == {}
+    buildall.save_build_times(path, {"numpy": 10.0, "scipy": 20.0})
+    buildall.save_build_times(path, {"numpy": 12.0})
+    assert buildall.load_build_times(path) == {"numpy": 12.0, "scipy": 20.0}
+
+
+def test_profile_report(tmpdir):
+    outputdir = Path(tmpdir)
+    report_path = outputdir / "report.json"
+    pkg_map = buildall.generate_dependency_graph(PACKAGES_DIR, {"beautifulsoup4"})
+
+    for profile, size in [("default", 1000000), ("size", 750000)]:
+        for name, pkg in pkg_map.items():
+            pkg.build_profile = profile
+            (outputdir / f"{name}.data").write_bytes(b"x" * size)
+        report = buildall.update_profile_report(report_path, pkg_map, outputdir)
+
+    assert report["size"]["soupsieve"] == {"size": 750000}
+    assert buildall.load_profile_report(report_path) == report
+    report["size"]["soupsieve"]["import_time"] = 0.25
+    assert buildall.format_profile_report(report).splitlines() == [
+        "package         default                   size",
+        "beautifulsoup4  1.00 MB          0.75 MB (75%)",
+        "soupsieve       1.00 MB  0.75 MB (75%) 0.250 s",
+    ]
+
+
+@pytest.mark.parametrize("n_jobs", [1, 4])
+def test_build_keep_going(n_jobs, monkeypatch, capsys):
+    build_list = []
+
+    class MockPackage(buildall.Package):
+        def build(self, outputdir: Path, args) -> None:
+            if self.name == "libxml":
+                raise ValueError("Failed build")
+            build_list.append(self.name)
+
+    monkeypatch.setattr(buildall, "Package", MockPackage)
+
+    pkg_map = buildall.generate_dependency_graph(PACKAGES_DIR, {"lxml", "micropip"})
+
+    buildall.build_from_graph(pkg_map, Path("."), Args(n_jobs=n_jobs, keep_going=True))
+
+    assert pkg_map["libxml"].failed
+    assert {name for name, pkg in pkg_map.items() if pkg.skipped} == {
+        "libxslt",
+        "lxml",
+    }
+    assert "micropip" in build_list
+    assert "zlib" in build_list
+    assert "lxml" not in build_list
+
+    captured = capsys.readouterr()
+    assert "failed (1): libxml" in captured.out
+    assert "skipped due to a failed dependency (2): libxslt, lxml" in captured.out
+
+
+@pytest.mark.parametrize("memory_budget", [0, 1000])
+def test_build_resource_budget(memory_budget, monkeypatch):
+    lock = Lock()
+    used = {"cpus": 0, "memory": 0}
+    max_used = {"cpus": 0, "memory": 0}
+    heavy = {"numpy": (3, 800), "scipy": (3, 800), "CLAPACK": (4, 500)}
+
+    class MockPackage(buildall.Package):
+        def __init__(self, pkgdir, meta=None):
+            super().__init__(pkgdir, meta)
+            self.weight, self.memory = heavy.get(self.name, (1, 100))
+
+        def build(self, outputdir: Path, args) -> None:
+            with lock:
+                used["cpus"] += self.weight
+                used["memory"] += self.memory
+                for key in used:
+                    max_used[key] = max(max_used[key], used[key])
+            sleep(0.005)
+            with lock:
+                used["cpus"] -= self.weight
+                used["memory"] -= self.memory
+
+    monkeypatch.setattr(buildall, "Package", MockPackage)
+
+    pkg_map = buildall.generate_dependency_graph(
+        PACKAGES_DIR, {"scipy", "lxml", "pandas"}
+    )
+    buildall.build_from_graph(
+        pkg_map, Path("."), Args(n_jobs=4, memory_budget=memory_budget)
+    )
+
+    assert max_used["cpus"] <= 4
+    if memory_budget:
+        # numpy and scipy are never built at the same time
+        assert max_used["memory"] <= memory_budget
+
+
+def test_build_fractional_weights(monkeypatch):
+    lock = Lock()
+    running = {"now": 0, "max": 0}
+
+    class MockPackage(buildall.Package):
+        def __init__(self, pkgdir, meta=None):
+            super().__init__(pkgdir, meta)
+            self.weight = 0.25
+
+        def build(self, outputdir: Path, args) -> None:
+            with lock:
+                running["now"] += 1
+                running["max"] = max(running["max"], running["now"])
+            sleep(0.02)
+            with lock:
+                running["now"] -= 1
+
+    monkeypatch.setattr(buildall, "Package", MockPackage)
+
+    pkg_map = buildall.generate_dependency_graph(
+        PACKAGES_DIR, {"beautifulsoup4", "pytz", "micropip", "zlib"}
+    )
+    assert buildall.count_builder_threads(pkg_map, 1) == 4
+    buildall.build_from_graph(pkg_map, Path("."), Args(n_jobs=1, memory_budget=0))
+
+    # four packages of weight 0.25 are built at once with a single job
+    assert 1 < running["max"] <= 4
+
+
+def test_resource_budget_clamp():
+    budget = buildall.ResourceBudget(2, 100)
+    pkg = buildall.StdLibPackage(PACKAGES_DIR / "test")
+    pkg.weight, pkg.memory = 8, 1000
+    # requests larger than the budget don't block forever
+    budget.acquire(pkg)
+    assert (budget.used_cpus, budget.used_memory) == (2, 100)
+    budget.release(pkg)
+    assert (budget.used_cpus, budget.used_memory) == (0, 0)
+
+    # the rounding errors of fractional weights don't block a package
+    # needing the whole budget
+    pkg.weight, pkg.memory = 0.1, 0
+    for _ in range(3):
+        budget.acquire(pkg)
+    for _ in range(3):
+        budget.release(pkg)
+    assert budget.used_cpus != 0
+    pkg.weight = 2
+    budget.acquire(pkg)
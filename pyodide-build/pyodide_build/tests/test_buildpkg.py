@@ -1,7 +1,17 @@
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import gzip
+import hashlib
+import importlib.util
+import io
 import shutil
 import subprocess
+import sys
+from time import sleep
+import zipfile
 
 from pathlib import Path
+from typing import Any, Dict
 
 import pytest
 
@@ -33,6 +43,33 @@ def test_subprocess_with_shared_env():
     assert p.env["A"] == "7"
 
 
+def test_subprocess_with_shared_env_errors(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    p = buildpkg.BashRunnerWithSharedEnvironment()
+    p.env.pop("A", None)
+
+    # A failing script doesn't stop the following ones
+    with pytest.raises(subprocess.CalledProcessError) as e:
+        p.run("export A=1; false; echo not reached", check=True)
+    assert e.value.returncode == 1
+    res = p.run(
+        "echo out; echo err >&2", stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    assert (res.stdout, res.stderr) == (b"out\n", b"err\n")
+
+    # The environment is kept when the script exits early
+    res = p.run("export A='x y\nz'; exit 0; export A=3")
+    assert res.returncode == 0
+    assert p.env["A"] == "x y\nz"
+
+    # Scripts run in the current directory, and variables can be unset
+    del p.env["A"]
+    res = p.run('pwd; echo "${A-unset}"', stdout=subprocess.PIPE)
+    assert res.stdout.decode().split() == [str(Path(tmpdir).resolve()), "unset"]
+
+    p.close()
+
+
 def test_download_and_extract(monkeypatch):
     monkeypatch.setattr(subprocess, "run", lambda *args, **kwargs: True)
     monkeypatch.setattr(buildpkg, "check_checksum", lambda *args, **kwargs: True)
@@ -86,3 +123,323 @@ def test_run_script_environment(tmpdir):
     shared_env.env.pop("A", None)
     buildpkg.run_script(build_dir, src_dir, pkg, shared_env)
     assert shared_env.env["A"] == "2"
+
+
+def _make_cache_test_packages(tmpdir):
+    packages_dir = Path(tmpdir.mkdir("packages"))
+    for name, meta in [
+        (
+            "a",
+            "package: {name: a, version: '1.0'}\n"
+            "source: {path: src, patches: [a.patch]}\n"
+            "requirements: {run: [b, distutils]}\n",
+        ),
+        ("b", "package: {name: b, version: '1.0'}\nsource: {path: src}\n"),
+    ]:
+        (packages_dir / name / "src").mkdir(parents=True)
+        (packages_dir / name / "meta.yaml").write_text(meta)
+        (packages_dir / name / "src" / "module.py").write_text("x = 1\n")
+    (packages_dir / "a" / "a.patch").write_text("patch\n")
+    return packages_dir
+
+
+def test_compute_cache_key(tmpdir):
+    packages_dir = _make_cache_test_packages(tmpdir)
+    Args = namedtuple(
+        "args",
+        [
+            "cflags",
+            "cxxflags",
+            "ldflags",
+            "package_format",
+            "compression",
+            "compile_bytecode",
+            "strip_sources",
+            "build_profile",
+        ],
+    )
+    args = Args(
+        "-O2",
+        "",
+        "",
+        "data",
+        "lz4",
+        compile_bytecode=False,
+        strip_sources=False,
+        build_profile="default",
+    )
+    meta_path = packages_dir / "a" / "meta.yaml"
+
+    key = buildpkg.compute_cache_key(meta_path, args)
+    assert len(key) == 64
+    # touching files doesn't change the key
+    meta_path.touch()
+    assert buildpkg.compute_cache_key(meta_path, args) == key
+
+    assert buildpkg.compute_cache_key(meta_path, args._replace(cflags="-O3")) != key
+    assert (
+        buildpkg.compute_cache_key(meta_path, args._replace(package_format="zip"))
+        != key
+    )
+    assert (
+        buildpkg.compute_cache_key(meta_path, args._replace(compression="gzip")) != key
+    )
+    assert (
+        buildpkg.compute_cache_key(meta_path, args._replace(compile_bytecode=True))
+        != key
+    )
+    assert (
+        buildpkg.compute_cache_key(meta_path, args._replace(build_profile="size"))
+        != key
+    )
+
+    (packages_dir / "a" / "a.patch").write_text("other patch\n")
+    key_patched = buildpkg.compute_cache_key(meta_path, args)
+    assert key_patched != key
+
+    # changes in dependencies propagate to dependents
+    (packages_dir / "b" / "src" / "module.py").write_text("x = 2\n")
+    assert buildpkg.compute_cache_key(meta_path, args) != key_patched
+
+
+def test_build_cache(tmpdir):
+    cache_dir = Path(tmpdir.mkdir("cache"))
+    buildpath = Path(tmpdir.mkdir("build"))
+    (buildpath / "a.data").write_bytes(b"data")
+    (buildpath / "a.js").write_text("js")
+
+    assert not buildpkg.restore_from_cache(buildpath, "a", "key", cache_dir)
+    buildpkg.store_in_cache(buildpath, "a", "key", cache_dir)
+    # storing an existing entry is a no-op
+    buildpkg.store_in_cache(buildpath, "a", "key", cache_dir)
+
+    restored_path = Path(tmpdir) / "restored"
+    assert buildpkg.restore_from_cache(restored_path, "a", "key", cache_dir)
+    assert (restored_path / "a.data").read_bytes() == b"data"
+    assert (restored_path / "a.js").read_text() == "js"
+    assert not buildpkg.restore_from_cache(restored_path, "a", "key2", cache_dir)
+
+
+@pytest.mark.parametrize("compression", ["lz4", "gzip"])
+def test_package_files_zip(tmpdir, compression):
+    buildpath = Path(tmpdir.mkdir("build"))
+    srcpath = buildpath / "pkg-1.0"
+    site_packages = srcpath / "install" / "lib" / "python3.9" / "site-packages"
+    (site_packages / "pkg" / "__pycache__").mkdir(parents=True)
+    (site_packages / "pkg" / "__init__.py").write_text("")
+    (site_packages / "pkg" / "__pycache__" / "__init__.cpython-39.pyc").write_text("")
+    (site_packages / "pkg" / "_ext.so").write_bytes(b"wasm")
+
+    Args = namedtuple("Args", ["package_format", "compile_bytecode", "compression"])
+    pkg = {"package": {"name": "pkg", "version": "1.0"}}
+    buildpkg.package_files(buildpath, srcpath, pkg, Args("zip", False, compression))
+
+    with zipfile.ZipFile(buildpath / "pkg.zip") as zf:
+        assert zf.namelist() == [
+            "lib/python3.9/site-packages/pkg/__init__.py",
+            "lib/python3.9/site-packages/pkg/_ext.so",
+        ]
+        info = zf.getinfo("lib/python3.9/site-packages/pkg/_ext.so")
+    assert (buildpath / ".packaged").is_file()
+    if compression == "gzip":
+        # the archive is compressed as a whole
+        assert info.compress_type == zipfile.ZIP_STORED
+        assert buildpkg.package_output_files("pkg", "zip", "gzip") == [
+            "pkg.zip",
+            "pkg.zip.gz",
+        ]
+        assert (
+            gzip.decompress((buildpath / "pkg.zip.gz").read_bytes())
+            == (buildpath / "pkg.zip").read_bytes()
+        )
+    else:
+        assert info.compress_type == zipfile.ZIP_DEFLATED
+        assert buildpkg.package_output_files("pkg", "zip") == ["pkg.zip"]
+
+
+def test_get_compression():
+    Args = namedtuple("Args", ["compression"])
+    pkg: Dict[str, Any] = {"package": {"name": "pkg", "version": "1.0"}}
+    assert buildpkg.get_compression(pkg, Args("none")) == "none"
+    pkg["build"] = {"compression": "brotli"}
+    assert buildpkg.get_compression(pkg, Args("none")) == "brotli"
+    pkg["build"] = {"compression": "zstd"}
+    with pytest.raises(ValueError, match="Unknown compression 'zstd' of package pkg"):
+        buildpkg.get_compression(pkg, Args("none"))
+
+
+def test_get_build_profile():
+    Args = namedtuple("Args", ["build_profile"])
+    pkg: Dict[str, Any] = {"package": {"name": "pkg", "version": "1.0"}}
+    assert buildpkg.get_build_profile(pkg, Args("speed")) == "speed"
+    pkg["build"] = {"profile": "size"}
+    assert buildpkg.get_build_profile(pkg, Args("speed")) == "size"
+    pkg["build"] = {"profile": "fast"}
+    with pytest.raises(ValueError, match="Unknown build profile"):
+        buildpkg.get_build_profile(pkg, Args("speed"))
+
+    ldflags = '-s BINARYEN_EXTRA_PASSES="--pass-arg=max-func-params@61" -O2 -s WASM=1'
+    assert buildpkg.apply_build_profile(ldflags, "default") == ldflags
+    assert buildpkg.apply_build_profile(ldflags, "speed") == ldflags.replace(
+        "-O2", "-O3"
+    )
+    assert buildpkg.apply_build_profile("-O2 -g3 -fPIC", "debug") == "-O0 -fPIC -g"
+
+    Args = namedtuple("Args", ["build_profile", "cflags", "cxxflags", "ldflags"])
+    args = Args("size", "-O2 -g -fPIC", "-O2", "-O2 -s SIDE_MODULE=1")
+    pkg["build"] = {"cflags": "-DX", "cxxflags": "-std=c++11 -O3 -g"}
+    assert buildpkg.get_compiler_flags(pkg, args) == (
+        "-Oz -fPIC -DX",
+        "-Oz -std=c++11 -Oz",
+        "-Oz -s SIDE_MODULE=1 ",
+    )
+
+
+@pytest.mark.parametrize("strip_sources", [False, True])
+def test_compile_bytecode(tmpdir, strip_sources):
+    install_prefix = Path(tmpdir)
+    pkgdir = install_prefix / "lib" / "python3.9" / "site-packages" / "pkg"
+    (pkgdir / "__pycache__").mkdir(parents=True)
+    (pkgdir / "__pycache__" / "stale.cpython-39.pyc").write_text("")
+    (pkgdir / "__init__.py").write_text("x = 1\n")
+    (pkgdir / "py2.py").write_text("print 'python 2'\n")
+
+    buildpkg.compile_bytecode(install_prefix, sys.executable, strip_sources)
+
+    assert not (pkgdir / "__pycache__" / "stale.cpython-39.pyc").exists()
+    if strip_sources:
+        pyc = pkgdir / "__init__.pyc"
+        assert not (pkgdir / "__init__.py").exists()
+    else:
+        pyc = Path(importlib.util.cache_from_source(str(pkgdir / "__init__.py")))
+        assert (pkgdir / "__init__.py").exists()
+    # bytecode is used without checking the sources
+    flags = int.from_bytes(pyc.read_bytes()[4:8], "little")
+    assert flags == 0b01
+    # modules that can't be compiled keep their sources
+    assert (pkgdir / "py2.py").exists()
+
+
+def test_needs_rebuild_cache_key(tmpdir):
+    buildpath = Path(tmpdir.mkdir("build"))
+    meta_path = Path(tmpdir) / "meta.yaml"
+    meta_path.write_text("")
+    pkg: dict = {}
+    assert buildpkg.needs_rebuild(pkg, meta_path, buildpath, "key")
+
+    (buildpath / ".packaged").write_text("key\n")
+    assert not buildpkg.needs_rebuild(pkg, meta_path, buildpath, "key")
+    assert buildpkg.needs_rebuild(pkg, meta_path, buildpath, "other_key")
+
+
+def _make_tarball_pkg(tmpdir, content=b"tarball content"):
+    tarball = Path(tmpdir) / "remote" / "pkg-1.0.tar.gz"
+    tarball.parent.mkdir()
+    tarball.write_bytes(content)
+    return {
+        "package": {"name": "pkg", "version": "1.0"},
+        "source": {
+            "url": tarball.as_uri(),
+            "sha256": hashlib.sha256(content).hexdigest(),
+        },
+    }
+
+
+def test_fetch_tarball_cache(tmpdir, monkeypatch):
+    pkg = _make_tarball_pkg(tmpdir)
+    source_cache = Path(tmpdir) / "sources"
+    tarballpath = buildpkg.fetch_tarball(Path(tmpdir) / "build", pkg, source_cache)
+    assert tarballpath.name == "pkg-1.0.tar.gz"
+    assert tarballpath.read_bytes() == b"tarball content"
+    assert tarballpath.parent == source_cache / ("sha256-" + pkg["source"]["sha256"])
+
+    # The cached tarball is reused without network access
+    def urlopen(*args, **kwargs):
+        raise AssertionError("Unexpected download")
+
+    monkeypatch.setattr(buildpkg.request, "urlopen", urlopen)
+    assert buildpkg.fetch_tarball(Path(tmpdir) / "build", pkg, source_cache) == (
+        tarballpath
+    )
+
+    # Populate another cache from a mirror with the same layout
+    other_cache = Path(tmpdir) / "other_sources"
+    mirrored = buildpkg.fetch_tarball(
+        Path(tmpdir) / "build", pkg, other_cache, source_mirror=source_cache
+    )
+    assert mirrored.read_bytes() == b"tarball content"
+    assert mirrored.parent.parent == other_cache
+
+
+def test_fetch_tarball_concurrent(tmpdir, monkeypatch):
+    content = b"0123456789" * 10000
+    pkg = _make_tarball_pkg(tmpdir, content)
+    source_cache = Path(tmpdir) / "sources"
+    urlopen = buildpkg.request.urlopen
+    downloads = []
+
+    class SlowResponse(io.BytesIO):
+        status = 200
+        headers: dict = {}
+
+        def geturl(self):
+            return pkg["source"]["url"]
+
+        def read(self, size=-1):
+            sleep(0.001)
+            return super().read(min(size, 1000))
+
+    def slow_urlopen(req):
+        downloads.append(req)
+        with urlopen(req) as response:
+            return SlowResponse(response.read())
+
+    monkeypatch.setattr(buildpkg.request, "urlopen", slow_urlopen)
+    with ThreadPoolExecutor(2) as executor:
+        futures = [
+            executor.submit(
+                buildpkg.fetch_tarball, Path(tmpdir) / f"build{n}", pkg, source_cache
+            )
+            for n in range(2)
+        ]
+        paths = [future.result() for future in futures]
+
+    # the second build waits for the first one and reuses its tarball
+    assert len(downloads) == 1
+    assert paths[0] == paths[1]
+    assert paths[0].read_bytes() == content
+
+
+def test_download_tarball_checksum(tmpdir):
+    pkg = _make_tarball_pkg(tmpdir)
+    pkg["source"]["sha256"] = "0" * 64
+    destdir = Path(tmpdir) / "build"
+    with pytest.raises(ValueError, match="Invalid sha256 checksum"):
+        buildpkg.download_tarball(pkg["source"]["url"], destdir, pkg)
+    assert list(destdir.iterdir()) == []
+
+
+def test_download_tarball_resume(tmpdir, monkeypatch):
+    content = b"0123456789" * 10000
+    pkg = _make_tarball_pkg(tmpdir, content)
+    destdir = Path(tmpdir) / "build"
+    destdir.mkdir()
+    (destdir / ".download.partial").write_bytes(content[:12345])
+
+    requests = []
+
+    class RangeResponse(io.BytesIO):
+        status = 206
+        headers: dict = {}
+
+        def geturl(self):
+            return pkg["source"]["url"]
+
+    def urlopen(req):
+        requests.append(req.get_header("Range"))
+        return RangeResponse(content[12345:])
+
+    monkeypatch.setattr(buildpkg.request, "urlopen", urlopen)
+    tarballpath = buildpkg.download_tarball(pkg["source"]["url"], destdir, pkg)
+    assert requests == ["bytes=12345-"]
+    assert tarballpath.read_bytes() == content
@@ -1,9 +1,13 @@
+import json
+import subprocess
 import sys
 from pathlib import Path
 
 sys.path.append(str(Path(__file__).parents[2]))
 
 from pyodide_build.common import (
+    MAKE_ENVIRONMENT_CACHE_VAR,
+    BuildTrace,
     _parse_package_subset,
     get_make_flag,
     get_make_environment_vars,
@@ -85,3 +89,72 @@ def test_get_make_environment_vars():
     assert "SIDE_MODULE_CFLAGS" in vars
     assert "SIDE_MODULE_CXXFLAGS" in vars
     assert "TOOLSDIR" in vars
+
+
+def test_get_make_environment_vars_cache(tmp_path, monkeypatch):
+    cache_path = tmp_path / "make-environment.json"
+    monkeypatch.setenv(MAKE_ENVIRONMENT_CACHE_VAR, str(cache_path))
+    vars = get_make_environment_vars.__wrapped__()
+    cache = json.loads(cache_path.read_text())
+    assert cache["vars"] == vars
+
+    # Child processes read the saved variables instead of running make
+    def run(*args, **kwargs):
+        raise AssertionError("make should not run")
+
+    with monkeypatch.context() as m:
+        m.setattr(subprocess, "run", run)
+        assert get_make_environment_vars.__wrapped__() == vars
+
+    # The variables are resolved again when Makefile.envs changed
+    cache["stamp"][1] -= 1
+    cache["vars"] = {"TOOLSDIR": "stale"}
+    cache_path.write_text(json.dumps(cache))
+    assert get_make_environment_vars.__wrapped__()["TOOLSDIR"] == vars["TOOLSDIR"]
+    assert json.loads(cache_path.read_text())["vars"]["TOOLSDIR"] == vars["TOOLSDIR"]
+
+
+def test_build_trace(tmpdir):
+    trace = BuildTrace()
+    with trace.phase("compile", package="numpy"):
+        pass
+    trace.set_thread_name(1, "Thread 1")
+
+    other = BuildTrace()
+    other.add_event("replay_compile", 10.0, 12.5, pid=1234, tid=5)
+    trace.merge(other.events, pid=1, tid=1)
+
+    path = Path(tmpdir) / "trace.json"
+    trace.save(path)
+    events = BuildTrace.load(path)
+
+    compile_event, thread_name, replay_event = events
+    assert compile_event["name"] == "compile"
+    assert compile_event["ph"] == "X"
+    assert compile_event["args"]["package"] == "numpy"
+    assert compile_event["args"]["max_child_rss_kb_so_far"] >= 0
+    assert thread_name["ph"] == "M"
+    assert thread_name["args"] == {"name": "Thread 1"}
+    assert replay_event["ts"] == 10_000_000
+    assert replay_event["dur"] == 2_500_000
+    assert (replay_event["pid"], replay_event["tid"]) == (1, 1)
+
+
+def test_build_trace_child_rss():
+    trace = BuildTrace()
+    with trace.phase("large"):
+        # larger than the children of the previous tests
+        subprocess.run(
+            [sys.executable, "-c", "data = b'x' * 500_000_000"],
+            check=True,
+        )
+    with trace.phase("small"):
+        subprocess.run([sys.executable, "-c", "pass"], check=True)
+
+    large, small = trace.events
+    assert large["args"]["max_child_rss_kb"] > 400_000
+    # the peak of the previous phase is not attributed to this one
+    assert "max_child_rss_kb" not in small["args"]
+    assert small["args"]["max_child_rss_kb_so_far"] == (
+        large["args"]["max_child_rss_kb"]
+    )
@@ -25,3 +25,29 @@ def test_fix_f2c_clapack_calls(tmpdir):
         code_fixed = fh.read()
 
     assert code_fixed == code.replace("sgemv_", "wsgemv_")
+
+
+def test_fix_f2c_clapack_calls_identifiers(tmpdir):
+    code = dedent(
+        """
+       extern int dgemm_(char *, char *), cher_(char *), cher2_(char *);
+       static integer c__1 = 1;
+       dgemm_("N", "N"); cher_("U"); cher2_("U"); xdgemm_("N"); dgemm_x();
+       """
+    )
+    expected = dedent(
+        """
+       extern int wdgemm_(char *, char *), wcher_(char *), wcher2_(char *);
+       static integer c__1 = 1;
+       wdgemm_("N", "N"); wcher_("U"); wcher2_("U"); xdgemm_("N"); dgemm_x();
+       """
+    )
+
+    source_file = str(tmpdir / "source.c")
+    with open(source_file, "w") as fh:
+        fh.write(code)
+
+    fix_f2c_clapack_calls(source_file)
+
+    with open(source_file, "r") as fh:
+        assert fh.read() == expected
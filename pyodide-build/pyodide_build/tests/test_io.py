@@ -0,0 +1,77 @@
+import os
+from pathlib import Path
+
+import pytest
+import yaml
+
+from pyodide_build import io
+from pyodide_build.io import check_package_config, parse_package_config
+
+
+def test_check_package_config():
+    config = {
+        "package": {"name": "a", "version": "1.0"},
+        "source": {"url": "https://a", "extras": [["src/a.py", "a.py"]]},
+        "build": {"weight": 0.25, "memory": 2},
+        "requirements": {"run": ["b"]},
+    }
+    assert check_package_config(config) == []
+
+    errors = check_package_config(
+        {
+            "package": {"name": "a"},
+            "source": {"extras": [["src/a.py"]], "patches": ["a.patch", 1]},
+            "build": {"weight": True, "memory": 0.5, "unknown": 1},
+            "test": None,
+        },
+        raise_errors=False,
+    )
+    assert errors == [
+        "Wrong type for 'source/extras': expected List[Tuple[str, str]], "
+        "got [['src/a.py']].",
+        "Wrong type for 'source/patches': expected List[str], got ['a.patch', 1].",
+        "Found unknown keys ['build/unknown']. Expected keys are "
+        f"{['build/' + key for key in io.PACKAGE_CONFIG_SPEC['build']]}.",
+        "Wrong type for 'build/weight': expected float, got True.",
+        "Wrong type for 'build/memory': expected int, got 0.5.",
+        "Wrong type for 'test': expected a mapping, got NoneType.",
+        "Missing mandatory key 'package/version'.",
+    ]
+
+    with pytest.raises(ValueError, match="validation failed"):
+        check_package_config({"package": {"name": "a"}})
+
+
+def test_parse_package_config_memoized(tmpdir, monkeypatch):
+    meta_path = Path(tmpdir) / "meta.yaml"
+    meta_path.write_text("package:\n  name: a\n  version: '1.0'\n")
+
+    loads = []
+    load = yaml.load
+
+    def counting_load(*args, **kwargs):
+        loads.append(kwargs["Loader"])
+        return load(*args, **kwargs)
+
+    monkeypatch.setattr(yaml, "load", counting_load)
+
+    config = parse_package_config(meta_path)
+    assert config == {"package": {"name": "a", "version": "1.0"}}
+    # the returned config can be modified without affecting the cache
+    config["package"]["version"] = "2.0"
+    assert parse_package_config(meta_path)["package"]["version"] == "1.0"
+    assert len(loads) == 1
+    assert loads[0] is getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+    meta_path.write_text("package:\n  name: a\n  version: '1.1'\n")
+    stat = meta_path.stat()
+    os.utime(meta_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+    assert parse_package_config(meta_path)["package"]["version"] == "1.1"
+    assert len(loads) == 2
+
+    # invalid files are not memoized as checked
+    meta_path.write_text("package:\n  name: a\n")
+    os.utime(meta_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 2_000_000))
+    assert parse_package_config(meta_path, check=False) == {"package": {"name": "a"}}
+    with pytest.raises(ValueError, match="package/version"):
+        parse_package_config(meta_path)
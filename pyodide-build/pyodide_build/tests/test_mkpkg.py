@@ -1,3 +1,5 @@
+import http.client
+import json
 import os
 from pathlib import Path
 import pytest
@@ -52,3 +54,155 @@ def test_mkpkg_update(tmpdir, monkeypatch):
     assert parse_version(db["package"]["version"]) > parse_version(
         db_init["package"]["version"]
     )
+
+
+def _write_pypi_fixture(index_dir, package, version, files):
+    """Write the PyPI JSON metadata of a package with sdists"""
+    releases = {
+        ver: [
+            {
+                "filename": f"{package}-{ver}.tar.gz",
+                "url": f"https://files/{package}-{ver}.tar.gz",
+                "digests": {"sha256": sha256},
+            }
+        ]
+        for ver, sha256 in files.items()
+    }
+    metadata = {
+        "info": {"name": package, "version": version},
+        "urls": releases[version],
+        "releases": releases,
+    }
+    (index_dir / package).mkdir(parents=True)
+    (index_dir / package / "json").write_text(json.dumps(metadata))
+
+
+def _make_update_fixture(base_dir):
+    """Write packages in various states, and a local PyPI index"""
+    packages_dir = base_dir / "packages"
+    index_dir = base_dir / "pypi"
+
+    def write_meta(name, meta):
+        (packages_dir / name).mkdir(parents=True)
+        with open(packages_dir / name / "meta.yaml", "w") as fh:
+            yaml.dump(meta, fh)
+
+    def source(name, version, sha256):
+        return {"url": f"https://files/{name}-{version}.tar.gz", "sha256": sha256}
+
+    write_meta(
+        "outdated",
+        {
+            "package": {"name": "outdated", "version": "1.0"},
+            "source": source("outdated", "1.0", "a" * 64),
+        },
+    )
+    _write_pypi_fixture(
+        index_dir, "outdated", "2.0", {"1.0": "a" * 64, "2.0": "b" * 64}
+    )
+    write_meta(
+        "uptodate",
+        {
+            "package": {"name": "uptodate", "version": "1.0"},
+            "source": source("uptodate", "1.0", "c" * 64),
+        },
+    )
+    _write_pypi_fixture(index_dir, "uptodate", "1.0", {"1.0": "d" * 64})
+    write_meta(
+        "patched",
+        {
+            "package": {"name": "patched", "version": "1.0"},
+            "source": dict(source("patched", "1.0", "e" * 64), patches=["a.patch"]),
+        },
+    )
+    _write_pypi_fixture(index_dir, "patched", "2.0", {"2.0": "f" * 64})
+    write_meta(
+        "local",
+        {"package": {"name": "local", "version": "1.0"}, "source": {"path": "src"}},
+    )
+    write_meta(
+        "missing",
+        {
+            "package": {"name": "missing", "version": "1.0"},
+            "source": source("missing", "1.0", "0" * 64),
+        },
+    )
+    return packages_dir, index_dir
+
+
+def test_pypi_client_errors(tmpdir, monkeypatch):
+    index_dir = Path(str(tmpdir))
+    (index_dir / "broken").mkdir()
+    (index_dir / "broken" / "json").write_text("<html>")
+    client = pyodide_build.mkpkg.PyPIClient(str(index_dir))
+    with pytest.raises(pyodide_build.mkpkg.MkpkgFailedException):
+        client.get_metadata("broken")
+
+    requests = []
+
+    class Response:
+        status = 302
+        reason = "Found"
+        headers = {"Location": "/pypi/other/json?serial=1"}
+
+        def read(self):
+            return b""
+
+    class Connection:
+        def request(self, method, path):
+            requests.append(path)
+
+        def getresponse(self):
+            if len(requests) == 1:
+                return Response()
+            raise http.client.BadStatusLine("")
+
+        def close(self):
+            pass
+
+    client = pyodide_build.mkpkg.PyPIClient("https://pypi.example/pypi")
+    monkeypatch.setattr(client, "_connection", lambda netloc: Connection())
+    with pytest.raises(pyodide_build.mkpkg.MkpkgFailedException):
+        client.get_metadata("pkg")
+    # the query string of the redirect is kept, and the request is retried
+    assert requests == [
+        "/pypi/pkg/json",
+        "/pypi/other/json?serial=1",
+        "/pypi/other/json?serial=1",
+    ]
+
+
+def test_update_packages(tmpdir):
+    packages_dir, index_dir = _make_update_fixture(Path(str(tmpdir)))
+
+    plans = pyodide_build.mkpkg.update_packages(
+        packages_dir, update_patched=False, jobs=4, index=str(index_dir), dry_run=True
+    )
+
+    assert [(plan.package, plan.action) for plan in plans] == [
+        ("local", "skip"),
+        ("missing", "error"),
+        ("outdated", "update"),
+        ("patched", "error"),
+        ("uptodate", "up-to-date"),
+    ]
+    outdated = plans[2]
+    assert (outdated.version, outdated.sha256) == ("2.0", "b" * 64)
+    assert outdated.url == "https://files/outdated-2.0.tar.gz"
+    # the checksum of uptodate is not the one of its sdist on PyPI
+    assert "sha256" in plans[4].warnings[0]
+    # nothing is written in a dry run
+    db = parse_package_config(packages_dir / "outdated" / "meta.yaml")
+    assert db["package"]["version"] == "1.0"
+
+
+def test_update_packages_write(tmpdir):
+    pytest.importorskip("ruamel")
+    packages_dir, index_dir = _make_update_fixture(Path(str(tmpdir)))
+
+    pyodide_build.mkpkg.update_packages(
+        packages_dir, ["outdated"], index=str(index_dir)
+    )
+    db = parse_package_config(packages_dir / "outdated" / "meta.yaml")
+    assert db["package"]["version"] == "2.0"
+    assert db["source"]["sha256"] == "b" * 64
@@ -0,0 +1,101 @@
+import argparse
+import json
+from pathlib import Path
+import zipfile
+
+from pyodide_build import prune
+
+SITE_PACKAGES = "lib/python3.9/site-packages"
+
+
+def make_package(packages_dir: Path) -> Path:
+    pkg_root = packages_dir / "pkg"
+    pkg_root.mkdir(parents=True)
+    (pkg_root / "meta.yaml").write_text(
+        "package:\n  name: pkg\n  version: '1.0'\n"
+        "source:\n  url: https://example.com/pkg-1.0.tar.gz\n"
+    )
+    install_prefix = pkg_root / "build" / "pkg-1.0" / "install"
+    for path in [
+        "pkg/__init__.py",
+        "pkg/used.py",
+        "pkg/unused.py",
+        "pkg/__pycache__/used.cpython-39.pyc",
+        "pkg/__pycache__/unused.cpython-39.pyc",
+        "pkg/sub/__init__.py",
+        "pkg/sub/_ext.so",
+        "pkg/data/table.csv",
+        "pkg/tests/__init__.py",
+        "pkg/tests/test_pkg.py",
+        "pkg-1.0.dist-info/METADATA",
+    ]:
+        file = install_prefix / SITE_PACKAGES / path
+        file.parent.mkdir(parents=True, exist_ok=True)
+        file.write_text(path)
+    return install_prefix
+
+
+def test_select_files(tmp_path):
+    install_prefix = make_package(tmp_path)
+    trace = {f"/{SITE_PACKAGES}/pkg/used.py", f"/{SITE_PACKAGES}/pkg/data/table.csv"}
+
+    kept = prune.select_files(install_prefix, trace, prune.DEFAULT_KEEP)
+
+    assert sorted(path[len(SITE_PACKAGES) + 1 :] for path, k in kept.items() if k) == [
+        "pkg-1.0.dist-info/METADATA",
+        "pkg/__init__.py",
+        "pkg/__pycache__/used.cpython-39.pyc",
+        "pkg/data/table.csv",
+        "pkg/sub/__init__.py",
+        "pkg/sub/_ext.so",
+        "pkg/used.py",
+    ]
+
+
+def test_prune_bundle(tmp_path):
+    make_package(tmp_path / "packages")
+    build_dir = tmp_path / "build"
+    build_dir.mkdir()
+    (build_dir / "packages.json").write_text(
+        json.dumps({"packages": {"pkg": {"name": "pkg", "depends": []}}})
+    )
+    trace_file = tmp_path / "trace.json"
+    prune.save_trace(trace_file, {f"/{SITE_PACKAGES}/pkg/used.py"})
+
+    parser = prune.make_parser(argparse.ArgumentParser())
+    args = parser.parse_args(
+        [
+            "bundle",
+            "pkg",
+            "--trace",
+            str(trace_file),
+            "--packages-dir",
+            str(tmp_path / "packages"),
+            "--build-dir",
+            str(build_dir),
+            "--package-format",
+            "zip",
+        ]
+    )
+    prune.main(args)
+
+    with zipfile.ZipFile(build_dir / "pkg.zip") as zf:
+        assert f"{SITE_PACKAGES}/pkg/used.py" in zf.namelist()
+        assert f"{SITE_PACKAGES}/pkg/unused.py" not in zf.namelist()
+
+    manifest = json.loads((build_dir / "pkg.pruned.json").read_text())
+    assert sorted(manifest["removed"]) == [
+        f"/{SITE_PACKAGES}/pkg/__pycache__/unused.cpython-39.pyc",
+        f"/{SITE_PACKAGES}/pkg/data/table.csv",
+        f"/{SITE_PACKAGES}/pkg/tests/__init__.py",
+        f"/{SITE_PACKAGES}/pkg/tests/test_pkg.py",
+        f"/{SITE_PACKAGES}/pkg/unused.py",
+    ]
+    for path in manifest["removed"]:
+        contents = path[len(SITE_PACKAGES) + 2 :]
+        assert (build_dir / ("pkg-pruned" + path)).read_text() == contents
+    assert manifest["removed_size"] > 0
+
+    entry = json.loads((build_dir / "packages.json").read_text())["packages"]["pkg"]
+    assert entry["pruned"]
+    assert entry["format"] == "zip"
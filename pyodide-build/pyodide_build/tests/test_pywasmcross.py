@@ -2,6 +2,11 @@ from pathlib import Path
 import sys
 import argparse
 from dataclasses import dataclass
+import json
+import os
+import shutil
+import subprocess
+import threading
 
 import pytest
 
@@ -10,6 +15,7 @@ sys.path.append(str(Path(__file__).parents[2]))
 from pyodide_build.pywasmcross import handle_command  # noqa: E402
 from pyodide_build.pywasmcross import f2c  # noqa: E402
 from pyodide_build.pywasmcross import make_parser
+from pyodide_build import pywasmcross
 
 
 @dataclass
@@ -22,6 +28,11 @@ class BuildArgs:
     host: str = ""
     replace_libs: str = ""
     install_dir: str = ""
+    jobs: int = 1
+    build_log_cache: str = ""
+    object_cache: str = ""
+    f2c_cache: str = ""
+    trace_file: str = ""
 
 
 def _args_wrapper(func):
@@ -107,6 +118,30 @@ def test_handle_command_optflags(in_ext, out_ext, executable, flag_name):
     )
 
 
+def test_rewrite_rules():
+    args = BuildArgs(cflags="-O2", replace_libs="bob=fred;**/jim=;fred=eve")
+    rules = pywasmcross.RewriteRules(args)
+    commands = [
+        "gcc -O3 -I/usr/include -Iinclude -c a.c -o a.o",
+        "gcc -O3 -I/usr/include -Iinclude -c b.c -o b.o",
+        "gcc -shared a.o b.o -lbob -lbob -lx/jim -o test.so",
+    ]
+    translated = [
+        " ".join(handle_command(line.split(), args, dryrun=True, rules=rules))
+        for line in commands
+    ]
+    assert translated == [
+        "emcc -O2 -Iinclude -c a.c -o a.o",
+        "emcc -O2 -Iinclude -c b.c -o b.o",
+        "emcc a.o b.o -leve -lx/jim -o test.so",
+    ]
+    # The rules are the same as the ones built for each command
+    for line, expected in zip(commands, translated):
+        assert handle_command_wrap(line, args) == expected
+    # The arguments shared by commands are translated once
+    assert rules.translate_arg.cache_info().hits >= 6
+
+
 def test_f2c():
     assert f2c_wrap("gfortran test.f") == "gfortran test.c"
     assert f2c_wrap("gcc test.c") is None
@@ -140,3 +175,270 @@ def test_environment_var_substitution(monkeypatch):
         and args.ldflags == '"-lpyodide_build_dir"'
         and args.replace_libs == "James Ignatius Morrison:Jimmy"
     )
+
+
+def test_build_job_graph():
+    commands = [
+        "gcc -c a.c -o build/a.o",
+        "gcc -c b.c -o ./build/b.o",
+        "ar rcs build/libab.a build/a.o build/b.o",
+        "gcc -c c.c -o build/c.o",
+        "gcc -shared build/c.o -Lbuild -lab -lm -o c.so",
+        "gcc --version",
+        "gcc -c d.c -o build/d.o",
+    ]
+    deps = pywasmcross.build_job_graph([line.split() for line in commands])
+    assert deps == [set(), set(), {0, 1}, set(), {2, 3}, {0, 1, 2, 3, 4}, {5}]
+
+    # an object rewritten while it is read by a previous command
+    commands = [
+        "gcc -c a.c -o a.o",
+        "ar rcs liba.a a.o",
+        "gcc -c a2.c -o a.o",
+        "ar rcs libb.a a.o",
+        "gcc -c b.c -o b.o",
+        "gcc -shared b.o -L. -la -o b.so",
+        "ar rcs liba.a a.o",
+    ]
+    deps = pywasmcross.build_job_graph([line.split() for line in commands])
+    assert deps == [set(), {0}, {0, 1}, {2}, set(), {1, 4}, {1, 2, 5}]
+
+
+@pytest.mark.parametrize("jobs", [1, 4])
+def test_replay_compile_parallel(jobs, tmpdir, monkeypatch):
+    commands = [["gcc", "-c", f"{name}.c", "-o", f"{name}.o"] for name in "abcdef"] + [
+        ["gcc", "-shared", *[f"{name}.o" for name in "abcdef"], "-o", "lib.so"]
+    ]
+    monkeypatch.chdir(tmpdir)
+    with open("build.log", "w") as fd:
+        for line in commands:
+            fd.write(json.dumps(line) + "\n")
+
+    lock = threading.Lock()
+    replayed = []
+
+    def handle_command(line, args, **kwargs):
+        with lock:
+            replayed.append(line[-1])
+
+    monkeypatch.setattr(pywasmcross, "handle_command", handle_command)
+    pywasmcross.replay_compile(BuildArgs(jobs=jobs))
+
+    assert sorted(replayed[:-1]) == [f"{name}.o" for name in "abcdef"]
+    assert replayed[-1] == "lib.so"
+
+
+def test_replay_compile_error(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    with open("build.log", "w") as fd:
+        fd.write(json.dumps(["gcc", "-c", "a.c", "-o", "a.o"]) + "\n")
+        fd.write(json.dumps(["gcc", "a.o", "-o", "a.so"]) + "\n")
+
+    replayed = []
+
+    def handle_command(line, args, **kwargs):
+        replayed.append(line[-1])
+        sys.exit(1)
+
+    monkeypatch.setattr(pywasmcross, "handle_command", handle_command)
+    with pytest.raises(SystemExit):
+        pywasmcross.replay_compile(BuildArgs(jobs=4))
+    assert replayed == ["a.o"]
+
+
+def test_build_log_cache(tmpdir, monkeypatch):
+    cache_dir = Path(tmpdir) / "cache"
+    srcdir = Path(tmpdir) / "src"
+    srcdir.mkdir()
+    (srcdir / "module.c").write_text("int x;")
+    monkeypatch.chdir(srcdir)
+    monkeypatch.setenv("SKIP_HOST", "")
+
+    n_captures = 0
+
+    def capture_compile(args):
+        nonlocal n_captures
+        n_captures += 1
+        Path("build").mkdir()
+        Path("build/module.o").write_text("")
+        Path("build/generated.c").write_text("int y;")
+        cmd = ["gcc", "-c", str(srcdir / "module.c"), "-o", "build/module.o"]
+        Path("build.log").write_text(json.dumps(cmd) + "\n")
+
+    replayed = []
+    monkeypatch.setattr(pywasmcross, "capture_compile", capture_compile)
+    monkeypatch.setattr(pywasmcross, "install_for_distribution", lambda args: None)
+    monkeypatch.setattr(
+        pywasmcross,
+        "handle_command",
+        lambda line, args, **kwargs: replayed.append(line),
+    )
+
+    args = BuildArgs(build_log_cache=str(cache_dir))
+    pywasmcross.build_wrap(args)
+    assert n_captures == 1
+    (entry,) = cache_dir.iterdir()
+    assert str(srcdir) not in (entry / "build.log").read_text()
+
+    # A fresh copy of the same sources reuses the captured build
+    shutil.rmtree("build")
+    Path("build.log").unlink()
+    pywasmcross.build_wrap(args)
+    assert n_captures == 1
+    assert Path("build/generated.c").read_text() == "int y;"
+    assert not Path("build/module.o").exists()
+    assert replayed[0] == replayed[1]
+    assert replayed[1][2] == str(srcdir / "module.c")
+
+    # Changed sources are captured again
+    shutil.rmtree("build")
+    Path("build.log").unlink()
+    (srcdir / "module.c").write_text("int z;")
+    pywasmcross.build_wrap(args)
+    assert n_captures == 2
+
+
+@pytest.mark.skipif(shutil.which("cc") is None, reason="requires a C compiler")
+def test_compiler_shim(tmpdir, monkeypatch):
+    toolsdir = Path(tmpdir) / "tools"
+    hostdir = Path(tmpdir) / "host"
+    workdir = Path(tmpdir) / "work"
+    for path in [toolsdir, hostdir, workdir]:
+        path.mkdir()
+    # A native "ar" which records its arguments
+    (hostdir / "ar").write_text('#!/bin/sh\necho "$@" > ar.out\n')
+    (hostdir / "ar").chmod(0o755)
+    host_path = f"{hostdir}:{os.environ['PATH']}"
+    shim = pywasmcross.build_compiler_shim(toolsdir, host_path)
+    assert shim is not None
+    assert pywasmcross.build_compiler_shim(toolsdir, host_path) == shim
+    for name in ["gcc", "ar"]:
+        (toolsdir / name).symlink_to(shim)
+
+    monkeypatch.chdir(workdir)
+    env = dict(os.environ, PYWASMCROSS_HOST_PATH=host_path, SKIP_HOST="")
+    env.pop("PYWASMCROSS_CCACHE", None)
+    args = [
+        b"-c",
+        'quote " backslash \\ tab \t'.encode(),
+        "caf\u00e9 \U0001f600".encode(),
+        b"invalid \xff",
+        b"-o",
+        b"module.o",
+    ]
+    subprocess.run([toolsdir / "gcc", *args], env=env, check=True)
+    subprocess.run([toolsdir / "ar", b"rcs", b"lib.a"], env=env, check=True)
+
+    # The build log is the one written by collect_args
+    expected = ""
+    for cmd in [[b"gcc", *args], [b"ar", b"rcs", b"lib.a"]]:
+        expected += json.dumps([os.fsdecode(arg) for arg in cmd]) + "\n"
+    assert Path("build.log").read_text() == expected
+    # gcc is skipped, and ar delegated to the native one
+    assert Path("module.o").read_bytes() == b""
+    assert Path("ar.out").read_text() == "rcs lib.a\n"
+
+
+def test_object_cache(tmpdir, monkeypatch):
+    bindir = Path(tmpdir) / "bin"
+    srcdir = Path(tmpdir) / "src"
+    bindir.mkdir()
+    srcdir.mkdir()
+    # A fake emcc which "preprocesses" by printing the source, and records its
+    # compilations
+    (bindir / "emcc").write_text(
+        "#!/bin/sh\n"
+        'if [ "$1" = --version ]; then echo emcc 1.0; exit; fi\n'
+        'for arg; do [ "$arg" = -E ] && exec cat "$1"; done\n'
+        'echo "$2" >> compiled.txt\n'
+        'cat "$2" > "$4"\n'
+    )
+    (bindir / "emcc").chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bindir}:{os.environ['PATH']}")
+    monkeypatch.chdir(srcdir)
+    (srcdir / "a.c").write_text("int a;")
+    (srcdir / "b.c").write_text("int b;")
+    commands = [
+        ["gcc", "-c", "a.c", "-o", "a.o"],
+        ["gcc", "-c", "b.c", "-o", "b.o"],
+    ]
+    cache_path = Path(tmpdir) / "cache"
+
+    def replay():
+        object_cache = pywasmcross.ObjectCache(cache_path)
+        for line in commands:
+            handle_command(line, BuildArgs(), object_cache=object_cache)
+        object_cache.prune()
+        compiled = Path("compiled.txt")
+        result = compiled.read_text().split() if compiled.exists() else []
+        if compiled.exists():
+            compiled.unlink()
+        return result
+
+    assert replay() == ["a.c", "b.c"]
+    assert len(list(cache_path.iterdir())) == 2
+
+    # Unchanged sources are copied from the cache
+    Path("a.o").unlink()
+    Path("b.o").unlink()
+    assert replay() == []
+    assert Path("a.o").read_text() == "int a;"
+
+    # Changed sources are compiled, and the stale objects removed
+    (srcdir / "b.c").write_text("int c;")
+    assert replay() == ["b.c"]
+    assert Path("b.o").read_text() == "int c;"
+    assert len(list(cache_path.iterdir())) == 2
+
+
+def test_translate_fortran_sources(tmpdir, monkeypatch):
+    cache_dir = Path(tmpdir) / "cache"
+    srcdir = Path(tmpdir) / "src"
+    srcdir.mkdir()
+    for name in ["a", "b"]:
+        (srcdir / f"{name}.f").write_text(f"      CALL DGEMM_{name.upper()}\n")
+
+    translated = []
+
+    def check_call(cmd, cwd):
+        # Fake f2c
+        translated.append(cmd[1])
+        fortran_file = Path(cwd) / cmd[1]
+        fortran_file.with_suffix(".c").write_text("dgemm_(); /* translated */\n")
+
+    monkeypatch.setattr(pywasmcross.subprocess, "check_call", check_call)
+    monkeypatch.chdir(srcdir)
+    commands = [
+        ["gfortran", "-c", "a.f", "-o", "a.o"],
+        ["gfortran", "-c", "b.f", "-o", "b.o"],
+        ["gfortran", "-c", "/tmp/conftest.f", "-o", "/tmp/conftest.o"],
+        ["gcc", "-c", "c.c", "-o", "c.o"],
+    ]
+    pywasmcross.translate_fortran_sources(commands, 1, cache_dir)
+    assert translated == ["a.f", "b.f"]
+    assert (srcdir / "a.c").read_text() == "wdgemm_(); /* translated */\n"
+
+    (srcdir / "a.c").unlink()
+    (srcdir / "b.f").write_text("      CALL SGEMM\n")
+    pywasmcross.translate_fortran_sources(commands, 1, cache_dir)
+    # a.f is restored from the cache, only the modified b.f is translated
+    assert translated == ["a.f", "b.f", "b.f"]
+    assert (srcdir / "a.c").read_text() == "wdgemm_(); /* translated */\n"
+
+
+def test_handle_command_translated_fortran(monkeypatch):
+    def check_call(*args, **kwargs):
+        raise AssertionError("f2c should not run")
+
+    commands = []
+
+    def run(cmd):
+        commands.append(cmd)
+        return subprocess.CompletedProcess(cmd, 0)
+
+    monkeypatch.setattr(pywasmcross.subprocess, "check_call", check_call)
+    monkeypatch.setattr(pywasmcross.subprocess, "run", run)
+    handle_command(
+        ["gfortran", "-c", "test.f", "-o", "test.o"], BuildArgs(), run_f2c=False
+    )
+    assert commands == [["emcc", "-c", "test.c", "-o", "test.o"]]
@@ -0,0 +1,112 @@
+import gzip
+import http.client
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).parents[2]))
+
+from pyodide_build import serve  # noqa: E402
+
+
+@pytest.fixture
+def server(tmp_path):
+    (tmp_path / "pkg.data").write_bytes(bytes(range(256)) * 4)
+    (tmp_path / "pkg.js").write_text("console.log(1);")
+    (tmp_path / "pkg.js.gz").write_bytes(gzip.compress(b"console.log(1);"))
+    (tmp_path / "module.wasm").write_bytes(b"\0asm\1\0\0\0")
+    (tmp_path / "shared-0123456789abcdef.zip").write_bytes(b"PK")
+    httpd = serve.server(0, tmp_path)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield http.client.HTTPConnection("127.0.0.1", httpd.server_address[1])
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def request(conn, path, method="GET", **headers):
+    conn.request(method, path, headers=headers)
+    response = conn.getresponse()
+    return response, response.read()
+
+
+def test_serve_content(server):
+    response, body = request(server, "/module.wasm")
+    assert response.status == 200
+    assert response.headers["Content-Type"] == "application/wasm"
+    assert response.headers["Access-Control-Allow-Origin"] == "*"
+    assert response.headers["Cache-Control"] == serve.DEFAULT_CACHE_CONTROL
+    assert body == b"\0asm\1\0\0\0"
+
+    response, body = request(server, "/shared-0123456789abcdef.zip")
+    assert response.headers["Cache-Control"] == serve.IMMUTABLE_CACHE_CONTROL
+
+    # the connection is kept alive
+    response, body = request(server, "/missing.js")
+    assert response.status == 404
+    response, body = request(server, "/pkg.data", method="HEAD")
+    assert response.headers["Content-Length"] == "1024"
+    assert body == b""
+    response, body = request(server, "/pkg.data")
+    assert len(body) == 1024
+
+
+def test_serve_precompressed(server):
+    response, body = request(server, "/pkg.js", **{"Accept-Encoding": "br, gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    # the type of the uncompressed file
+    assert response.headers["Content-Type"].endswith("/javascript")
+    assert response.headers["Vary"] == "Accept-Encoding"
+    assert gzip.decompress(body) == b"console.log(1);"
+
+    response, body = request(server, "/pkg.js", **{"Accept-Encoding": "gzip;q=0"})
+    assert "Content-Encoding" not in response.headers
+    assert response.headers["Vary"] == "Accept-Encoding"
+    assert body == b"console.log(1);"
+
+    response, body = request(server, "/pkg.data", **{"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in response.headers
+    assert "Vary" not in response.headers
+
+
+def test_serve_etag(server):
+    response, body = request(server, "/pkg.data")
+    etag = response.headers["ETag"]
+    response, body = request(server, "/pkg.data", **{"If-None-Match": etag})
+    assert response.status == 304
+    assert response.headers["ETag"] == etag
+    assert body == b""
+    response, body = request(server, "/pkg.data", **{"If-None-Match": '"other"'})
+    assert response.status == 200
+
+    # the compressed and uncompressed copies have different tags
+    response, body = request(server, "/pkg.js", **{"Accept-Encoding": "gzip"})
+    response2, body = request(server, "/pkg.js")
+    assert response.headers["ETag"] != response2.headers["ETag"]
+
+
+def test_serve_range(server):
+    data = bytes(range(256)) * 4
+    response, body = request(server, "/pkg.data", Range="bytes=10-19")
+    assert response.status == 206
+    assert response.headers["Content-Range"] == "bytes 10-19/1024"
+    assert body == data[10:20]
+
+    response, body = request(server, "/pkg.data", Range="bytes=-24")
+    assert response.status == 206
+    assert body == data[-24:]
+
+    response, body = request(server, "/pkg.data", Range="bytes=2000-")
+    assert response.status == 416
+    assert response.headers["Content-Range"] == "bytes */1024"
+
+    # the whole file is sent when the file changed since the client's copy
+    response, body = request(
+        server, "/pkg.data", Range="bytes=0-9", **{"If-Range": '"other"'}
+    )
+    assert response.status == 200
+    assert body == data
@@ -147,6 +147,124 @@ function recursiveDependencies(
   return toLoad;
 }
 
+// Directory in which the archives of zip packages are stored. Their Python
+// modules are extracted from there when they are first imported.
+const ZIP_PACKAGES_DIR = "/lib/pyodide-packages";
+
+/**
+ * Fetch a file next to pyodide.js.
+ * @param {string} url
+ * @returns {Promise<Uint8Array>}
+ * @private
+ */
+async function fetchBinary(url) {
+  if (IN_NODE) {
+    const fsPromises = await import("fs/promises");
+    return new Uint8Array(await fsPromises.readFile(url));
+  }
+  const response = await fetch(url);
+  if (!response.ok) {
+    throw new Error(`Failed to fetch ${url}: ${response.status}`);
+  }
+  return new Uint8Array(await response.arrayBuffer());
+}
+
+/**
+ * Run the preload plugins on files written to the file system, so that the
+ * shared libraries among them are compiled asynchronously and can be loaded
+ * synchronously when imported.
+ * @param {string[]} paths
+ * @private
+ */
+function runPreloadPlugins(paths) {
+  return Promise.all(
+    paths.map((path) => {
+      const plugin = Module.preloadPlugins.find((p) => p.canHandle(path));
+      if (plugin === undefined) {
+        return;
+      }
+      return new Promise((resolve, reject) =>
+        plugin.handle(Module.FS.readFile(path), path, resolve, reject)
+      );
+    })
+  );
+}
+
+/**
+ * Fetch a package built with ``--package-format=zip`` and mount it. All files
+ * except the Python modules are extracted right away, and the extracted
+ * shared libraries are compiled asynchronously so that they can be loaded
+ * synchronously when imported.
+ * @param {string} pkgname
+ * @private
+ */
+async function loadZipPackage(pkgname) {
+  const buffer = await fetchBinary(`${baseURL}${pkgname}.zip`);
+  const zipPath = `${ZIP_PACKAGES_DIR}/${pkgname}.zip`;
+  Module.FS.mkdirTree(ZIP_PACKAGES_DIR);
+  Module.FS.writeFile(zipPath, buffer);
+
+  const sharedLibsProxy = Module.pyodide_py._mount_zip_package(zipPath);
+  let sharedLibs;
+  try {
+    sharedLibs = sharedLibsProxy.toJs();
+  } finally {
+    sharedLibsProxy.destroy();
+  }
+  await runPreloadPlugins(sharedLibs);
+}
+
+// Map from the hash of a file shared by several packages (see ``buildall
+// --deduplicate``) to the promise of its contents, so that it is only
+// fetched once.
+const sharedFiles = new Map();
+
+/**
+ * Write the files of a package which are stored in the shared bundles.
+ * @param {Object<string, string>} files Map from paths to hashes
+ * @private
+ */
+async function loadSharedFiles(files) {
+  const paths = Object.keys(files);
+  await Promise.all(
+    paths.map(async (path) => {
+      const hash = files[path];
+      if (!sharedFiles.has(hash)) {
+        sharedFiles.set(hash, fetchBinary(`${baseURL}shared/${hash}`));
+      }
+      const contents = await sharedFiles.get(hash);
+      Module.FS.mkdirTree(path.substring(0, path.lastIndexOf("/")));
+      Module.FS.writeFile(path, contents);
+    })
+  );
+  await runPreloadPlugins(paths);
+}
+
+/**
+ * Register the files removed from a package by ``pyodide-build prune
+ * bundle``, so that they are fetched when they are imported or opened.
+ * @param {string} pkgname
+ * @private
+ */
+async function registerPrunedFiles(pkgname) {
+  const url = `${baseURL}${pkgname}.pruned.json`;
+  let manifest;
+  if (IN_NODE) {
+    const fsPromises = await import("fs/promises");
+    manifest = JSON.parse(await fsPromises.readFile(url, "utf8"));
+  } else {
+    const response = await fetch(url);
+    if (!response.ok) {
+      throw new Error(`Failed to fetch ${url}: ${response.status}`);
+    }
+    manifest = await response.json();
+  }
+  Module.pyodide_py._register_pruned_files(
+    `${baseURL}${pkgname}-pruned`,
+    JSON.stringify(manifest.removed)
+  );
+}
+
 async function _loadPackage(names, messageCallback, errorCallback) {
   // toLoad is a map pkg_name => pkg_uri
   let toLoad = recursiveDependencies(names, messageCallback, errorCallback);
@@ -194,6 +312,31 @@ async function _loadPackage(names, messageCallback, errorCallback) {
       }
     }
     let pkgname = (Module.packages[pkg] && Module.packages[pkg].name) || pkg;
+    if (uri === DEFAULT_CHANNEL && Module.packages[pkg].shared_files) {
+      scriptPromises.push(
+        loadSharedFiles(Module.packages[pkg].shared_files).catch((e) => {
+          errorCallback(`Couldn't load the shared files of ${pkg}`, e);
+          toLoad.delete(pkg);
+        })
+      );
+    }
+    if (uri === DEFAULT_CHANNEL && Module.packages[pkg].pruned) {
+      scriptPromises.push(
+        registerPrunedFiles(pkgname).catch((e) => {
+          errorCallback(`Couldn't load the pruned files of ${pkg}`, e);
+        })
+      );
+    }
+    if (uri === DEFAULT_CHANNEL && Module.packages[pkg].format === "zip") {
+      messageCallback(`Loading ${pkg} from ${baseURL}${pkgname}.zip`);
+      scriptPromises.push(
+        loadZipPackage(pkgname).catch((e) => {
+          errorCallback(`Couldn't load package ${pkg}`, e);
+          toLoad.delete(pkg);
+        })
+      );
+      continue;
+    }
     let scriptSrc = uri === DEFAULT_CHANNEL ? `${baseURL}${pkgname}.js` : uri;
     messageCallback(`Loading ${pkg} from ${scriptSrc}`);
     scriptPromises.push(
@@ -1,6 +1,15 @@
 from importlib.abc import MetaPathFinder, Loader
-from importlib.util import spec_from_loader
+from importlib.machinery import EXTENSION_SUFFIXES
+from importlib.util import (
+    cache_from_source,
+    source_from_cache,
+    spec_from_file_location,
+    spec_from_loader,
+)
+import os
 import sys
+from typing import Any, Callable, Dict, List, Set, Tuple
+import zipfile
 
 
 class JsFinder(MetaPathFinder):
@@ -108,3 +117,270 @@ def register_js_finder():
     JsProxy = _pyodide_core.JsProxy
     sys.meta_path.append(jsfinder)  # type: ignore
     return jsfinder
+
+
+class DeferredFilesFinder(MetaPathFinder):
+    """Base class of the finders of package files which are not in the file
+    system until they are needed.
+
+    Subclasses find the deferred modules which are imported, and an audit
+    hook materializes the deferred files which are opened, or listed with
+    ``os.listdir`` or ``os.scandir``. Directories listed by the import
+    system are skipped: the path based finder lists them to find modules,
+    and the deferred ones are found by this finder instead. ``os.stat`` (and
+    so ``os.path.exists``) raises no audit event, so deferred files are
+    missing for it until they are materialized.
+    """
+
+    def __init__(self):
+        self._audit_hook_installed = False
+
+    def _deferred_files(self) -> Dict[str, Any]:
+        """The deferred files, by absolute path"""
+        raise NotImplementedError
+
+    def _materialize(self, path: str) -> bool:
+        """Write a deferred file, and return whether the path was deferred"""
+        raise NotImplementedError
+
+    def _install_audit_hook(self):
+        if not self._audit_hook_installed:
+            sys.addaudithook(self._audit_hook)
+            self._audit_hook_installed = True
+
+    def _audit_hook(self, event, args):
+        if event not in ("open", "os.listdir", "os.scandir"):
+            return
+        if not self._deferred_files():
+            return
+        path = "." if args[0] is None else args[0]
+        if not isinstance(path, (str, os.PathLike)):
+            return
+        path = os.fspath(path)
+        if not isinstance(path, str):
+            return
+        path = os.path.abspath(path)
+        if event != "open":
+            if not sys._getframe(1).f_code.co_filename.startswith("<frozen importlib"):
+                self._materialize_directory(path)
+            return
+        try:
+            if self._materialize(path):
+                self._invalidate_caches(os.path.dirname(path))
+        except Exception:
+            # e.g. a network error: the file stays deferred, and is missing
+            # for the operation
+            pass
+
+    def _materialize_directory(self, directory: str):
+        """Materialize the deferred entries of a directory. Deferred
+        subdirectories are created, with their __init__.py file"""
+        prefix = os.path.join(directory, "")
+        children = {
+            path[len(prefix) :].split(os.sep, 1)[0]
+            for path in self._deferred_files()
+            if path.startswith(prefix)
+        }
+        if not children:
+            return
+        for child in children:
+            path = prefix + child
+            # as when opening a file, errors leave the entry deferred
+            try:
+                if not self._materialize(path):
+                    os.makedirs(path, exist_ok=True)
+                    self._materialize(os.path.join(path, "__init__.py"))
+            except Exception:
+                pass
+        self._invalidate_caches(directory)
+
+    @staticmethod
+    def _invalidate_caches(directory: str):
+        """Make the path based finder list a directory again, after files
+        were added to it outside of the import system"""
+        invalidate_caches = getattr(
+            sys.path_importer_cache.get(directory), "invalidate_caches", None
+        )
+        if invalidate_caches is not None:
+            invalidate_caches()
+
+
+class ZipPackageFinder(DeferredFilesFinder):
+    """Import Python modules of packages distributed as zip files.
+
+    When a package is mounted, all of its files are extracted except the
+    Python modules (``.py`` files, or ``.pyc`` files without sources) and
+    their cached bytecode, which are only extracted when they are imported
+    for the first time. Package ``__init__`` files and all directories are
+    extracted right away, so that the path based finder sees the same packages as if the
+    whole archive was extracted. This finder comes after it in
+    ``sys.meta_path``, and is only asked for modules that are not extracted
+    yet. Modules which are opened or listed, e.g. by linecache or
+    pkgutil.iter_modules, are extracted as well, see DeferredFilesFinder.
+    """
+
+    def __init__(self):
+        super().__init__()
+        # Path of a module that is not extracted yet -> archive and member name
+        self.pending: Dict[str, Tuple[zipfile.ZipFile, str]] = {}
+
+    def mount(self, zip_path: str, target: str = "/") -> List[str]:
+        """Mount a package archive.
+
+        Parameters
+        ----------
+        zip_path : str
+            Path of the zip file. It must be kept until the modules of the
+            package are imported.
+
+        target : str
+            Directory in which the archive is extracted.
+
+        Returns
+        -------
+        The paths of the extracted shared libraries, which need to be loaded
+        before they are imported.
+        """
+        archive = zipfile.ZipFile(zip_path)
+        shared_libs = []
+        for info in archive.infolist():
+            path = os.path.normpath(os.path.join(target, info.filename))
+            if info.is_dir():
+                os.makedirs(path, exist_ok=True)
+                continue
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if self._is_lazy(path):
+                self.pending[path] = (archive, info.filename)
+                continue
+            archive.extract(info, target)
+            if path.endswith(".so"):
+                shared_libs.append(path)
+        if self not in sys.meta_path:
+            sys.meta_path.append(self)
+        self._install_audit_hook()
+        return shared_libs
+
+    @staticmethod
+    def _is_lazy(path: str) -> bool:
+        """Whether a file is only extracted when its module is imported"""
+        if os.path.basename(os.path.dirname(path)) == "__pycache__":
+            try:
+                path = source_from_cache(path)
+            except ValueError:
+                # bytecode for another Python version
+                return False
+        stem, ext = os.path.splitext(os.path.basename(path))
+        return ext in (".py", ".pyc") and stem != "__init__"
+
+    def _deferred_files(self) -> Dict[str, Tuple[zipfile.ZipFile, str]]:
+        return self.pending
+
+    def _materialize(self, path: str) -> bool:
+        if path not in self.pending:
+            return False
+        archive, member = self.pending.pop(path)
+        with open(path, "wb") as fd:
+            fd.write(archive.read(member))
+        return True
+
+    def find_spec(self, fullname, path, target=None):
+        name = fullname.rpartition(".")[2]
+        for entry in sys.path if path is None else path:
+            module_path = os.path.normpath(os.path.join(entry or os.getcwd(), name))
+            if self._materialize(module_path + ".py"):
+                self._materialize(cache_from_source(module_path + ".py"))
+                return spec_from_file_location(fullname, module_path + ".py")
+            if self._materialize(module_path + ".pyc"):
+                return spec_from_file_location(fullname, module_path + ".pyc")
+        return None
+
+
+zip_package_finder: ZipPackageFinder = ZipPackageFinder()
+
+
+class PrunedFilesFinder(DeferredFilesFinder):
+    """Fetch the files removed from pruned packages when they are needed.
+
+    ``pyodide-build prune bundle`` removes the files that were not used by a
+    set of scripts from package bundles, and puts them next to the bundle so
+    that they can be fetched one by one. This finder comes after the path
+    based finder in ``sys.meta_path``, and fetches the modules which are not
+    found because they were removed. Other removed files are fetched when
+    they are opened or listed, see DeferredFilesFinder.
+    """
+
+    def __init__(self):
+        super().__init__()
+        # Path of a removed file -> URL from which it can be fetched
+        self.files: Dict[str, str] = {}
+        self.fetch: Callable[[str], bytes]
+        # Files being fetched, which are opened to be written
+        self._restoring: Set[str] = set()
+
+    def register(self, base_url: str, paths: List[str], fetch: Callable[[str], bytes]):
+        """Register the files removed from a package.
+
+        Parameters
+        ----------
+        base_url : str
+            URL of the directory containing the removed files, with the same
+            layout as the root of the file system.
+
+        paths : List[str]
+            Absolute paths of the removed files.
+
+        fetch : Callable[[str], bytes]
+            Function fetching the contents of a URL synchronously.
+        """
+        self.fetch = fetch
+        for path in paths:
+            self.files[path] = base_url.rstrip("/") + path
+        if self not in sys.meta_path:
+            sys.meta_path.append(self)
+        self._install_audit_hook()
+
+    def _deferred_files(self) -> Dict[str, str]:
+        return self.files
+
+    def _materialize(self, path: str) -> bool:
+        url = self.files.get(path)
+        if url is None or path in self._restoring:
+            return False
+        self._restoring.add(path)
+        try:
+            data = self.fetch(url)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as fd:
+                fd.write(data)
+        finally:
+            self._restoring.discard(path)
+        # Only unregistered once fetched, so that failed fetches are retried
+        del self.files[path]
+        return True
+
+    def _restore(self, fullname: str, path: str) -> bool:
+        try:
+            return self._materialize(path)
+        except Exception as e:
+            raise ImportError(
+                f"Failed to fetch {path} of the pruned module {fullname}",
+                name=fullname,
+                path=path,
+            ) from e
+
+    def find_spec(self, fullname, path, target=None):
+        name = fullname.rpartition(".")[2]
+        for entry in sys.path if path is None else path:
+            base = os.path.normpath(os.path.join(entry or os.getcwd(), name))
+            init = os.path.join(base, "__init__.py")
+            if self._restore(fullname, init):
+                return spec_from_file_location(
+                    fullname, init, submodule_search_locations=[base]
+                )
+            for suffix in [".py", ".pyc"] + EXTENSION_SUFFIXES:
+                if self._restore(fullname, base + suffix):
+                    return spec_from_file_location(fullname, base + suffix)
+        return None
+
+
+pruned_files_finder: PrunedFilesFinder = PrunedFilesFinder()
@@ -19,13 +19,15 @@ from _pyodide._base import (
     CodeRunner,
     should_quiet,
 )
-from ._util import open_url
+from ._util import open_url, _register_pruned_files  # noqa: F401
 from . import _state  # noqa
 
-from _pyodide._importhook import jsfinder
+from _pyodide._importhook import jsfinder, zip_package_finder
 
 register_js_module = jsfinder.register_js_module
 unregister_js_module = jsfinder.unregister_js_module
+# Called by loadPackage for packages built with --package-format=zip
+_mount_zip_package = zip_package_finder.mount
 
 if IN_BROWSER:
     import asyncio
@@ -1,4 +1,7 @@
 from io import StringIO
+import json
+
+from _pyodide._importhook import pruned_files_finder
 
 try:
     from js import XMLHttpRequest
@@ -25,3 +28,25 @@ def open_url(url: str) -> StringIO:
     req.open("GET", url, False)
     req.send(None)
     return StringIO(req.response)
+
+
+# Synchronous requests can't have a binary response type on the main thread.
+# With this charset, bytes >= 0x80 are decoded to the characters 0xF780-0xF7FF.
+_X_USER_DEFINED_CHARSET = "text/plain; charset=x-user-defined"
+_X_USER_DEFINED_TABLE = {0xF700 + byte: byte for byte in range(0x80, 0x100)}
+
+
+def _fetch_bytes(url: str) -> bytes:
+    """Fetch a binary file synchronously"""
+    req = XMLHttpRequest.new()
+    req.open("GET", url, False)
+    req.overrideMimeType(_X_USER_DEFINED_CHARSET)
+    req.send(None)
+    if req.status != 200:
+        raise OSError(f"Failed to fetch {url}: {req.status} {req.statusText}")
+    return req.response.translate(_X_USER_DEFINED_TABLE).encode("latin-1")
+
+
+def _register_pruned_files(base_url: str, paths_json: str):
+    """Called by loadPackage for packages pruned by pyodide-build prune"""
+    pruned_files_finder.register(base_url, json.loads(paths_json), _fetch_bytes)
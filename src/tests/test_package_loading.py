@@ -1,7 +1,16 @@
+import os
 import pytest
 import shutil
+import py_compile
+import sys
+import zipfile
+from importlib.util import cache_from_source
 from pathlib import Path
 
+sys.path.append(str(Path(__file__).resolve().parents[2] / "src" / "py"))
+
+from _pyodide._importhook import PrunedFilesFinder, ZipPackageFinder  # noqa: E402
+
 
 @pytest.mark.parametrize("active_server", ["main", "secondary"])
 def test_load_from_url(selenium_standalone, web_server_secondary, active_server):
@@ -196,3 +205,147 @@ def test_load_package_mixed_case(selenium_standalone, jinja2):
         `)
         """
     )
+
+
+def test_zip_package_finder(tmpdir, monkeypatch):
+    site_packages = "lib/python3.9/site-packages"
+    zip_path = Path(tmpdir) / "pkg.zip"
+    with zipfile.ZipFile(zip_path, "w") as zf:
+        zf.writestr(f"{site_packages}/zippkg/__init__.py", "from . import a\n")
+        zf.writestr(f"{site_packages}/zippkg/a.py", "x = 1\n")
+        zf.writestr(f"{site_packages}/zippkg/b.py", "y = 2\n")
+        zf.writestr(f"{site_packages}/zippkg/d.py", "w = 4\n")
+        zf.writestr(f"{site_packages}/zippkg/plugins/p1.py", "")
+        zf.writestr(f"{site_packages}/zippkg/plugins/p2.py", "")
+        zf.writestr(f"{site_packages}/zippkg/data.txt", "data")
+        zf.writestr(f"{site_packages}/zippkg/_ext.so", "wasm")
+        # a module without sources, and the bytecode of a.py
+        source = Path(tmpdir) / "source.py"
+        for code, name in [
+            ("z = 3\n", "c.pyc"),
+            ("x = 1\n", cache_from_source("a.py")),
+        ]:
+            source.write_text(code)
+            pyc = py_compile.compile(
+                str(source),
+                invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH,
+            )
+            zf.write(pyc, f"{site_packages}/zippkg/{name}")
+
+    target = Path(tmpdir) / "root"
+    pkgdir = target / site_packages / "zippkg"
+    monkeypatch.syspath_prepend(str(target / site_packages))
+    finder = ZipPackageFinder()
+    monkeypatch.setattr(sys, "meta_path", list(sys.meta_path))
+    for name in ["zippkg", "zippkg.a", "zippkg.b", "zippkg.c", "zippkg.d"]:
+        monkeypatch.delitem(sys.modules, name, raising=False)
+
+    assert finder.mount(str(zip_path), str(target)) == [str(pkgdir / "_ext.so")]
+    assert finder in sys.meta_path
+    assert (pkgdir / "data.txt").read_text() == "data"
+    assert not (pkgdir / "a.py").exists()
+
+    import zippkg
+
+    assert zippkg.a.x == 1
+    assert (pkgdir / "a.py").exists()
+    assert Path(zippkg.a.__cached__).exists()
+    # modules which are not imported are not extracted
+    assert not (pkgdir / "b.py").exists()
+
+    from zippkg import b
+
+    assert b.y == 2
+
+    from zippkg import c
+
+    assert c.z == 3
+
+    # modules are extracted when they are opened, e.g. by linecache
+    assert (pkgdir / "d.py").read_text() == "w = 4\n"
+    from zippkg import d
+
+    assert d.w == 4
+    # or listed, e.g. to discover plugins
+    assert sorted(os.listdir(pkgdir / "plugins")) == ["p1.py", "p2.py"]
+    assert finder.pending == {}
+
+
+def test_pruned_files_finder(tmpdir, monkeypatch):
+    site_packages = Path(tmpdir) / "lib" / "python3.9" / "site-packages"
+    (site_packages / "prunedpkg").mkdir(parents=True)
+    (site_packages / "prunedpkg" / "__init__.py").write_text("")
+    removed = {
+        "prunedpkg/extra.py": b"x = 1\n",
+        "prunedpkg/data.txt": b"data",
+        "prunedpkg/sub/__init__.py": b"",
+        "prunedpkg/sub/mod.py": b"y = 2\n",
+        "otherpkg/__init__.py": b"z = 3\n",
+    }
+    server = {
+        f"https://example.com/pruned{site_packages}/{path}": data
+        for path, data in removed.items()
+    }
+    fetched = []
+
+    def fetch(url):
+        fetched.append(url)
+        return server[url]
+
+    monkeypatch.syspath_prepend(str(site_packages))
+    monkeypatch.setattr(sys, "meta_path", list(sys.meta_path))
+    for name in [
+        "prunedpkg",
+        "prunedpkg.extra",
+        "prunedpkg.sub",
+        "prunedpkg.sub.mod",
+        "otherpkg",
+    ]:
+        monkeypatch.delitem(sys.modules, name, raising=False)
+
+    finder = PrunedFilesFinder()
+    finder.register(
+        "https://example.com/pruned/",
+        [str(site_packages / path) for path in removed],
+        fetch,
+    )
+    assert finder in sys.meta_path
+
+    from prunedpkg import extra
+    from prunedpkg.sub import mod
+    import otherpkg
+
+    assert (extra.x, mod.y, otherpkg.z) == (1, 2, 3)
+    assert (site_packages / "prunedpkg" / "data.txt").read_bytes() == b"data"
+    assert len(fetched) == 5
+    assert finder.files == {}
+
+    # failed fetches are retried
+    failing = {"prunedpkg/flaky.txt", "prunedpkg/broken.py"}
+
+    def flaky_fetch(url):
+        path = url.split(str(site_packages) + "/")[1]
+        if path in failing:
+            failing.remove(path)
+            raise OSError(f"Failed to fetch {url}")
+        return b"x = 4\n"
+
+    later = ["flaky.txt", "broken.py", "res/a.txt", "res/deep/b.txt"]
+    finder.register(
+        "https://example.com/pruned/",
+        [str(site_packages / "prunedpkg" / path) for path in later],
+        flaky_fetch,
+    )
+    monkeypatch.delitem(sys.modules, "prunedpkg.broken", raising=False)
+    with pytest.raises(FileNotFoundError):
+        open(site_packages / "prunedpkg" / "flaky.txt")
+    assert (site_packages / "prunedpkg" / "flaky.txt").read_bytes() == b"x = 4\n"
+    with pytest.raises(ImportError, match="Failed to fetch"):
+        import prunedpkg.broken  # noqa: F401
+    from prunedpkg import broken
+
+    assert broken.x == 4
+
+    # listed directories are restored, without fetching their subdirectories
+    assert sorted(os.listdir(site_packages / "prunedpkg" / "res")) == ["a.txt", "deep"]
+    assert list(finder.files) == [str(site_packages / "prunedpkg/res/deep/b.txt")]
@@ -3,9 +3,16 @@
 EM_DIR=`dirname $(which emcc.py)`
 FILENAME=$1
 shift
+# Packages compiled to bytecode keep their __pycache__ directories
+if [ -z "$PYODIDE_PACKAGE_PYCACHE" ]; then
+    set -- --exclude '*__pycache__*' "$@"
+fi
+# Compressed with LZ4 unless the package selects another compression, which
+# is applied by buildpkg to the whole bundle
+if [ -z "$PYODIDE_PACKAGE_COMPRESSION" ] || [ "$PYODIDE_PACKAGE_COMPRESSION" = "lz4" ]; then
+    set -- --lz4 "$@"
+fi
 $EM_DIR/tools/file_packager.py $FILENAME \
-    --lz4 \
     --export-name=globalThis.__pyodide_module \
-    --exclude *__pycache__* \
     --use-preload-plugins \
-    $@
+    "$@"